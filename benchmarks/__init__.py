@@ -0,0 +1 @@
+"""CPU benchmarks, run from the repository root as `python -m benchmarks.<name>`."""
@@ -0,0 +1,118 @@
+"""
+Measures the per-step overhead of the entropy-adaptive mode (`adaptive_top_k`) against the base
+processor, on CPU and without downloading anything.
+
+Each variant is driven with synthetic `input_ids` and `scores` over a sweep of batch sizes and
+vocab sizes: the base `IncrementalThinkingEffortProcessor`, the adaptive one, and, as a
+reference for what the top-k estimate avoids, a processor that computes the full-vocabulary
+softmax entropy every step. The llama-cpp closure is measured the same way on one sequence
+(its calls are per sequence). The median per-step latency and the overhead over the base
+processor are reported.
+
+Usage:
+    python -m benchmarks.adaptive_overhead
+    python -m benchmarks.adaptive_overhead --batch-sizes 1 64 --vocab-sizes 32000 152064 --top-k 20
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+import torch
+
+from thinking_effort import IncrementalThinkingEffortProcessor, thinking_effort_processor
+
+# The end token is never sampled, so every step pays the full "still thinking" cost
+END_THINKING_TOKEN_ID = 7
+
+
+class FullEntropyProcessor(IncrementalThinkingEffortProcessor):
+    """The base processor plus a full-vocabulary softmax entropy per step (reference only)."""
+
+    def process(self, input_ids, scores):
+        probs = scores.float().softmax(dim=-1)
+        self.full_entropy = torch.special.entr(probs).sum(dim=-1)
+        return super().process(input_ids, scores)
+
+
+def torch_variants(top_k):
+    return {
+        "base": lambda: IncrementalThinkingEffortProcessor(END_THINKING_TOKEN_ID, thinking_effort=0.5),
+        f"adaptive top-{top_k}": lambda: IncrementalThinkingEffortProcessor(
+            END_THINKING_TOKEN_ID, thinking_effort=0.5, adaptive_top_k=top_k
+        ),
+        "full softmax entropy": lambda: FullEntropyProcessor(END_THINKING_TOKEN_ID, thinking_effort=0.5),
+    }
+
+
+def numpy_variants(top_k):
+    return {
+        "base": lambda: thinking_effort_processor(0.5, END_THINKING_TOKEN_ID),
+        f"adaptive top-{top_k}": lambda: thinking_effort_processor(0.5, END_THINKING_TOKEN_ID, adaptive_top_k=top_k),
+    }
+
+
+def bench_torch(make_processor, batch_size, vocab_size, args):
+    """Returns the median per-step latency (seconds) of a Transformers processor."""
+    generator = torch.Generator().manual_seed(0)
+    total_steps = args.warmup + args.steps
+    buffer = torch.randint(8, vocab_size, (batch_size, args.seq_length + total_steps), generator=generator)
+    scores = torch.randn(batch_size, vocab_size, generator=generator)
+    processor = make_processor()
+    latencies = []
+    for step in range(total_steps):
+        start = time.perf_counter()
+        processor(buffer[:, : args.seq_length + step], scores)
+        if step >= args.warmup:
+            latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies)
+
+
+def bench_numpy(make_processor, vocab_size, args):
+    """Returns the median per-step latency (seconds) of the llama-cpp closure on one sequence."""
+    rng = np.random.default_rng(0)
+    total_steps = args.warmup + args.steps
+    buffer = rng.integers(8, vocab_size, size=args.seq_length + total_steps, dtype=np.intc)
+    logits = rng.standard_normal(vocab_size, dtype=np.float32)
+    processor = make_processor()
+    latencies = []
+    for step in range(total_steps):
+        start = time.perf_counter()
+        processor(buffer[: args.seq_length + step], logits)
+        if step >= args.warmup:
+            latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--vocab-sizes", type=int, nargs="+", default=[32000, 152064])
+    parser.add_argument("--seq-length", type=int, default=1024)
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'backend':<10}{'batch':>6}{'vocab':>8}  {'variant':<22}{'median us':>11}{'overhead us':>13}")
+    for vocab_size in args.vocab_sizes:
+        for batch_size in args.batch_sizes:
+            base = None
+            for name, make_processor in torch_variants(args.top_k).items():
+                latency = bench_torch(make_processor, batch_size, vocab_size, args)
+                base = latency if base is None else base
+                print(
+                    f"{'torch':<10}{batch_size:>6}{vocab_size:>8}  {name:<22}{latency * 1e6:>11.1f}"
+                    f"{(latency - base) * 1e6:>+13.1f}"
+                )
+        base = None
+        for name, make_processor in numpy_variants(args.top_k).items():
+            latency = bench_numpy(make_processor, vocab_size, args)
+            base = latency if base is None else base
+            print(
+                f"{'llama-cpp':<10}{1:>6}{vocab_size:>8}  {name:<22}{latency * 1e6:>11.1f}{(latency - base) * 1e6:>+13.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Compares answer-phase tokens/sec of `generate_with_answer_lookup` with prompt-lookup decoding
+against plain decoding of the same answer phase.
+
+Both runs share the thinking phase (same processor, greedy decoding), so only the part after the
+end-of-thinking marker differs. Without `--model`, a tiny randomly initialized causal LM with a
+byte-level tokenizer is used, which needs no download; its answers are mostly repetition, so
+expect an optimistic speedup. Pass a Hugging Face model ID for realistic numbers.
+
+Usage:
+    python -m benchmarks.answer_phase_lookup
+    python -m benchmarks.answer_phase_lookup --model deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B --thinking-effort 0.2
+"""
+import argparse
+
+import torch
+
+from thinking_effort import (
+    ByteTokenizer,
+    IncrementalThinkingEffortProcessor,
+    build_tiny_random_model,
+    generate_with_answer_lookup,
+)
+
+PROMPT = "Write a Python function that checks whether a string is a palindrome, then explain it."
+
+
+def load(args):
+    if args.model is None:
+        tokenizer = ByteTokenizer()
+        return build_tiny_random_model(tokenizer.vocab_size), tokenizer
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype="auto")
+    return model, tokenizer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="Hugging Face model ID (default: tiny random model)")
+    parser.add_argument("--thinking-effort", type=float, default=0.0)
+    parser.add_argument("--scale-factor", type=float, default=4)
+    parser.add_argument("--max-new-tokens", type=int, default=256)
+    parser.add_argument("--prompt-lookup-num-tokens", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    model, tokenizer = load(args)
+    messages = [{"role": "user", "content": PROMPT}]
+    input_ids = torch.tensor([tokenizer.apply_chat_template(messages, add_generation_prompt=True)])
+    if input_ids.dim() == 3:
+        input_ids = input_ids[0]
+    end_thinking_token_id = tokenizer.convert_tokens_to_ids("</think>")
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    generate_kwargs = {"do_sample": False, "pad_token_id": pad_token_id}
+
+    print(f"{'answer phase':<20}{'tokens':>10}{'seconds':>10}{'tokens/sec':>12}")
+    for name, lookup in [("plain", None), ("prompt lookup", args.prompt_lookup_num_tokens)]:
+        tokens, seconds = 0, 0.0
+        for _ in range(args.repeats):
+            processor = IncrementalThinkingEffortProcessor(
+                end_thinking_token_id, thinking_effort=args.thinking_effort, scale_factor=args.scale_factor
+            )
+            output = generate_with_answer_lookup(
+                model,
+                input_ids,
+                processor,
+                max_new_tokens=args.max_new_tokens,
+                prompt_lookup_num_tokens=lookup,
+                thinking_kwargs=generate_kwargs,
+                answer_kwargs=generate_kwargs,
+            )
+            tokens += output.answer_tokens
+            seconds += output.answer_seconds
+        print(f"{name:<20}{tokens:>10}{seconds:>10.2f}{tokens / seconds if seconds else 0.0:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Measures the cold-start import time of the `thinking_effort` package and checks that the heavy
+backends stay lazy.
+
+Each repeat runs a fresh interpreter that imports the package, touches the core names (the
+controller, the splitters, the schedules) and reports the elapsed time together with which of
+torch, transformers and NumPy ended up in `sys.modules`. Accessing a backend name afterwards
+must then import that backend, and only that one. The bare interpreter start-up is measured the
+same way and subtracted.
+
+Usage:
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --repeats 20 --max-ms 50   # exits with 1 above 50 ms
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["torch", "transformers", "numpy"]
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+STATEMENTS = {
+    "baseline": "pass",
+    "import thinking_effort": (
+        "import thinking_effort\n"
+        "thinking_effort.ThinkingEffortController, thinking_effort.ThinkingSplitter, thinking_effort.scheduled_effort"
+    ),
+}
+
+# Backend name to access after the import, and the heavy modules it may load (torch imports NumPy)
+BACKEND_CHECKS = {
+    "thinking_effort_processor": ["numpy"],
+    "IncrementalThinkingEffortProcessor": ["torch", "transformers", "numpy"],
+}
+
+
+def run_child(statement):
+    code = CHILD.format(statement=statement, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, capture_output=True, text=True)
+    return json.loads(output.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, help="Fail if the median import time exceeds this")
+    parser.add_argument("--skip-backends", action="store_true", help="Skip the backend import checks")
+    args = parser.parse_args()
+
+    medians = {}
+    failures = []
+    print(f"{'statement':<36}{'median ms':>11}{'min ms':>10}  loaded")
+    for name, statement in STATEMENTS.items():
+        results = [run_child(statement) for _ in range(args.repeats)]
+        times = [result["seconds"] * 1000 for result in results]
+        loaded = sorted({module for result in results for module in result["loaded"]})
+        medians[name] = statistics.median(times)
+        print(f"{name:<36}{medians[name]:>11.2f}{min(times):>10.2f}  {', '.join(loaded) or '-'}")
+        if name != "baseline" and loaded:
+            failures.append(f"`{name}` imported {', '.join(loaded)}")
+
+    if not args.skip_backends:
+        for attribute, expected in BACKEND_CHECKS.items():
+            try:
+                result = run_child(f"import thinking_effort\nthinking_effort.{attribute}")
+            except subprocess.CalledProcessError as error:
+                print(f"{attribute:<36}{'skipped':>11}  ({error.stderr.strip().splitlines()[-1]})")
+                continue
+            loaded = result["loaded"]
+            print(f"{attribute:<36}{result['seconds'] * 1000:>11.2f}{'':>10}  {', '.join(loaded)}")
+            unexpected = sorted(set(loaded) - set(expected))
+            if unexpected:
+                failures.append(f"`thinking_effort.{attribute}` also imported {', '.join(unexpected)}")
+
+    package_ms = medians["import thinking_effort"] - medians["baseline"]
+    print(f"\npackage import: {package_ms:.2f} ms")
+    if args.max_ms is not None and package_ms > args.max_ms:
+        failures.append(f"package import took {package_ms:.2f} ms (limit {args.max_ms:g} ms)")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Compares the batched NumPy processor (`batched_thinking_effort_processor`) with one
+`thinking_effort_processor` closure per sequence, on CPU and without downloading anything.
+
+Both are driven with the same synthetic `(n_seq, vocab_size)` logits and token streams over a
+sweep of sequence counts and vocab sizes, with per-sequence efforts and budgets; every step the
+outputs are checked to be identical. The median per-step latency of each and the speedup are
+reported. With `--threads`, the threaded `ThinkingEffortProcessorFactory` is also exercised on a
+fake model that runs the processors and checks that no two requests overlap on one model.
+
+Usage:
+    python -m benchmarks.llamacpp_batched
+    python -m benchmarks.llamacpp_batched --num-seqs 1 8 64 --vocab-sizes 152064 --threads 16
+"""
+import argparse
+import statistics
+import threading
+import time
+
+import numpy as np
+
+from thinking_effort import ThinkingEffortProcessorFactory, batched_thinking_effort_processor, thinking_effort_processor
+
+END_THINKING_TOKEN_ID = 7
+
+
+def row_settings(num_seqs, steps):
+    """Per-sequence efforts, and budgets that force some sequences to end mid-run."""
+    efforts = [0.25 + 1.25 * row / max(num_seqs - 1, 1) for row in range(num_seqs)]
+    budgets = [steps // 2 if row % 4 == 3 else None for row in range(num_seqs)]
+    return efforts, budgets
+
+
+def bench(num_seqs, vocab_size, args):
+    """Returns the median per-step latencies (seconds) of the closures and the batched processor."""
+    rng = np.random.default_rng(0)
+    total_steps = args.warmup + args.steps
+    efforts, budgets = row_settings(num_seqs, total_steps)
+    closures = [
+        thinking_effort_processor(effort, END_THINKING_TOKEN_ID, max_thinking_tokens=budget)
+        for effort, budget in zip(efforts, budgets)
+    ]
+    batched = batched_thinking_effort_processor(efforts, END_THINKING_TOKEN_ID, max_thinking_tokens=budgets)
+    # The end token is never sampled, so every sequence keeps paying the "still thinking" cost
+    buffer = rng.integers(8, vocab_size, size=(num_seqs, args.seq_length + total_steps), dtype=np.intc)
+    scores = rng.standard_normal((num_seqs, vocab_size), dtype=np.float32)
+    closure_latencies = []
+    batched_latencies = []
+    for step in range(total_steps):
+        input_ids = buffer[:, : args.seq_length + step]
+        expected = scores.copy()
+        logits = scores.copy()
+        start = time.perf_counter()
+        for row, closure in enumerate(closures):
+            closure(input_ids[row], expected[row])
+        middle = time.perf_counter()
+        batched(input_ids, logits)
+        end = time.perf_counter()
+        if not np.array_equal(expected, logits):
+            raise AssertionError(f"Batched output differs from the closures at step {step}")
+        if step >= args.warmup:
+            closure_latencies.append(middle - start)
+            batched_latencies.append(end - middle)
+    return statistics.median(closure_latencies), statistics.median(batched_latencies)
+
+
+class FakeLlama:
+    """Runs the logits processors like `Llama.create_completion` and records overlapping calls."""
+
+    def __init__(self, vocab_size):
+        self.vocab_size = vocab_size
+        self.active = 0
+        self.overlaps = 0
+        self.completions = 0
+
+    def create_completion(self, prompt, logits_processor=None, max_tokens=16, **kwargs):
+        self.active += 1
+        self.overlaps += self.active > 1
+        rng = np.random.default_rng(len(prompt))
+        input_ids = list(prompt)
+        for _ in range(max_tokens):
+            logits = rng.standard_normal(self.vocab_size, dtype=np.float32)
+            for processor in logits_processor:
+                logits = processor(np.array(input_ids, dtype=np.intc), logits)
+            input_ids.append(int(np.argmax(logits)))
+            # Give the other threads a chance to interleave
+            time.sleep(0)
+        self.active -= 1
+        self.completions += 1
+        return {"choices": [{"text": "", "tokens": input_ids[len(prompt) :]}]}
+
+
+def bench_factory(args):
+    """Runs `--requests` completions from `--threads` threads over two fake models."""
+    factory = ThinkingEffortProcessorFactory(END_THINKING_TOKEN_ID, thinking_effort=0.5)
+    models = [FakeLlama(32000), FakeLlama(32000)]
+
+    def worker(index):
+        for request in range(index, args.requests, args.threads):
+            factory.create_completion(
+                models[request % len(models)],
+                [1, 2, 3, request],
+                processor_kwargs={"thinking_effort": (request % 5) / 4},
+                max_tokens=16,
+            )
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    completions = sum(model.completions for model in models)
+    overlaps = sum(model.overlaps for model in models)
+    print(f"\nfactory: {completions} completions from {args.threads} threads in {elapsed:.2f} s, {overlaps} overlaps")
+    if completions != args.requests or overlaps:
+        raise AssertionError("The factory let requests overlap on one model or lost some")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-seqs", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--vocab-sizes", type=int, nargs="+", default=[32000, 152064])
+    parser.add_argument("--seq-length", type=int, default=1024)
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"{'n_seq':>6}{'vocab':>8}{'closures us':>13}{'batched us':>12}{'speedup':>9}")
+    for vocab_size in args.vocab_sizes:
+        for num_seqs in args.num_seqs:
+            closures, batched = bench(num_seqs, vocab_size, args)
+            print(f"{num_seqs:>6}{vocab_size:>8}{closures * 1e6:>13.1f}{batched * 1e6:>12.1f}{closures / batched:>8.1f}x")
+    if args.threads:
+        bench_factory(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Compares llama-cpp-python generation speed with the Python logits-processor closure, with the
+`logit_bias` argument of `create_completion` (which llama-cpp-python turns into a Python logits
+processor that copies the scores every token) and with `create_completion_with_effort_bias`,
+which applies the effort as a logit-bias stage of llama.cpp's sampler chain.
+
+Tokens are counted from the completions' `usage`; every run starts from an empty KV cache.
+
+Usage:
+    python -m benchmarks.llamacpp_logit_bias --model path/to/qwq_model.gguf --thinking-effort 0.0 --scale-factor 4
+"""
+import argparse
+import time
+
+from llama_cpp import Llama
+from thinking_effort import create_completion_with_effort_bias, effort_to_logit_bias, thinking_effort_processor
+
+PROMPT = """<|im_start|>user
+What is the capital of France?
+<|im_end|>
+<|im_start|>assistant
+<think>
+"""
+
+
+def run(complete):
+    # Returns (generated tokens, seconds) for one completion
+    start = time.perf_counter()
+    usage = complete()
+    return usage["completion_tokens"], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", required=True, help="Path to a GGUF model")
+    parser.add_argument("--end-thinking-token-id", type=int, default=151668, help="</think> token id (QwQ default)")
+    parser.add_argument("--thinking-effort", type=float, default=0.0)
+    parser.add_argument("--scale-factor", type=float, default=4)
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--n-ctx", type=int, default=4096)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    llm = Llama(model_path=args.model, n_ctx=args.n_ctx, verbose=False)
+    sampling = {"max_tokens": args.max_tokens, "temperature": 0.6, "seed": args.seed}
+
+    def completion(**kwargs):
+        return llm.create_completion(PROMPT, **sampling, **kwargs)["usage"]
+
+    def sampler_stage():
+        for chunk in create_completion_with_effort_bias(
+            llm, PROMPT, args.thinking_effort, args.end_thinking_token_id, scale_factor=args.scale_factor, **sampling
+        ):
+            pass
+        return chunk["usage"]
+
+    # A fixed bias, as `logit_bias` cannot follow the logit; only its cost is of interest here
+    fixed_bias = effort_to_logit_bias(args.thinking_effort, 10.0, args.scale_factor)
+    modes = {
+        "no processor": completion,
+        "python closure": lambda: completion(
+            logits_processor=[
+                thinking_effort_processor(args.thinking_effort, args.end_thinking_token_id, args.scale_factor)
+            ]
+        ),
+        "logit_bias argument": lambda: completion(logit_bias={args.end_thinking_token_id: fixed_bias}),
+        "sampler-chain stage": sampler_stage,
+    }
+
+    print(f"{'mode':<22}{'tokens':>10}{'seconds':>10}{'tokens/sec':>12}")
+    for name, complete in modes.items():
+        total_tokens, total_seconds = 0, 0.0
+        for _ in range(args.runs):
+            llm.reset()
+            tokens, seconds = run(complete)
+            total_tokens += tokens
+            total_seconds += seconds
+        print(f"{name:<22}{total_tokens:>10}{total_seconds:>10.2f}{total_tokens / total_seconds:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Measures the per-turn time-to-first-token of a multi-turn thinking chat with and without KV
+cache reuse, on CPU and without downloading anything.
+
+A 20-turn synthetic conversation runs on a tiny randomly initialized causal LM with a byte-level
+tokenizer and a Qwen-style chat template, through `ThinkingChatSession`: once keeping the KV cache
+across turns (only the previous answer and the new message are prefilled) and once re-ingesting
+the whole answer-only conversation every turn. Greedy decoding is used, so both runs must
+generate the same tokens; the table reports, per turn, the prompt length, the prefilled tokens
+and the time-to-first-token of each run.
+
+Usage:
+    python -m benchmarks.multiturn_ttft
+    python -m benchmarks.multiturn_ttft --turns 20 --message-length 400 --hidden-size 512 --layers 8
+"""
+import argparse
+import sys
+
+from thinking_effort import ByteTokenizer, ThinkingChatSession, build_tiny_random_model
+
+WORDS = "the ball bounces inside a rotating hexagon while gravity and friction slow it down".split()
+
+
+def user_message(turn, length):
+    """A deterministic user message of about `length` characters."""
+    words = [WORDS[(turn * 7 + index) % len(WORDS)] for index in range(length // 5 + 1)]
+    return f"Turn {turn}: " + " ".join(words)[:length]
+
+
+def run(model, tokenizer, reuse_cache, args):
+    session = ThinkingChatSession(
+        model,
+        tokenizer,
+        tokenizer.convert_tokens_to_ids("</think>"),
+        thinking_effort=args.thinking_effort,
+        reuse_cache=reuse_cache,
+        processor_kwargs={"max_thinking_tokens": args.max_thinking_tokens},
+        max_new_tokens=args.max_new_tokens,
+        do_sample=False,
+    )
+    for turn in range(args.turns):
+        session.send(user_message(turn, args.message_length))
+    return session.turns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--message-length", type=int, default=200, help="Characters per user message")
+    parser.add_argument("--max-new-tokens", type=int, default=48)
+    parser.add_argument("--max-thinking-tokens", type=int, default=24)
+    parser.add_argument("--thinking-effort", type=float, default=0.5)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    args = parser.parse_args()
+
+    tokenizer = ByteTokenizer()
+    model = build_tiny_random_model(
+        vocab_size=tokenizer.vocab_size,
+        hidden_size=args.hidden_size,
+        intermediate_size=4 * args.hidden_size,
+        num_hidden_layers=args.layers,
+        max_position_embeddings=16384,
+    )
+    # Warm-up, so the first measured turn does not pay for lazy initialization
+    run(model, tokenizer, True, argparse.Namespace(**{**vars(args), "turns": 2}))
+
+    warm = run(model, tokenizer, True, args)
+    cold = run(model, tokenizer, False, args)
+
+    print(f"{'turn':>4}{'prompt':>8}{'prefilled':>11}{'ttft ms':>9}{'re-ingest ms':>14}{'speedup':>9}  boundary")
+    for index, (cached, full) in enumerate(zip(warm, cold)):
+        print(
+            f"{index + 1:>4}{cached.prompt_tokens:>8}{cached.prefilled_tokens:>11}"
+            f"{cached.time_to_first_token * 1e3:>9.1f}{full.time_to_first_token * 1e3:>14.1f}"
+            f"{full.time_to_first_token / cached.time_to_first_token:>8.1f}x  {cached.thinking_end}"
+        )
+    warm_total = sum(turn.time_to_first_token for turn in warm)
+    cold_total = sum(turn.time_to_first_token for turn in cold)
+    print(f"\ntotal time-to-first-token: {warm_total:.3f} s with cache reuse, {cold_total:.3f} s re-ingesting")
+    print(
+        f"prefilled tokens: {sum(turn.prefilled_tokens for turn in warm)} with cache reuse, "
+        f"{sum(turn.prefilled_tokens for turn in cold)} re-ingesting"
+    )
+    if [turn.generated_ids for turn in warm] != [turn.generated_ids for turn in cold]:
+        print("FAIL: cache reuse changed the generated tokens")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
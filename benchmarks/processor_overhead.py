@@ -0,0 +1,262 @@
+"""
+Measures the per-step cost of the thinking effort processors on CPU, without downloading anything.
+
+Every processor is driven with synthetic `input_ids` and `scores` (torch tensors for the
+Transformers processors, NumPy arrays for the llama-cpp closure). Starting from a base point,
+the batch size, sequence length and vocab size are swept one at a time, and the median/p90
+latency per generation step and the peak memory allocated during a step are reported, which
+gives one scaling curve per dimension. The peak is measured the same way for both backends: the
+highest amount of memory held during the step above what was held before it, averaged over the
+steps (from the torch profiler's allocation events for torch, from tracemalloc for NumPy).
+
+With `--e2e`, a tiny randomly initialized causal LM is also run through `model.generate` with
+and without each Transformers processor to compare end-to-end tokens/sec.
+
+Usage:
+    python -m benchmarks.processor_overhead
+    python -m benchmarks.processor_overhead --batch-sizes 1 16 256 --seq-lengths 1024 131072 --e2e
+    python -m benchmarks.processor_overhead --output overhead.jsonl
+"""
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+
+import numpy as np
+import torch
+
+from thinking_effort import (
+    IncrementalThinkingEffortProcessor,
+    ThinkingEffortProcessor,
+    build_tiny_random_model,
+    thinking_effort_processor,
+)
+
+TORCH_PROCESSORS = {
+    "ThinkingEffortProcessor": ThinkingEffortProcessor,
+    "IncrementalThinkingEffortProcessor": IncrementalThinkingEffortProcessor,
+}
+NUMPY_PROCESSORS = {
+    "thinking_effort_processor": thinking_effort_processor,
+}
+# The end token is never sampled, so every step pays the full "still thinking" cost
+END_THINKING_TOKEN_ID = 7
+
+
+def _summarize(latencies, peaks):
+    latencies = sorted(latencies)
+    return {
+        "median_us": statistics.median(latencies) * 1e6,
+        "p90_us": latencies[int(0.9 * (len(latencies) - 1))] * 1e6,
+        "peak_alloc_bytes": statistics.mean(peaks),
+    }
+
+
+def _torch_step_peak(step_fn):
+    """
+    Returns the peak memory held during `step_fn()` above what was held before it.
+
+    The profiler attributes each allocation to the operator that made it, while frees outside
+    an operator appear as "[memory]" events, so the running sum of the leaf events' own memory
+    changes, in time order, follows the memory held.
+    """
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True) as profiler:
+        step_fn()
+    events = [event for event in profiler.events() if not event.cpu_children and event.self_cpu_memory_usage]
+    held = peak = 0
+    for event in sorted(events, key=lambda event: event.time_range.end):
+        held += event.self_cpu_memory_usage
+        peak = max(peak, held)
+    return peak
+
+
+def _numpy_step_peak(step_fn):
+    """Returns the peak memory traced during `step_fn()` above what was held before it."""
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    step_fn()
+    _, peak = tracemalloc.get_traced_memory()
+    return peak - before
+
+
+def bench_torch_processor(processor_cls, batch_size, seq_length, vocab_size, steps, warmup, thinking_effort):
+    """
+    Returns the per-step latency and peak allocation of a Transformers processor.
+
+    `input_ids` grows by one token per step, as during generation. The tokens live in one
+    preallocated buffer and each step receives a view of it, so the benchmark itself does not
+    allocate.
+    """
+    generator = torch.Generator().manual_seed(0)
+    total_steps = warmup + steps
+    buffer = torch.randint(8, vocab_size, (batch_size, seq_length + total_steps), generator=generator)
+    scores = torch.randn(batch_size, vocab_size, generator=generator)
+    processor = processor_cls(END_THINKING_TOKEN_ID, thinking_effort=thinking_effort, scale_factor=2)
+
+    latencies = []
+    for step in range(total_steps):
+        input_ids = buffer[:, : seq_length + step]
+        start = time.perf_counter()
+        processor(input_ids, scores)
+        elapsed = time.perf_counter() - start
+        if step >= warmup:
+            latencies.append(elapsed)
+
+    # Allocations are measured in a separate pass so profiling does not skew the latencies
+    processor = processor_cls(END_THINKING_TOKEN_ID, thinking_effort=thinking_effort, scale_factor=2)
+    processor(buffer[:, :seq_length], scores)
+    peaks = [
+        _torch_step_peak(lambda: processor(buffer[:, : seq_length + step], scores)) for step in range(1, steps + 1)
+    ]
+
+    return _summarize(latencies, peaks)
+
+
+def bench_numpy_processor(processor_fn, batch_size, seq_length, vocab_size, steps, warmup, thinking_effort):
+    """
+    Returns the per-step latency and peak allocation of the llama-cpp closure.
+
+    The closure handles one sequence, so a batch is served by `batch_size` closures and one
+    step is the time to run all of them.
+    """
+    rng = np.random.default_rng(0)
+    total_steps = warmup + steps
+    buffer = rng.integers(8, vocab_size, size=(batch_size, seq_length + total_steps), dtype=np.intc)
+    logits = rng.standard_normal((batch_size, vocab_size), dtype=np.float32)
+
+    def run(processors, step):
+        for row, processor in enumerate(processors):
+            processor(buffer[row, : seq_length + step], logits[row])
+
+    processors = [processor_fn(thinking_effort, END_THINKING_TOKEN_ID, 2) for _ in range(batch_size)]
+    latencies = []
+    for step in range(total_steps):
+        start = time.perf_counter()
+        run(processors, step)
+        elapsed = time.perf_counter() - start
+        if step >= warmup:
+            latencies.append(elapsed)
+
+    processors = [processor_fn(thinking_effort, END_THINKING_TOKEN_ID, 2) for _ in range(batch_size)]
+    run(processors, 0)
+    tracemalloc.start()
+    try:
+        peaks = [_numpy_step_peak(lambda: run(processors, step)) for step in range(1, steps + 1)]
+    finally:
+        tracemalloc.stop()
+
+    return _summarize(latencies, peaks)
+
+
+def sweep_points(args):
+    """Yields (dimension, batch_size, seq_length, vocab_size): one sweep per dimension around the base point."""
+    for batch_size in args.batch_sizes:
+        yield "batch_size", batch_size, args.base_seq_length, args.base_vocab_size
+    for seq_length in args.seq_lengths:
+        yield "seq_length", args.base_batch_size, seq_length, args.base_vocab_size
+    for vocab_size in args.vocab_sizes:
+        yield "vocab_size", args.base_batch_size, args.base_seq_length, vocab_size
+
+
+def run_sweeps(args, emit):
+    benches = [(name, bench_torch_processor, cls) for name, cls in TORCH_PROCESSORS.items()]
+    benches += [(name, bench_numpy_processor, fn) for name, fn in NUMPY_PROCESSORS.items()]
+    benches = [bench for bench in benches if not args.processors or bench[0] in args.processors]
+
+    print(f"{'processor':<36}{'sweep':<12}{'batch':>7}{'seq_len':>9}{'vocab':>8}{'median us':>12}{'p90 us':>12}{'peak B/step':>14}")
+    for dimension, batch_size, seq_length, vocab_size in sweep_points(args):
+        for name, bench, target in benches:
+            result = bench(target, batch_size, seq_length, vocab_size, args.steps, args.warmup, args.thinking_effort)
+            print(
+                f"{name:<36}{dimension:<12}{batch_size:>7}{seq_length:>9}{vocab_size:>8}"
+                f"{result['median_us']:>12.1f}{result['p90_us']:>12.1f}{result['peak_alloc_bytes']:>14.0f}"
+            )
+            emit(
+                {
+                    "kind": "step",
+                    "processor": name,
+                    "sweep": dimension,
+                    "batch_size": batch_size,
+                    "seq_length": seq_length,
+                    "vocab_size": vocab_size,
+                    **result,
+                }
+            )
+
+
+def run_e2e(args, emit):
+    model = build_tiny_random_model(args.e2e_vocab_size)
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(8, args.e2e_vocab_size, (args.e2e_batch_size, args.e2e_prompt_length), generator=generator)
+
+    variants = {"no processor": None}
+    for name, cls in TORCH_PROCESSORS.items():
+        if not args.processors or name in args.processors:
+            variants[name] = cls
+
+    print()
+    print(f"{'end-to-end generate':<36}{'tokens':>10}{'seconds':>10}{'tokens/sec':>12}")
+    for name, cls in variants.items():
+        kwargs = {}
+        if cls is not None:
+            kwargs["logits_processor"] = [cls(END_THINKING_TOKEN_ID, thinking_effort=args.thinking_effort)]
+        with torch.no_grad():
+            start = time.perf_counter()
+            output = model.generate(
+                input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                max_new_tokens=args.e2e_new_tokens,
+                min_new_tokens=args.e2e_new_tokens,
+                do_sample=False,
+                pad_token_id=0,
+                **kwargs,
+            )
+            elapsed = time.perf_counter() - start
+        tokens = (output.shape[1] - input_ids.shape[1]) * output.shape[0]
+        print(f"{name:<36}{tokens:>10}{elapsed:>10.2f}{tokens / elapsed:>12.1f}")
+        emit({"kind": "e2e", "processor": name, "tokens": tokens, "seconds": elapsed, "tokens_per_sec": tokens / elapsed})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16, 64, 256])
+    parser.add_argument("--seq-lengths", type=int, nargs="+", default=[1024, 8192, 32768, 131072])
+    parser.add_argument("--vocab-sizes", type=int, nargs="+", default=[32000, 65536, 151936, 262144])
+    parser.add_argument("--base-batch-size", type=int, default=8)
+    parser.add_argument("--base-seq-length", type=int, default=4096)
+    parser.add_argument("--base-vocab-size", type=int, default=151936)
+    parser.add_argument("--steps", type=int, default=20, help="Measured steps per point")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--thinking-effort", type=float, default=0.5)
+    parser.add_argument(
+        "--processors",
+        nargs="+",
+        choices=list(TORCH_PROCESSORS) + list(NUMPY_PROCESSORS),
+        help="Restrict the run to these processors (default: all)",
+    )
+    parser.add_argument("--output", help="Also write every result as a JSON line to this file")
+    parser.add_argument("--e2e", action="store_true", help="Run the end-to-end tokens/sec comparison")
+    parser.add_argument("--e2e-batch-size", type=int, default=4)
+    parser.add_argument("--e2e-prompt-length", type=int, default=64)
+    parser.add_argument("--e2e-new-tokens", type=int, default=128)
+    parser.add_argument("--e2e-vocab-size", type=int, default=32000)
+    args = parser.parse_args()
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else None
+
+    def emit(record):
+        if output is not None:
+            output.write(json.dumps(record) + "\n")
+
+    try:
+        run_sweeps(args, emit)
+        if args.e2e:
+            run_e2e(args, emit)
+    finally:
+        if output is not None:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Measures how many thinking tokens the repetition-loop detector saves on a synthetic looping stream.
+
+A scripted "model" emits a stretch of random reasoning tokens and then falls into a loop that
+repeats one phrase forever. Its end-of-thinking logit stays low, so without help a sequence
+keeps looping for a long time. Each trial samples from these logits through the thinking
+effort processor, with and without repetition detection, and the mean number of thinking
+tokens (and the share spent looping) is reported. The torch processor runs all trials as one
+batch; the llama-cpp closure runs them one by one on NumPy logits.
+
+Usage:
+    python -m benchmarks.repetition_loops
+    python -m benchmarks.repetition_loops --trials 512 --loop-period 40 --ngram-size 6
+"""
+import argparse
+
+import numpy as np
+import torch
+
+from thinking_effort import IncrementalThinkingEffortProcessor, thinking_effort_processor
+
+END_THINKING_TOKEN_ID = 0
+
+
+def scripted_tokens(args, rng):
+    """Returns the token the synthetic model prefers at each step: reasoning, then a loop."""
+    reasoning = rng.integers(1, args.vocab_size, size=args.reasoning_tokens)
+    phrase = rng.integers(1, args.vocab_size, size=args.loop_period)
+    loop = np.tile(phrase, args.max_thinking_tokens // args.loop_period + 1)
+    return np.concatenate([reasoning, loop])[: args.max_thinking_tokens]
+
+
+def synthetic_logits(args, preferred):
+    # The preferred token dominates, the end token keeps a small positive logit
+    logits = np.full((len(preferred), args.vocab_size), -10.0, dtype=np.float32)
+    logits[np.arange(len(preferred)), preferred] = args.token_logit
+    logits[:, END_THINKING_TOKEN_ID] = args.end_logit
+    return logits
+
+
+def detector_kwargs(args, enabled):
+    if not enabled:
+        return {}
+    return {
+        "repetition_ngram_size": args.ngram_size,
+        "repetition_window": args.window,
+        "repetition_threshold": args.threshold,
+        "repetition_boost": args.boost,
+    }
+
+
+def run_torch(args, script, enabled):
+    """Returns the thinking length of every trial, sampled as one batch."""
+    generator = torch.Generator().manual_seed(args.seed)
+    processor = IncrementalThinkingEffortProcessor(
+        END_THINKING_TOKEN_ID, thinking_effort=args.thinking_effort, scale_factor=args.scale_factor,
+        **detector_kwargs(args, enabled),
+    )
+    input_ids = torch.ones((args.trials, 1), dtype=torch.long)
+    lengths = torch.full((args.trials,), args.max_thinking_tokens)
+    for step in range(args.max_thinking_tokens):
+        preferred = np.full(args.trials, script[step])
+        scores = processor(input_ids, torch.from_numpy(synthetic_logits(args, preferred)))
+        tokens = torch.multinomial(scores.softmax(dim=-1), 1, generator=generator)
+        ended = (tokens[:, 0] == END_THINKING_TOKEN_ID) & (lengths == args.max_thinking_tokens)
+        lengths[ended] = step + 1
+        if bool((lengths < args.max_thinking_tokens).all()):
+            break
+        input_ids = torch.cat([input_ids, tokens], dim=-1)
+    return lengths.numpy()
+
+
+def run_llamacpp(args, script, enabled):
+    """Returns the thinking length of every trial, one closure per trial."""
+    rng = np.random.default_rng(args.seed)
+    lengths = []
+    for _ in range(args.trials):
+        processor = thinking_effort_processor(
+            args.thinking_effort, END_THINKING_TOKEN_ID, args.scale_factor, **detector_kwargs(args, enabled)
+        )
+        input_ids = [1]
+        length = args.max_thinking_tokens
+        for step in range(args.max_thinking_tokens):
+            logits = processor(np.array(input_ids, dtype=np.intc), synthetic_logits(args, [script[step]])[0])
+            probs = np.exp(logits - logits.max())
+            token = int(rng.choice(args.vocab_size, p=probs / probs.sum()))
+            if token == END_THINKING_TOKEN_ID:
+                length = step + 1
+                break
+            input_ids.append(token)
+        lengths.append(length)
+    return np.array(lengths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trials", type=int, default=128)
+    parser.add_argument("--vocab-size", type=int, default=1000)
+    parser.add_argument("--reasoning-tokens", type=int, default=300)
+    parser.add_argument("--loop-period", type=int, default=30)
+    parser.add_argument("--max-thinking-tokens", type=int, default=4000)
+    parser.add_argument("--token-logit", type=float, default=8.0)
+    parser.add_argument("--end-logit", type=float, default=2.0)
+    parser.add_argument("--thinking-effort", type=float, default=1.2)
+    parser.add_argument("--scale-factor", type=float, default=2)
+    parser.add_argument("--ngram-size", type=int, default=8)
+    parser.add_argument("--window", type=int, default=256)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--boost", type=float, default=4.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    script = scripted_tokens(args, np.random.default_rng(args.seed))
+    print(f"{'backend':<12}{'detector':<10}{'mean tokens':>13}{'looping tokens':>16}{'saved':>9}")
+    for backend, run in [("torch", run_torch), ("llama-cpp", run_llamacpp)]:
+        baseline = None
+        for enabled in (False, True):
+            lengths = run(args, script, enabled)
+            looping = np.clip(lengths - args.reasoning_tokens, 0, None).mean()
+            mean = lengths.mean()
+            saved = "" if baseline is None else f"{1 - mean / baseline:>8.0%}"
+            baseline = mean if baseline is None else baseline
+            print(f"{backend:<12}{'on' if enabled else 'off':<10}{mean:>13.0f}{looping:>16.0f}{saved:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,8 @@
+# Requires the package and its backend: pip install -e ".[llama_cpp]" from the repository root
 import sys
-import os
-
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 from llama_cpp import Llama
-from thinking_effort_llamacpp_py import thinking_effort_processor
+from thinking_effort import thinking_effort_processor
 
 model_path = "path/to/your/qwq_model.gguf"
 
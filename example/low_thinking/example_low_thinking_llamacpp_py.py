@@ -1,10 +1,6 @@
-import sys
-import os
-
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
-
+# Requires the package and its backend: pip install -e ".[llama_cpp]" from the repository root
 from llama_cpp import Llama
-from thinking_effort_llamacpp_py import thinking_effort_processor
+from thinking_effort import thinking_effort_processor
 
 
 model_path = "path/to/your/model.gguf (end_thinking_token_id was adjusted to QwQ model)"
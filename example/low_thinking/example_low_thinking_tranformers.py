@@ -1,10 +1,6 @@
-import sys
-import os
-
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
-
+# Requires the package and its backend: pip install -e ".[transformers]" from the repository root
 from transformers import AutoModelForCausalLM, AutoTokenizer, LogitsProcessorList
-from thinking_effort_transformers import ThinkingEffortProcessor
+from thinking_effort import ThinkingEffortProcessor
 
 model_name = "deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B"
 tokenizer = AutoTokenizer.from_pretrained(model_name)
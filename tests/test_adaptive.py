@@ -0,0 +1,64 @@
+"""
+Tests of the entropy-adaptive effort: the top-k confidence, its bias-corrected moving average
+and the resulting scale, in the torch processor and the llama-cpp-python closure.
+"""
+import math
+
+import numpy as np
+import pytest
+import torch
+
+from thinking_effort import IncrementalThinkingEffortProcessor, thinking_effort_processor
+from thinking_effort.transformers_backend import _top_k_values
+
+VOCAB_SIZE = 1000
+END_ID = 3
+TOP_K = 5
+SETTINGS = {"adaptive_top_k": TOP_K, "adaptive_smoothing": 0.8, "adaptive_strength": 1.5, "adaptive_pivot": 0.4}
+
+
+def reference_confidence(scores):
+    """One minus the normalized entropy of the softmax over the top-k logits, with a full sort."""
+    probs = scores.double().topk(TOP_K, dim=-1).values.softmax(dim=-1)
+    return 1.0 - (-(probs * probs.log()).sum(dim=-1)) / math.log(TOP_K)
+
+
+@pytest.mark.parametrize("vocab_size", [10, 200, 1000, 1027])
+def test_top_k_values_match_topk(vocab_size):
+    scores = torch.randn(4, vocab_size, generator=torch.Generator().manual_seed(vocab_size))
+    actual = _top_k_values(scores, TOP_K).sort(dim=-1).values
+    torch.testing.assert_close(actual, scores.topk(TOP_K, dim=-1).values.sort(dim=-1).values, rtol=0, atol=0)
+
+
+def test_scale_follows_the_smoothed_confidence():
+    efforts, factor = [0.5, 1.0], 3.0
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(4, 100, (2, 4), generator=generator)
+    processor = IncrementalThinkingEffortProcessor(END_ID, thinking_effort=efforts, scale_factor=factor, **SETTINGS)
+    closures = [thinking_effort_processor(effort, END_ID, factor, **SETTINGS) for effort in efforts]
+    average = torch.zeros(2, dtype=torch.float64)
+    for step in range(8):
+        scores = torch.randn(2, VOCAB_SIZE, generator=generator, dtype=torch.float64)
+        # Row 0 grows more and more confident, row 1 stays uncertain
+        scores[0, 10] += step
+        average = 0.8 * average + 0.2 * reference_confidence(scores)
+        smoothed = average / (1.0 - 0.8 ** (step + 1))
+        actual = processor(input_ids, scores.clone())
+        torch.testing.assert_close(processor.smoothed_confidence().double(), smoothed, rtol=1e-5, atol=1e-6)
+        for row, effort in enumerate(efforts):
+            scale = factor ** (1.0 - effort) * factor ** (1.5 * (float(smoothed[row]) - 0.4))
+            assert math.isclose(float(actual[row, END_ID]), float(scores[row, END_ID]) * scale, rel_tol=1e-5)
+            closure_actual = closures[row](input_ids[row].numpy(), scores[row].numpy().copy())
+            np.testing.assert_allclose(closure_actual, actual[row].numpy(), rtol=1e-5)
+            assert math.isclose(closures[row].confidence(), float(smoothed[row]), rel_tol=1e-5)
+        input_ids = torch.cat([input_ids, torch.randint(4, 100, (2, 1), generator=generator)], dim=-1)
+    confidence = processor.smoothed_confidence()
+    assert confidence[0] > 0.4 > confidence[1]
+
+
+def test_invalid_settings_are_rejected():
+    for kwargs in [{"adaptive_top_k": 1}, {"adaptive_top_k": 5, "adaptive_smoothing": 1.0}]:
+        with pytest.raises(ValueError):
+            IncrementalThinkingEffortProcessor(END_ID, **kwargs)
+        with pytest.raises(ValueError):
+            thinking_effort_processor(1.0, END_ID, **kwargs)
@@ -0,0 +1,95 @@
+"""
+Tests of `generate_with_answer_lookup` on the tiny random model: prompt lookup and per-row cache
+slicing must not change greedy output, and the answer phase must not prefill again.
+"""
+import pytest
+import torch
+
+from thinking_effort import (
+    ByteTokenizer,
+    IncrementalThinkingEffortProcessor,
+    build_tiny_random_model,
+    generate_with_answer_lookup,
+)
+
+PROMPTS = ["hello hello hello world", "abc abc abc abc abc", "x"]
+BUDGETS = [5, 12, 8]
+
+
+@pytest.fixture(scope="module")
+def tiny_model():
+    tokenizer = ByteTokenizer()
+    return build_tiny_random_model(vocab_size=tokenizer.vocab_size), tokenizer
+
+
+def generate(tiny_model, prompts, budgets, prompt_lookup_num_tokens, **answer_kwargs):
+    model, tokenizer = tiny_model
+    ids = [tokenizer.encode(prompt) for prompt in prompts]
+    length = max(len(row) for row in ids)
+    input_ids = torch.tensor([[0] * (length - len(row)) + row for row in ids])
+    attention_mask = torch.tensor([[0] * (length - len(row)) + [1] * len(row) for row in ids])
+    processor = IncrementalThinkingEffortProcessor(
+        tokenizer.convert_tokens_to_ids("</think>"), thinking_effort=0.0, max_thinking_tokens=budgets
+    )
+    return generate_with_answer_lookup(
+        model,
+        input_ids,
+        processor,
+        attention_mask=attention_mask,
+        max_new_tokens=60,
+        prompt_lookup_num_tokens=prompt_lookup_num_tokens,
+        thinking_kwargs={"do_sample": False, "pad_token_id": 0},
+        answer_kwargs={"do_sample": False, "pad_token_id": 0, **answer_kwargs},
+    )
+
+
+def test_prompt_lookup_matches_plain_decoding_on_padded_batch(tiny_model):
+    plain = generate(tiny_model, PROMPTS, BUDGETS, None)
+    lookup = generate(tiny_model, PROMPTS, BUDGETS, 10)
+    assert lookup.thinking_lengths == plain.thinking_lengths
+    assert [row.tolist() for row in lookup.sequences] == [row.tolist() for row in plain.sequences]
+    for row, (prompt, budget) in enumerate(zip(PROMPTS, BUDGETS)):
+        alone = generate(tiny_model, [prompt], budget, 10)
+        assert alone.sequences[0].tolist() == lookup.sequences[row].tolist()
+
+
+def test_generate_fallback_matches_cached_lookup(tiny_model):
+    # An answer argument the cached loop does not handle falls back to `generate`
+    cached = generate(tiny_model, PROMPTS, BUDGETS, 4)
+    fallback = generate(tiny_model, PROMPTS, BUDGETS, 4, repetition_penalty=1.0)
+    assert [row.tolist() for row in fallback.sequences] == [row.tolist() for row in cached.sequences]
+
+
+@pytest.mark.parametrize("answer_kwargs", [{}, {"do_sample": True, "temperature": 0.7, "top_k": 20, "top_p": 0.9}])
+def test_answer_phase_reuses_the_thinking_cache(tiny_model, answer_kwargs):
+    model, _ = tiny_model
+    lengths = []
+
+    def record(module, args, kwargs):
+        lengths.append((kwargs["input_ids"] if "input_ids" in kwargs else args[0]).size(1))
+
+    hook = model.register_forward_pre_hook(record, with_kwargs=True)
+    try:
+        output = generate(tiny_model, PROMPTS[:2], 10, 10, **answer_kwargs)
+    finally:
+        hook.remove()
+    thinking_steps = max(output.thinking_lengths)
+    # One prefill for the batch; the answer phase only feeds the pending token plus a draft
+    assert lengths[0] == max(len(prompt) for prompt in PROMPTS[:2])
+    assert max(lengths[thinking_steps:]) <= 11
+
+
+def test_marker_started_in_a_prompt_shorter_than_the_marker(tiny_model):
+    model, tokenizer = tiny_model
+    # A three-token prompt ending in the middle of a four-token marker, whose last token is forced
+    processor = IncrementalThinkingEffortProcessor(None, end_markers=[tokenizer.encode("abcd")], max_thinking_tokens=0)
+    output = generate_with_answer_lookup(
+        model,
+        torch.tensor([tokenizer.encode("abc")]),
+        processor,
+        max_new_tokens=8,
+        thinking_kwargs={"do_sample": False, "pad_token_id": 0},
+        answer_kwargs={"do_sample": False, "pad_token_id": 0},
+    )
+    assert output.thinking_lengths == [1]
+    assert output.sequences[0][:4].tolist() == tokenizer.encode("abcd")
@@ -0,0 +1,45 @@
+"""
+Tests that the effort processors keep their state across the rollbacks of assisted and
+prompt-lookup decoding: greedy output must be the same with and without them.
+"""
+import pytest
+import torch
+
+from thinking_effort import (
+    ByteTokenizer,
+    IncrementalThinkingEffortProcessor,
+    ThinkingEffortProcessor,
+    build_tiny_random_model,
+)
+
+PROCESSORS = {
+    "rescanning": lambda end: ThinkingEffortProcessor(end, thinking_effort=0.0, scale_factor=40),
+    "incremental": lambda end: IncrementalThinkingEffortProcessor(end, thinking_effort=0.0, scale_factor=40),
+    "budget": lambda end: IncrementalThinkingEffortProcessor(end, thinking_effort=0.5, max_thinking_tokens=7),
+}
+
+
+@pytest.fixture(scope="module")
+def models():
+    tokenizer = ByteTokenizer()
+    target = build_tiny_random_model(vocab_size=tokenizer.vocab_size)
+    draft = build_tiny_random_model(vocab_size=tokenizer.vocab_size, seed=1, num_hidden_layers=1)
+    return target, draft, tokenizer
+
+
+def generate(target, tokenizer, processor, **kwargs):
+    input_ids = torch.tensor([tokenizer.encode("abc abc abc abc abc")])
+    output = target.generate(input_ids, max_new_tokens=40, do_sample=False, logits_processor=[processor], **kwargs)
+    return output[0, input_ids.size(1) :].tolist()
+
+
+@pytest.mark.parametrize("name", PROCESSORS)
+@pytest.mark.parametrize("mode", ["assistant_model", "prompt_lookup_num_tokens"])
+def test_greedy_output_unchanged_by_speculation(models, name, mode):
+    target, draft, tokenizer = models
+    end = tokenizer.convert_tokens_to_ids("</think>")
+    expected = generate(target, tokenizer, PROCESSORS[name](end))
+    # The end token lands mid-sequence, so candidates crossing it get rolled back
+    assert end in expected[1:-1]
+    kwargs = {"assistant_model": draft} if mode == "assistant_model" else {"prompt_lookup_num_tokens": 4}
+    assert generate(target, tokenizer, PROCESSORS[name](end), **kwargs) == expected
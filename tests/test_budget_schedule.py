@@ -0,0 +1,77 @@
+"""
+Tests of the thinking-token budget and the effort schedules, in the torch processor and the
+llama-cpp-python closure: the scale follows the schedule as the budget is spent, and the end
+token is forced once it is exhausted.
+"""
+import math
+
+import numpy as np
+import pytest
+import torch
+
+from thinking_effort import (
+    IncrementalThinkingEffortProcessor,
+    get_effort_schedule,
+    scheduled_effort,
+    thinking_effort_processor,
+)
+
+VOCAB_SIZE = 16
+END_ID = 3
+BUDGET = 8
+
+
+def expected_end_scale(thinking_tokens, schedule, thinking_effort=1.0, final_thinking_effort=0.0, scale_factor=2):
+    progress = min(thinking_tokens / BUDGET, 1.0)
+    effort = scheduled_effort(thinking_effort, final_thinking_effort, progress, get_effort_schedule(schedule))
+    return scale_factor ** (1.0 - effort)
+
+
+@pytest.mark.parametrize("schedule", ["constant", "linear", "quadratic", "cubic", "sqrt", lambda p: p * 0.5])
+def test_scale_follows_the_schedule_and_budget_forces_the_end(schedule):
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(4, VOCAB_SIZE, (1, 5), generator=generator)
+    torch_processor = IncrementalThinkingEffortProcessor(END_ID, max_thinking_tokens=BUDGET, schedule=schedule)
+    closure = thinking_effort_processor(1.0, END_ID, max_thinking_tokens=BUDGET, schedule=schedule)
+    for thinking_tokens in range(BUDGET + 1):
+        scores = torch.rand(1, VOCAB_SIZE, generator=generator) + 1.0
+        actual = torch_processor(input_ids, scores.clone())[0]
+        closure_actual = closure(input_ids[0].numpy(), scores[0].numpy().astype(np.float64).copy())
+        np.testing.assert_allclose(closure_actual, actual.numpy(), rtol=1e-6)
+        assert int(torch_processor.thinking_tokens[0]) == thinking_tokens
+        if thinking_tokens < BUDGET:
+            scale = expected_end_scale(thinking_tokens, schedule)
+            assert math.isclose(float(actual[END_ID]), float(scores[0, END_ID]) * scale, rel_tol=1e-6)
+            assert torch.equal(actual[:END_ID], scores[0, :END_ID])
+        else:
+            # Only the end token is left
+            assert float(actual[END_ID]) == 0.0
+            assert torch.isinf(actual[torch.arange(VOCAB_SIZE) != END_ID]).all()
+        input_ids = torch.cat([input_ids, torch.randint(4, VOCAB_SIZE, (1, 1), generator=generator)], dim=-1)
+
+
+def test_per_row_budgets_only_force_their_own_row():
+    generator = torch.Generator().manual_seed(1)
+    input_ids = torch.randint(4, VOCAB_SIZE, (3, 5), generator=generator)
+    processor = IncrementalThinkingEffortProcessor(END_ID, thinking_effort=0.5, max_thinking_tokens={0: 2, 2: 4})
+    for step in range(6):
+        scores = processor(input_ids, torch.randn(3, VOCAB_SIZE, generator=generator))
+        forced = torch.isinf(scores).any(dim=-1).tolist()
+        assert forced == [step >= 2, False, step == 4]
+        tokens = torch.randint(4, VOCAB_SIZE, (3, 1), generator=generator)
+        if step == 4:
+            # The forced row emits the end token and is then left alone
+            tokens[2, 0] = END_ID
+        input_ids = torch.cat([input_ids, tokens], dim=-1)
+    assert processor.finished.tolist() == [False, False, True]
+    # Six calls: the prompt, then five sampled tokens (the end token counts as thinking)
+    assert processor.thinking_tokens.tolist() == [5, 5, 5]
+
+
+def test_schedule_requires_a_budget():
+    with pytest.raises(ValueError):
+        IncrementalThinkingEffortProcessor(END_ID, schedule="linear")
+    with pytest.raises(ValueError):
+        thinking_effort_processor(1.0, END_ID, schedule="linear")
+    with pytest.raises(ValueError):
+        get_effort_schedule("exponential")
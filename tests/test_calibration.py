@@ -0,0 +1,70 @@
+"""
+Tests of the offline calibration on the tiny random model: the `--tiny-random` command line
+end to end, and a cache that only returns a curve for the settings it was calibrated with.
+"""
+import json
+
+import pytest
+
+from thinking_effort import calibration
+
+
+@pytest.fixture
+def count_sweeps(monkeypatch):
+    sweeps = []
+    sweep = calibration.sweep
+
+    def counting_sweep(*args, **kwargs):
+        sweeps.append(args)
+        return sweep(*args, **kwargs)
+
+    monkeypatch.setattr(calibration, "sweep", counting_sweep)
+    return sweeps
+
+
+def run_main(monkeypatch, capsys, *args):
+    monkeypatch.setattr("sys.argv", ["thinking-effort-calibrate", "--tiny-random", *args])
+    calibration.main()
+    return capsys.readouterr().out
+
+
+def test_tiny_random_calibrates_then_loads_from_cache(monkeypatch, capsys, tmp_path, count_sweeps):
+    args = ["--cache-dir", str(tmp_path), "--max-new-tokens", "12", "--efforts", "0", "1.5", "--target-tokens", "5"]
+    first = run_main(monkeypatch, capsys, *args)
+    assert len(count_sweeps) == 1
+    assert "fit:" in first and "target=5" in first
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # Same settings: the curve comes from the cache, fit included
+    assert run_main(monkeypatch, capsys, *args) == first
+    assert len(count_sweeps) == 1
+
+    # Any other setting is calibrated again and cached next to the first curve
+    run_main(monkeypatch, capsys, *args, "--temperature", "0.9")
+    run_main(monkeypatch, capsys, *[arg if arg != "12" else "10" for arg in args])
+    assert len(count_sweeps) == 3
+    assert len(list(tmp_path.iterdir())) == 3
+
+
+def test_cache_checks_the_stored_settings(tmp_path, count_sweeps):
+    cache = calibration.CalibrationCache(str(tmp_path))
+    lengths = {0.0: 4, 1.0: 9}
+
+    def generate_fn(prompt, thinking_effort, scale_factor):
+        return lengths[thinking_effort] + len(prompt)
+
+    curve = calibration.calibrate(generate_fn, ["a", "bb"], "model", efforts=[0.0, 1.0], cache=cache)
+    cached = calibration.calibrate(generate_fn, ["a", "bb"], "model", efforts=(0.0, 1.0), cache=cache)
+    assert cached.to_dict() == curve.to_dict()
+    assert len(count_sweeps) == 1
+    for kwargs in [{"efforts": [0.0, 1.0], "settings": {"max_new_tokens": 8}}, {"efforts": [1.0, 0.0]}]:
+        calibration.calibrate(generate_fn, ["a", "bb"], "model", cache=cache, **kwargs)
+    calibration.calibrate(generate_fn, ["a", "ccc"], "model", efforts=[0.0, 1.0], cache=cache)
+    assert len(count_sweeps) == 4
+
+    # A file whose stored settings do not match (e.g. from an older version) is not used
+    path = cache.path_for("model", curve.settings)
+    other = calibration.EffortCurve(curve.intercept, curve.slope, "model", settings={"efforts": [2.0]})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(other.to_dict(), f)
+    assert cache.load("model", curve.settings) is None
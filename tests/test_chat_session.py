@@ -0,0 +1,130 @@
+"""
+Tests of KV prefix reuse in the multi-turn chat sessions: each turn must reuse exactly the
+prefix the new prompt shares with the previous turn's tokens (everything before the previous
+thinking) and only prefill the rest, without changing the generated turns.
+"""
+import numpy as np
+import pytest
+import torch
+
+from thinking_effort import (
+    ByteTokenizer,
+    LlamaChatSession,
+    ThinkingChatSession,
+    build_tiny_random_model,
+    longest_common_prefix,
+)
+
+MESSAGES = ["What is 2 + 2?", "And times 3?", "Thanks!"]
+# "<think>\n" closes the rendered generation prompt, and is dropped from the history
+THINKING_OPENING = 2
+
+
+@pytest.fixture(scope="module")
+def tiny_model():
+    tokenizer = ByteTokenizer()
+    return build_tiny_random_model(vocab_size=tokenizer.vocab_size), tokenizer
+
+
+def test_transformers_session_reuses_the_common_prefix(tiny_model):
+    model, tokenizer = tiny_model
+    end = tokenizer.convert_tokens_to_ids("</think>")
+    settings = {"thinking_effort": 0.5, "processor_kwargs": {"max_thinking_tokens": 4}, "max_new_tokens": 12}
+    session = ThinkingChatSession(model, tokenizer, end, do_sample=False, **settings)
+    baseline = ThinkingChatSession(model, tokenizer, end, reuse_cache=False, do_sample=False, **settings)
+
+    widths = []
+    hook = model.register_forward_pre_hook(
+        lambda module, args, kwargs: widths.append(kwargs["input_ids"].size(1)), with_kwargs=True
+    )
+    previous = None
+    try:
+        for content in MESSAGES:
+            widths.clear()
+            turn = session.send(content)
+            prompt_ids = tokenizer.encode(
+                tokenizer.apply_chat_template(session.messages[:-1], add_generation_prompt=True, tokenize=False)
+            )
+            assert turn.prompt_tokens == len(prompt_ids)
+            if previous is None:
+                assert turn.reused_tokens == 0
+            else:
+                previous_ids, previous_turn = previous
+                common = longest_common_prefix(previous_ids + previous_turn.generated_ids, prompt_ids)
+                assert turn.reused_tokens == common == len(previous_ids) - THINKING_OPENING
+            # Only the part of the prompt that is not in the cache is prefilled
+            assert widths[0] == turn.prefilled_tokens
+            expected = baseline.send(content)
+            assert turn.generated_ids == expected.generated_ids
+            assert (turn.thinking_end, turn.answer) == (expected.thinking_end, expected.answer)
+            previous = prompt_ids, turn
+    finally:
+        hook.remove()
+    assert session.messages == baseline.messages
+
+
+class FakeLlama:
+    """
+    Replays a scripted reply through the logits processor, keeping the longest evaluated prefix
+    of each prompt like `Llama.generate`.
+    """
+
+    def __init__(self, reply):
+        self.tokenizer = ByteTokenizer()
+        self.reply = self.tokenizer.encode(reply)
+        self.input_ids = np.zeros(4096, dtype=np.intc)
+        self.n_tokens = 0
+        self.evaluated = 0
+
+    def tokenize(self, text, special=False):
+        return self.tokenizer.encode(text.decode("utf-8"))
+
+    def detokenize(self, ids):
+        return self.tokenizer.decode(ids, skip_special_tokens=True).encode("utf-8")
+
+    def token_eos(self):
+        return self.tokenizer.eos_token_id
+
+    def reset(self):
+        self.n_tokens = 0
+
+    def eval(self, tokens):
+        self.input_ids[self.n_tokens : self.n_tokens + len(tokens)] = tokens
+        self.n_tokens += len(tokens)
+        self.evaluated += len(tokens)
+
+    def generate(self, tokens, logits_processor=None, **kwargs):
+        prefix = min(longest_common_prefix(self.input_ids[: self.n_tokens].tolist(), tokens), len(tokens) - 1)
+        self.n_tokens = prefix
+        self.eval(tokens[prefix:])
+        for token in self.reply:
+            logits = np.zeros(self.tokenizer.vocab_size)
+            logits[token] = 1.0
+            logits = logits_processor(self.input_ids[: self.n_tokens], logits)
+            token = int(np.argmax(logits))
+            yield token
+            self.eval([token])
+
+
+@pytest.mark.parametrize("end_markers", [None, [[ord("<"), ord("/"), ord("t")]]])
+def test_llamacpp_session_reuses_the_common_prefix(end_markers):
+    pytest.importorskip("llama_cpp")
+    tokenizer = ByteTokenizer()
+    llm = FakeLlama("hmm</think>ok<|im_end|>" if end_markers is None else "hm</thinking>ok<|im_end|>")
+    end = tokenizer.convert_tokens_to_ids("</think>") if end_markers is None else None
+    session = LlamaChatSession(llm, end, processor_kwargs={"end_markers": end_markers} if end_markers else None)
+    previous = None
+    for content in MESSAGES:
+        evaluated = llm.evaluated
+        turn = session.send(content)
+        prompt_ids = tokenizer.encode(session.template(session.messages[:-1]))
+        assert turn.prompt_tokens == len(prompt_ids)
+        if previous is not None:
+            previous_ids, previous_turn = previous
+            common = longest_common_prefix(previous_ids + previous_turn.generated_ids, prompt_ids)
+            assert turn.reused_tokens == common == len(previous_ids) - THINKING_OPENING
+        # The prompt tail, then every generated token but the last one
+        assert llm.evaluated - evaluated == turn.prefilled_tokens + len(turn.generated_ids) - 1
+        assert turn.answer == ("ok" if end_markers is None else "hinking>ok")
+        assert turn.thinking_end == (4 if end_markers is None else 5)
+        previous = prompt_ids, turn
@@ -0,0 +1,154 @@
+"""
+Tests of the request-keyed `ThinkingEffortController` and its adapters under a fake continuous
+batching scheduler that admits, preempts, finishes and shuffles requests every step.
+"""
+import random
+
+import numpy as np
+import pytest
+import torch
+
+from thinking_effort import ControllerLogitsProcessor, ThinkingEffortController, controller_logits_processor
+
+VOCAB_SIZE = 32
+PAD_ID = 0
+END_MARKERS = [[5, 6, 7], [9]]
+# Mostly marker tokens, so markers get started, broken off and completed
+STREAM_TOKENS = [5, 5, 6, 6, 7, 9, 10, 11, 12]
+
+
+class Request:
+    """A request with a fixed prompt, settings and token stream, so every run sees the same tokens."""
+
+    def __init__(self, request_id, rng):
+        self.request_id = request_id
+        self.prompt = [rng.randrange(10, VOCAB_SIZE) for _ in range(rng.randint(2, 8))]
+        self.stream = [rng.choice(STREAM_TOKENS) for _ in range(rng.randint(5, 30))]
+        self.settings = {
+            "thinking_effort": rng.choice([0.0, 0.5, 1.5]),
+            "scale_factor": rng.choice([2, 4]),
+            "max_thinking_tokens": rng.choice([None, 3, 10]),
+        }
+        self.generated = []
+        self.saved_state = None
+
+    @property
+    def tokens(self):
+        return self.prompt + self.generated
+
+    def expected_stats(self):
+        """Thinking tokens and whether an end marker completed, by scanning the generated tokens."""
+        for end in range(1, len(self.generated) + 1):
+            if any(self.generated[max(end - len(marker), 0) : end] == marker for marker in END_MARKERS):
+                return end, True
+        return len(self.generated), False
+
+
+class FakeScheduler:
+    """
+    Admits new and preempted requests up to `capacity` rows, evicts random ones (keeping their
+    state with `state_dict`), drops finished ones and shuffles the rows, every step.
+    """
+
+    def __init__(self, controller, seed, num_requests=24, capacity=6):
+        self.controller = controller
+        self.rng = random.Random(seed)
+        self.waiting = [Request(request_id, self.rng) for request_id in range(num_requests)]
+        self.capacity = capacity
+        self.running = []
+
+    def schedule(self):
+        for request in list(self.running):
+            if len(request.generated) == len(request.stream):
+                self.running.remove(request)
+                self.controller.remove(request.request_id)
+            elif self.rng.random() < 0.1:
+                self.running.remove(request)
+                request.saved_state = self.controller.state_dict(request.request_id)
+                self.controller.remove(request.request_id)
+                self.waiting.append(request)
+        self.rng.shuffle(self.waiting)
+        while self.waiting and len(self.running) < self.capacity and self.rng.random() < 0.8:
+            request = self.waiting.pop()
+            if request.saved_state is None:
+                self.controller.add(request.request_id, request.prompt, **request.settings)
+            else:
+                self.controller.load_state_dict(request.request_id, request.saved_state)
+            self.running.append(request)
+        self.rng.shuffle(self.running)
+        rows = list(self.running)
+        # Unused slots in the batch
+        for _ in range(self.rng.randint(0, 2)):
+            rows.insert(self.rng.randint(0, len(rows)), None)
+        return rows
+
+    def finished(self):
+        return not self.waiting and not self.running
+
+
+def transformers_step(controller, rows, scores, processors):
+    processor = processors.setdefault(None, ControllerLogitsProcessor(controller))
+    length = max(len(request.tokens) for request in rows if request is not None)
+    input_ids = torch.full((len(rows), length), PAD_ID)
+    for row, request in enumerate(rows):
+        if request is not None:
+            input_ids[row, length - len(request.tokens) :] = torch.tensor(request.tokens)
+    processor.set_request_ids([None if request is None else request.request_id for request in rows])
+    return processor(input_ids, torch.from_numpy(scores)).numpy()
+
+
+def llamacpp_step(controller, rows, scores, processors):
+    for row, request in enumerate(rows):
+        if request is not None:
+            processor = processors.setdefault(
+                request.request_id, controller_logits_processor(controller, request.request_id)
+            )
+            scores[row] = processor(np.array(request.tokens, dtype=np.intc), scores[row])
+    return scores
+
+
+def request_processor_step(controller, rows, scores, processors):
+    for row, request in enumerate(rows):
+        if request is not None:
+            scores[row] = controller.request_processor(request.request_id)(request.generated, scores[row])
+    return scores
+
+
+@pytest.mark.parametrize("step", [transformers_step, llamacpp_step, request_processor_step])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_state_follows_requests_across_shuffles_drops_and_inserts(step, seed):
+    controller = ThinkingEffortController(end_markers=END_MARKERS)
+    scheduler = FakeScheduler(controller, seed)
+    # One controller per request, driven in order, one row at a time
+    references = {}
+    for request in scheduler.waiting:
+        references[request.request_id] = ThinkingEffortController(end_markers=END_MARKERS)
+        references[request.request_id].add(request.request_id, request.prompt, **request.settings)
+    generator = np.random.default_rng(seed)
+    processors = {}
+    preempted = set()
+    steps = 0
+    while not scheduler.finished():
+        rows = scheduler.schedule()
+        preempted.update(request.request_id for request in scheduler.waiting if request.saved_state is not None)
+        if not any(request is not None for request in rows):
+            continue
+        scores = generator.standard_normal((len(rows), VOCAB_SIZE), dtype=np.float32)
+        expected = scores.copy()
+        for row, request in enumerate(rows):
+            if request is not None:
+                reference = references[request.request_id]
+                reference.observe(request.request_id, request.tokens[-1])
+                reference.apply(request.request_id, expected[row])
+        actual = step(controller, rows, scores.copy(), processors)
+        np.testing.assert_allclose(actual, expected, rtol=1e-6)
+        for request in rows:
+            if request is None:
+                continue
+            stats = controller.stats(request.request_id)
+            assert (stats["thinking_tokens"], stats["finished"]) == request.expected_stats()
+            request.generated.append(request.stream[len(request.generated)])
+        steps += 1
+    assert len(controller) == 0
+    # The run must actually have exercised preemption and concurrency
+    assert preempted and steps > 24
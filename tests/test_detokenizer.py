@@ -0,0 +1,55 @@
+"""
+Tests of `IncrementalDetokenizer`: the streamed text must equal a full decode, and the decoded
+window must stay short whatever the tokens decode to.
+"""
+import random
+
+import pytest
+
+from thinking_effort import IncrementalDetokenizer
+
+SPECIAL_ID = 256
+
+
+class ByteDecoder:
+    """Decodes byte tokens as UTF-8 and skips the special token, recording each window's length."""
+
+    def __init__(self):
+        self.windows = []
+
+    def __call__(self, ids):
+        self.windows.append(len(ids))
+        return bytes(token for token in ids if token != SPECIAL_ID).decode("utf-8", "replace")
+
+
+def stream(detokenizer, tokens):
+    return "".join(detokenizer.add(token) for token in tokens) + detokenizer.flush()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_streamed_text_matches_full_decode(seed):
+    rng = random.Random(seed)
+    text = "".join(rng.choice(["a", " b", "é", "€", "🙂", "\n"]) for _ in range(300))
+    tokens = []
+    for byte in text.encode("utf-8"):
+        tokens.append(byte)
+        if rng.random() < 0.2:
+            tokens.append(SPECIAL_ID)
+    decode = ByteDecoder()
+    assert stream(IncrementalDetokenizer(decode), tokens) == text
+    assert max(decode.windows) <= 2 * 8
+
+
+@pytest.mark.parametrize(
+    "tokens",
+    [
+        [ord("a")] + [SPECIAL_ID] * 2000 + [ord("b")],
+        # A lead byte whose continuation never comes, then only special tokens
+        [0xE2] + [SPECIAL_ID] * 2000,
+    ],
+)
+def test_window_stays_bounded_when_tokens_add_no_text(tokens):
+    decode = ByteDecoder()
+    detokenizer = IncrementalDetokenizer(decode, max_pending=8)
+    assert stream(detokenizer, tokens) == ByteDecoder()(tokens)
+    assert max(decode.windows) <= 2 * 8
@@ -0,0 +1,83 @@
+"""
+Tests of multi-token end-of-thinking markers: the `EndMarkerMatcher` automaton against a
+rescanning reference, and the llama-cpp-python closure biasing the next token of the partially
+matched marker.
+"""
+import random
+
+import numpy as np
+import pytest
+
+from thinking_effort import EndMarkerMatcher, thinking_effort_processor
+
+VOCAB_SIZE = 16
+MARKER_SETS = [[[5, 6, 7]], [[5, 6, 7], [9]], [[5, 5, 6], [6, 8]], [[5, 6, 5, 6, 7]]]
+
+
+def completes_marker(tokens, markers):
+    return any(tokens[-len(marker) :] == list(marker) for marker in markers if len(marker) <= len(tokens))
+
+
+def expected_next_tokens(tokens, markers):
+    """The next tokens of the markers whose longest prefix ends the tokens (rescanning)."""
+    for depth in range(max(len(marker) for marker in markers) - 1, -1, -1):
+        if depth > len(tokens):
+            continue
+        suffix = tokens[len(tokens) - depth :] if depth else []
+        next_tokens = {marker[depth] for marker in markers if len(marker) > depth and list(marker[:depth]) == suffix}
+        if next_tokens:
+            return next_tokens
+    return set()
+
+
+@pytest.mark.parametrize("markers", MARKER_SETS)
+def test_matcher_agrees_with_rescanning(markers):
+    rng = random.Random(0)
+    matcher = EndMarkerMatcher(markers)
+    alphabet = sorted({token for marker in markers for token in marker}) + [10]
+    for _ in range(50):
+        tokens, state = [], 0
+        for _ in range(30):
+            tokens.append(rng.choice(alphabet))
+            state = matcher.step(state, tokens[-1])
+            assert matcher.accepting[state] == completes_marker(tokens, markers)
+            if not matcher.accepting[state]:
+                assert set(matcher.next_tokens[state]) == expected_next_tokens(tokens, markers)
+        # Scanning the whole sequence reaches the same state
+        assert matcher.scan(tokens)[0] == state
+
+
+def test_find_end_counts_markers_started_in_the_context():
+    matcher = EndMarkerMatcher([[5, 6, 7], 9])
+    assert matcher.find_end([1, 5, 6, 7, 9]) == 4
+    assert matcher.find_end([6, 7, 1], context=[2, 5]) == 2
+    assert matcher.find_end([1, 2, 9]) == 3
+    assert matcher.find_end([5, 6, 1, 7]) is None
+    assert matcher.single_token is None
+    assert EndMarkerMatcher([9]).single_token == 9
+    with pytest.raises(ValueError):
+        EndMarkerMatcher([[]])
+
+
+@pytest.mark.parametrize("markers", MARKER_SETS)
+def test_closure_scales_the_next_marker_token(markers):
+    rng = np.random.default_rng(1)
+    alphabet = sorted({token for marker in markers for token in marker}) + [10, 11]
+    # The prompt ends in the middle of the first marker
+    tokens = [12, 13] + list(markers[0][:-1])
+    scale = 2 ** (1 - 0.2)
+    processor = thinking_effort_processor(0.2, None, end_markers=markers)
+    finished = False
+    for _ in range(60):
+        logits = rng.standard_normal(VOCAB_SIZE)
+        expected = logits.copy()
+        finished = finished or any(
+            tokens[start : start + len(marker)] == list(marker)
+            for marker in markers
+            for start in range(len(tokens) - len(marker) + 1)
+        )
+        if not finished:
+            for token in expected_next_tokens(tokens, markers):
+                expected[token] *= scale
+        np.testing.assert_array_equal(processor(np.array(tokens, dtype=np.intc), logits), expected)
+        tokens.append(int(rng.choice(alphabet)))
@@ -0,0 +1,74 @@
+"""
+Tests of the effort-sweep harness end to end on the tiny random model: resuming from the JSONL
+log, and per-run seeds that make a run's result independent of its batch.
+"""
+import json
+
+import pytest
+
+from thinking_effort.evaluation import TINY_RANDOM_PROMPTS, ResultsLog, build_runner, run_sweep, sweep_grid
+
+CONFIG = {
+    "source": "tiny-random",
+    "model": None,
+    "end_thinking_token_id": None,
+    "max_new_tokens": 24,
+    "temperature": 0.8,
+}
+RESULT_KEYS = ("thinking_tokens", "thinking_finished", "output_tokens", "answer", "seed")
+
+
+@pytest.fixture(scope="module")
+def runner():
+    return build_runner(CONFIG)
+
+
+def sweep(runner, path, batch_size=1):
+    """Runs a two-run sweep (one prompt at two efforts), counting the batches the runner gets."""
+    calls = []
+
+    def counting_runner(prompt, runs, seeds):
+        calls.append([run["run_id"] for run in runs])
+        return runner(prompt, runs, seeds)
+
+    records = run_sweep(
+        lambda: counting_runner,
+        TINY_RANDOM_PROMPTS[:1],
+        sweep_grid(1, [0.0, 1.5]),
+        ResultsLog(str(path), CONFIG),
+        batch_size=batch_size,
+        seed=3,
+    )
+    return records, calls
+
+
+def test_resume_skips_finished_runs(runner, tmp_path):
+    path = tmp_path / "sweep.jsonl"
+    records, calls = sweep(runner, path)
+    assert calls == [["p0-e0-s2-r0"], ["p0-e1.5-s2-r0"]]
+    assert len(path.read_text().splitlines()) == 2
+
+    resumed, calls = sweep(runner, path)
+    assert calls == []
+    assert [record["run_id"] for record in resumed] == [record["run_id"] for record in records]
+
+    # A crash after the first record, mid-way through writing the second
+    lines = path.read_text().splitlines()
+    path.write_text(lines[0] + "\n" + lines[1][:20])
+    resumed, calls = sweep(runner, path)
+    assert calls == [["p0-e1.5-s2-r0"]]
+    assert json.loads(path.read_text().splitlines()[-1])["run_id"] == "p0-e1.5-s2-r0"
+    assert [record[key] for record in resumed for key in RESULT_KEYS] == [
+        record[key] for record in records for key in RESULT_KEYS
+    ]
+
+
+def test_run_results_do_not_depend_on_the_batch(runner, tmp_path):
+    alone, calls = sweep(runner, tmp_path / "alone.jsonl", batch_size=1)
+    assert len(calls) == 2
+    batched, calls = sweep(runner, tmp_path / "batched.jsonl", batch_size=2)
+    assert len(calls) == 1
+    assert alone[0]["seed"] != alone[1]["seed"]
+    for expected, record in zip(alone, batched):
+        assert [record[key] for key in RESULT_KEYS] == [expected[key] for key in RESULT_KEYS]
+
@@ -0,0 +1,111 @@
+"""
+Tests of the multi-effort fan-out: every branch must match a separate run at its effort, while
+the prompt is prefilled only once.
+"""
+import numpy as np
+import pytest
+import torch
+
+from thinking_effort import (
+    ByteTokenizer,
+    IncrementalThinkingEffortProcessor,
+    build_tiny_random_model,
+    effort_fanout,
+    generate_effort_fanout,
+)
+
+EFFORTS = [0.0, 1.0, 1.5]
+
+
+@pytest.fixture(scope="module")
+def tiny_model():
+    tokenizer = ByteTokenizer()
+    return build_tiny_random_model(vocab_size=tokenizer.vocab_size), tokenizer
+
+
+def test_branches_match_separate_runs_and_prefill_once(tiny_model):
+    model, tokenizer = tiny_model
+    end = tokenizer.convert_tokens_to_ids("</think>")
+    input_ids = torch.tensor([tokenizer.encode("fan out this prompt")])
+    generate_kwargs = {"max_new_tokens": 30, "do_sample": False, "pad_token_id": 0}
+
+    expected = []
+    for effort in EFFORTS:
+        processor = IncrementalThinkingEffortProcessor(end, thinking_effort=effort, scale_factor=40)
+        output = model.generate(input_ids, logits_processor=[processor], **generate_kwargs)
+        expected.append(output[0, input_ids.size(1) :].tolist())
+    # The efforts must actually lead to different outputs
+    assert len({tuple(tokens) for tokens in expected}) > 1
+
+    lengths = []
+    hook = model.register_forward_pre_hook(
+        lambda module, args, kwargs: lengths.append((kwargs["input_ids"] if "input_ids" in kwargs else args[0]).shape),
+        with_kwargs=True,
+    )
+    streamed = {branch: [] for branch in range(len(EFFORTS))}
+    try:
+        branches = generate_effort_fanout(
+            model,
+            input_ids,
+            EFFORTS,
+            end,
+            scale_factor=40,
+            callback=lambda branch, token: streamed[branch].append(token),
+            **generate_kwargs,
+        )
+    finally:
+        hook.remove()
+    assert [branch.tolist() for branch in branches] == expected
+    assert [streamed[branch] for branch in range(len(EFFORTS))] == expected
+    # One single-row prefill, then only one new token per branch and step
+    assert lengths[0] == (1, input_ids.size(1) - 1)
+    assert all(shape == (len(EFFORTS), 1) for shape in lengths[1:])
+
+
+class FakeLlama:
+    """Evaluates nothing, but records what llama-cpp-python would have to evaluate."""
+
+    def __init__(self):
+        self.evaluated = []
+        self.state = []
+
+    def tokenize(self, text, special=False):
+        return list(text)
+
+    def reset(self):
+        self.state = []
+
+    def eval(self, tokens):
+        self.evaluated.extend(tokens)
+        self.state = self.state + list(tokens)
+
+    def save_state(self):
+        return list(self.state)
+
+    def load_state(self, state):
+        self.state = list(state)
+
+    def create_completion(self, prompt, max_tokens, logits_processor, stream, **kwargs):
+        # Only what is not already in the context is evaluated, as in `Llama.generate`
+        self.eval(prompt[len(self.state) :] or prompt[-1:])
+        tokens = list(prompt)
+        for _ in range(max_tokens):
+            logits = logits_processor(np.array(tokens, dtype=np.intc), np.ones(256))
+            token = int(np.argmax(logits))
+            tokens.append(token)
+            self.eval([token])
+            yield {"choices": [{"text": chr(token)}]}
+
+
+def test_llamacpp_branches_restore_the_prefix_state():
+    pytest.importorskip("llama_cpp")
+    llm = FakeLlama()
+    prompt = "<think>\n"
+    chunks = list(effort_fanout(llm, prompt, [0.0, 0.5], ord("!"), scale_factor=4, max_tokens=2))
+    assert [branch for branch, _ in chunks] == [0, 0, 1, 1]
+    # Effort 0 boosts "!" above the other (equal) logits, effort 0.5 still does
+    assert [chunk["choices"][0]["text"] for _, chunk in chunks] == ["!", "\x00", "!", "\x00"]
+    # The prompt is evaluated once; each branch then only feeds the last prompt token
+    prompt_tokens = list(prompt.encode("utf-8"))
+    assert llm.evaluated[: len(prompt_tokens) - 1] == prompt_tokens[:-1]
+    assert len(llm.evaluated) == len(prompt_tokens) - 1 + 2 * (1 + 2)
@@ -0,0 +1,156 @@
+"""
+CPU tests checking that `IncrementalThinkingEffortProcessor` produces the same logits as the
+original rescanning `ThinkingEffortProcessor`, and that it compiles without graph breaks.
+"""
+import pytest
+import torch
+
+from thinking_effort import IncrementalThinkingEffortProcessor, ThinkingEffortProcessor
+
+VOCAB_SIZE = 32
+END_ID = 5
+PAD_ID = 0
+
+
+def random_batch(generator, batch_size, prompt_length, max_padding=0):
+    """Left-padded random prompts that never contain the end token."""
+    prompts = torch.randint(6, VOCAB_SIZE, (batch_size, prompt_length), generator=generator)
+    for row in range(batch_size):
+        padding = int(torch.randint(0, max_padding + 1, (1,), generator=generator))
+        prompts[row, :padding] = PAD_ID
+    return prompts
+
+
+def sample(generator, scores, end_probability=0.15):
+    """Draws the next tokens, emitting the end token now and then."""
+    tokens = torch.randint(6, VOCAB_SIZE, (scores.size(0),), generator=generator)
+    emit = torch.rand(scores.size(0), generator=generator) < end_probability
+    return torch.where(emit, END_ID, tokens)
+
+
+def run_pair(reference, processor, input_ids, steps, generator):
+    """Drives both processors over the same token stream and compares every step."""
+    for _ in range(steps):
+        scores = torch.randn(input_ids.size(0), VOCAB_SIZE, generator=generator)
+        expected = reference(input_ids, scores.clone())
+        actual = processor(input_ids, scores.clone())
+        torch.testing.assert_close(actual, expected, rtol=0, atol=0)
+        input_ids = torch.cat([input_ids, sample(generator, scores)[:, None]], dim=-1)
+    return input_ids
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 8])
+@pytest.mark.parametrize("thinking_effort", [0.0, 0.5, 1.0, 1.7])
+def test_matches_reference_on_random_batches(batch_size, thinking_effort):
+    generator = torch.Generator().manual_seed(batch_size)
+    input_ids = random_batch(generator, batch_size, prompt_length=7)
+    reference = ThinkingEffortProcessor(END_ID, thinking_effort=thinking_effort, scale_factor=3)
+    processor = IncrementalThinkingEffortProcessor(END_ID, thinking_effort=thinking_effort, scale_factor=3)
+    run_pair(reference, processor, input_ids, steps=40, generator=generator)
+
+
+def test_matches_reference_with_per_row_settings():
+    generator = torch.Generator().manual_seed(1)
+    efforts = [0.0, 0.25, 1.0, 1.5]
+    factors = {1: 4.0, 3: 1.5}
+    input_ids = random_batch(generator, 4, prompt_length=5)
+    reference = ThinkingEffortProcessor(END_ID, thinking_effort=efforts, scale_factor=factors)
+    processor = IncrementalThinkingEffortProcessor(END_ID, thinking_effort=efforts, scale_factor=factors)
+    run_pair(reference, processor, input_ids, steps=30, generator=generator)
+
+
+def test_matches_reference_with_left_padding():
+    generator = torch.Generator().manual_seed(2)
+    input_ids = random_batch(generator, 6, prompt_length=12, max_padding=9)
+    reference = ThinkingEffortProcessor(END_ID, thinking_effort=0.3)
+    processor = IncrementalThinkingEffortProcessor(END_ID, thinking_effort=0.3)
+    run_pair(reference, processor, input_ids, steps=30, generator=generator)
+
+
+def test_prompt_containing_end_token():
+    generator = torch.Generator().manual_seed(3)
+    input_ids = random_batch(generator, 4, prompt_length=8)
+    input_ids[1, 3] = END_ID
+    input_ids[2, -1] = END_ID
+    reference = ThinkingEffortProcessor(END_ID, thinking_effort=0.0)
+    processor = IncrementalThinkingEffortProcessor(END_ID, thinking_effort=0.0)
+    run_pair(reference, processor, input_ids, steps=10, generator=generator)
+
+
+class RescanningMarkerReference:
+    """
+    Multi-token marker semantics computed from scratch every step: a row is finished once any
+    marker occurs in it; otherwise the next token of every marker whose prefix ends the row
+    (longest such prefix) is scaled.
+    """
+
+    def __init__(self, markers, scale):
+        self.markers = [list(marker) for marker in markers]
+        self.scale = scale
+
+    def __call__(self, input_ids, scores):
+        for row, tokens in enumerate(input_ids.tolist()):
+            if any(
+                tokens[start : start + len(marker)] == marker
+                for marker in self.markers
+                for start in range(len(tokens) - len(marker) + 1)
+            ):
+                continue
+            for depth in range(max(len(marker) for marker in self.markers) - 1, -1, -1):
+                suffix = tokens[len(tokens) - depth :] if depth else []
+                next_tokens = {
+                    marker[depth] for marker in self.markers if len(marker) > depth and marker[:depth] == suffix
+                }
+                if next_tokens:
+                    for token in next_tokens:
+                        scores[row, token] *= self.scale
+                    break
+        return scores
+
+
+@pytest.mark.parametrize("markers", [[[5, 6, 7]], [[5, 6, 7], [9]], [[5, 5, 6], [6, 8]]])
+def test_multi_token_markers_match_rescanning_reference(markers):
+    generator = torch.Generator().manual_seed(4)
+    marker_tokens = sorted({token for marker in markers for token in marker})
+    input_ids = random_batch(generator, 5, prompt_length=6, max_padding=3)
+    reference = RescanningMarkerReference(markers, scale=2 ** (1 - 0.2))
+    processor = IncrementalThinkingEffortProcessor(None, thinking_effort=0.2, end_markers=markers)
+    for _ in range(60):
+        scores = torch.randn(input_ids.size(0), VOCAB_SIZE, generator=generator)
+        expected = reference(input_ids, scores.clone())
+        actual = processor(input_ids, scores.clone())
+        torch.testing.assert_close(actual, expected, rtol=0, atol=0)
+        # Mostly marker tokens, so markers get started, broken off and completed
+        choices = torch.tensor(marker_tokens + [10, 11])
+        tokens = choices[torch.randint(0, len(choices), (input_ids.size(0),), generator=generator)]
+        input_ids = torch.cat([input_ids, tokens[:, None]], dim=-1)
+
+
+def test_single_token_end_markers_match_end_thinking_token_id():
+    generator = torch.Generator().manual_seed(5)
+    input_ids = random_batch(generator, 4, prompt_length=6)
+    reference = ThinkingEffortProcessor(END_ID, thinking_effort=0.4)
+    processor = IncrementalThinkingEffortProcessor(None, thinking_effort=0.4, end_markers=[[END_ID]])
+    run_pair(reference, processor, input_ids, steps=30, generator=generator)
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"end_markers": [[5, 6, 7], [9]]},
+        {"repetition_ngram_size": 3, "repetition_window": 16, "adaptive_top_k": 4},
+    ],
+)
+def test_no_graph_breaks(kwargs):
+    generator = torch.Generator().manual_seed(6)
+    input_ids = random_batch(generator, 4, prompt_length=6)
+    processor = IncrementalThinkingEffortProcessor(
+        END_ID, thinking_effort=0.5, max_thinking_tokens=[8, None, 3, 20], **kwargs
+    )
+    # The first call scans the prompt, the following ones only the newest token
+    processor(input_ids, torch.randn(4, VOCAB_SIZE, generator=generator))
+    input_ids = torch.cat([input_ids, torch.full((4, 1), 11)], dim=-1)
+    torch._dynamo.reset()
+    explanation = torch._dynamo.explain(processor)(input_ids, torch.randn(4, VOCAB_SIZE, generator=generator))
+    assert explanation.graph_break_count == 0, explanation.break_reasons
@@ -0,0 +1,52 @@
+"""
+Tests of the lazy public API: `import thinking_effort` only loads the standard-library core,
+each backend is imported on first access to one of its names, and every exported name resolves.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import thinking_effort
+
+BACKEND_MODULES = ["torch", "transformers", "numpy", "llama_cpp"]
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def loaded_after(code):
+    """Runs `code` in a fresh interpreter and returns which backend modules it loaded."""
+    script = f"import json, sys\n{code}\nprint(json.dumps(sorted(name for name in {BACKEND_MODULES!r} if name in sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", script], cwd=REPO_ROOT, check=True, capture_output=True, text=True)
+    return json.loads(result.stdout)
+
+
+@pytest.mark.parametrize(
+    "code, expected",
+    [
+        ("import thinking_effort", []),
+        ("import thinking_effort; thinking_effort.EndMarkerMatcher([[1, 2]])", []),
+        ("import thinking_effort; thinking_effort.create_processor('llama_cpp', 3)", ["numpy"]),
+        ("from thinking_effort import thinking_effort_processor", ["numpy"]),
+        ("import thinking_effort; thinking_effort.IncrementalThinkingEffortProcessor", ["numpy", "torch", "transformers"]),
+        ("import thinking_effort.calibration, thinking_effort.evaluation", []),
+    ],
+)
+def test_backends_are_imported_on_first_use(code, expected):
+    assert loaded_after(code) == expected
+
+
+def test_every_exported_name_resolves():
+    for name in thinking_effort.__all__:
+        assert getattr(thinking_effort, name) is not None
+    assert set(thinking_effort.__all__) <= set(dir(thinking_effort))
+    # Resolved names are cached as plain module attributes
+    assert "IncrementalThinkingEffortProcessor" in vars(thinking_effort)
+
+
+def test_unknown_names_and_backends_raise():
+    with pytest.raises(AttributeError):
+        thinking_effort.NoSuchProcessor
+    with pytest.raises(ValueError):
+        thinking_effort.create_processor("vllm", 3)
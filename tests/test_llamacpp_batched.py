@@ -0,0 +1,60 @@
+"""
+Tests of the batched NumPy processor of the llama-cpp-python backend against one
+`thinking_effort_processor` closure per sequence (llama-cpp-python itself is not needed).
+"""
+import numpy as np
+import pytest
+
+from thinking_effort import batched_thinking_effort_processor, thinking_effort_processor
+
+VOCAB_SIZE = 32
+END_ID = 5
+
+
+def run(processor, closures, input_ids, steps, rng):
+    """Drives the batched processor and the closures over the same tokens, comparing every step."""
+    for _ in range(steps):
+        scores = rng.standard_normal((input_ids.shape[0], VOCAB_SIZE), dtype=np.float32)
+        expected = scores.copy()
+        for row, closure in enumerate(closures):
+            closure(input_ids[row], expected[row])
+        np.testing.assert_array_equal(processor(input_ids, scores), expected)
+        tokens = np.where(rng.random(input_ids.shape[0]) < 0.1, END_ID, rng.integers(6, VOCAB_SIZE, input_ids.shape[0]))
+        input_ids = np.concatenate([input_ids, tokens[:, None].astype(np.intc)], axis=1)
+    return input_ids
+
+
+def test_matches_closures_with_per_row_settings():
+    rng = np.random.default_rng(0)
+    efforts, budgets = [0.0, 0.5, 1.0, 1.5], [None, 4, None, 12]
+    processor = batched_thinking_effort_processor(efforts, END_ID, scale_factor=3, max_thinking_tokens=budgets)
+    closures = [
+        thinking_effort_processor(effort, END_ID, scale_factor=3, max_thinking_tokens=budget)
+        for effort, budget in zip(efforts, budgets)
+    ]
+    run(processor, closures, rng.integers(6, VOCAB_SIZE, (4, 7)).astype(np.intc), 30, rng)
+
+
+@pytest.mark.parametrize("started", [False, True])
+def test_reset_restores_construction_settings_and_respects_rows(started):
+    rng = np.random.default_rng(1)
+    input_ids = rng.integers(6, VOCAB_SIZE, (3, 5)).astype(np.intc)
+    processor = batched_thinking_effort_processor(0.5, END_ID)
+    closures = [thinking_effort_processor(0.5, END_ID) for _ in range(3)]
+    if started:
+        input_ids = run(processor, closures, input_ids, 5, rng)
+    # Only row 1 restarts, with its own effort; its tokens so far become its prompt
+    processor.reset(rows=[1], thinking_effort=0.0)
+    closures[1] = thinking_effort_processor(0.0, END_ID)
+    input_ids = run(processor, closures, input_ids, 10, rng)
+    # Without overrides, every row restarts with the construction-time settings
+    processor.reset()
+    run(processor, [thinking_effort_processor(0.5, END_ID) for _ in range(3)], input_ids, 10, rng)
+
+
+def test_reset_before_first_call_does_not_change_other_rows():
+    rng = np.random.default_rng(2)
+    processor = batched_thinking_effort_processor(0.5, END_ID)
+    processor.reset(rows=[2], thinking_effort=1.5)
+    closures = [thinking_effort_processor(effort, END_ID) for effort in (0.5, 0.5, 1.5)]
+    run(processor, closures, rng.integers(6, VOCAB_SIZE, (3, 5)).astype(np.intc), 10, rng)
@@ -0,0 +1,78 @@
+"""
+Tests of the opt-in telemetry: per-sequence records from the torch processor and the
+llama-cpp-python closure, step hooks, exporters and the Prometheus text format.
+"""
+import numpy as np
+import torch
+
+from thinking_effort import (
+    IncrementalThinkingEffortProcessor,
+    PrometheusTextExporter,
+    ThinkingMetrics,
+    thinking_effort_processor,
+)
+
+VOCAB_SIZE = 16
+END_ID = 3
+
+
+def test_records_count_thinking_tokens_and_end_step(tmp_path):
+    steps, exported = [], []
+    metrics = ThinkingMetrics(
+        exporters=[exported.append, PrometheusTextExporter(str(tmp_path / "thinking.prom"))],
+        step_hooks=[lambda name, seconds: steps.append((name, seconds))],
+        labels={"model": "tiny"},
+    )
+    processor = IncrementalThinkingEffortProcessor(
+        END_ID, thinking_effort=[0.5, 1.5], metrics=metrics, metrics_name="torch"
+    )
+    closure = thinking_effort_processor(0.5, END_ID, metrics=metrics, metrics_name="llama")
+
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(4, VOCAB_SIZE, (2, 4), generator=generator)
+    for step in range(6):
+        processor(input_ids, torch.randn(2, VOCAB_SIZE, generator=generator))
+        closure(input_ids[0].numpy(), np.random.default_rng(step).standard_normal(VOCAB_SIZE))
+        tokens = torch.randint(4, VOCAB_SIZE, (2, 1), generator=generator)
+        if step == 2:
+            # Row 0 ends its thinking with the third sampled token
+            tokens[0, 0] = END_ID
+        input_ids = torch.cat([input_ids, tokens], dim=-1)
+
+    assert [name for name, _ in steps] == ["torch", "llama"] * 6
+    assert all(seconds >= 0 for _, seconds in steps)
+    records = {(record["processor"], record["sequence"]): record for record in metrics.export()}
+    assert exported == [list(records.values())]
+    assert set(records) == {("torch", "0"), ("torch", "1"), ("llama", "0")}
+    for key in [("torch", "0"), ("llama", "0")]:
+        assert records[key]["thinking_tokens"] == 3
+        assert records[key]["finished"] and records[key]["end_step"] == 2
+        assert records[key]["thinking_effort"] == 0.5
+    assert records["torch", "1"]["thinking_tokens"] == 5
+    assert not records["torch", "1"]["finished"] and records["torch", "1"]["end_step"] is None
+    assert records["torch", "1"]["thinking_effort"] == 1.5
+    assert all(record["model"] == "tiny" and record["processor_seconds"] > 0 for record in records.values())
+
+    text = (tmp_path / "thinking.prom").read_text()
+    assert "# TYPE thinking_effort_thinking_tokens gauge" in text
+    assert 'thinking_effort_thinking_tokens{model="tiny",processor="torch",sequence="1"} 5' in text
+    assert 'thinking_effort_end_step{model="tiny",processor="llama",sequence="0"} 2' in text
+    # Sequences without an end step have no sample rather than a fake value
+    assert 'thinking_effort_end_step{model="tiny",processor="torch",sequence="1"}' not in text
+
+
+def test_prometheus_label_values_are_escaped():
+    exporter = PrometheusTextExporter(prefix="te")
+    record = {
+        "processor": 'a"b\\c\nd',
+        "sequence": "0",
+        "thinking_effort": 1.0,
+        "scale_factor": 2.0,
+        "thinking_tokens": 7,
+        "finished": False,
+        "end_step": None,
+        "processor_seconds": 0.5,
+    }
+    text = exporter.export([record])
+    assert text == exporter.last_output
+    assert 'te_thinking_tokens{processor="a\\"b\\\\c\\nd",sequence="0"} 7' in text
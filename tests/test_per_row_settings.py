@@ -0,0 +1,59 @@
+"""
+Tests of per-row `thinking_effort` / `scale_factor` in `ThinkingEffortProcessor`: a mixed batch
+must be scaled exactly as if every row ran alone with its own scalar settings.
+"""
+import pytest
+import torch
+
+from thinking_effort import ThinkingEffortProcessor
+
+VOCAB_SIZE = 16
+END_ID = 3
+
+
+def run_alone(efforts, factors, input_ids, scores):
+    """Scales every row with a scalar processor of its own."""
+    expected = scores.clone()
+    for row, (effort, factor) in enumerate(zip(efforts, factors)):
+        processor = ThinkingEffortProcessor(END_ID, thinking_effort=effort, scale_factor=factor)
+        expected[row : row + 1] = processor(input_ids[row : row + 1], scores[row : row + 1].clone())
+    return expected
+
+
+@pytest.mark.parametrize(
+    "thinking_effort, scale_factor, efforts, factors",
+    [
+        ([0.0, 0.5, 1.0, 1.5], 2, [0.0, 0.5, 1.0, 1.5], [2, 2, 2, 2]),
+        (torch.tensor([0.0, 0.2, 0.4, 0.6]), [4, 3, 2, 1.5], [0.0, 0.2, 0.4, 0.6], [4, 3, 2, 1.5]),
+        # Rows missing from a mapping keep the defaults (effort 1.0, scale factor 2)
+        ({0: 0.0, 2: 1.5}, {1: 8.0, 2: 3.0}, [0.0, 1.0, 1.5, 1.0], [2, 8.0, 3.0, 2]),
+        ([0.0, None, 0.5, None], 3, [0.0, 1.0, 0.5, 1.0], [3, 3, 3, 3]),
+    ],
+)
+def test_mixed_batch_matches_rows_run_alone(thinking_effort, scale_factor, efforts, factors):
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(4, VOCAB_SIZE, (4, 6), generator=generator)
+    # Row 3 has already left the thinking phase
+    input_ids[3, 2] = END_ID
+    processor = ThinkingEffortProcessor(END_ID, thinking_effort=thinking_effort, scale_factor=scale_factor)
+    for _ in range(3):
+        scores = torch.randn(4, VOCAB_SIZE, generator=generator)
+        expected = run_alone(efforts, factors, input_ids, scores)
+        torch.testing.assert_close(processor(input_ids, scores.clone()), expected, rtol=0, atol=0)
+        input_ids = torch.cat([input_ids, torch.randint(4, VOCAB_SIZE, (4, 1), generator=generator)], dim=-1)
+
+
+def test_scales_are_computed_once_per_batch_shape():
+    processor = ThinkingEffortProcessor(END_ID, thinking_effort=[0.0, 1.0], scale_factor=4)
+    scales = processor.get_scales(2)
+    torch.testing.assert_close(scales, torch.tensor([4.0, 1.0]))
+    assert processor.get_scales(2) is scales
+    # Scalars stay a plain float shared by the batch
+    assert ThinkingEffortProcessor(END_ID, thinking_effort=0.0, scale_factor=4).get_scales(2) == 4.0
+
+
+@pytest.mark.parametrize("thinking_effort", [[0.0, 1.0, 0.5], {3: 0.0}])
+def test_settings_that_do_not_fit_the_batch_are_rejected(thinking_effort):
+    processor = ThinkingEffortProcessor(END_ID, thinking_effort=thinking_effort)
+    with pytest.raises(ValueError):
+        processor(torch.randint(4, VOCAB_SIZE, (2, 5)), torch.randn(2, VOCAB_SIZE))
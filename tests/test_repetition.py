@@ -0,0 +1,83 @@
+"""
+Tests of repetition-loop detection: `RepetitionDetector` and the per-row detector of the torch
+processor must fire on a looping stream, stay quiet on a varied one, and agree with each other
+and with the llama-cpp-python closure.
+"""
+import numpy as np
+import pytest
+import torch
+
+from thinking_effort import IncrementalThinkingEffortProcessor, RepetitionDetector, thinking_effort_processor
+
+VOCAB_SIZE = 256
+END_ID = 3
+NGRAM_SIZE = 4
+WINDOW = 32
+SETTINGS = {"repetition_ngram_size": NGRAM_SIZE, "repetition_window": WINDOW, "repetition_threshold": 0.5}
+
+
+def streams(length, seed=0):
+    """A looping row (a 7-token phrase after some reasoning) and a varied row."""
+    rng = np.random.default_rng(seed)
+    phrase = rng.integers(4, VOCAB_SIZE, size=7)
+    looping = np.concatenate([rng.integers(4, VOCAB_SIZE, size=20), np.tile(phrase, length)])[:length]
+    varied = rng.integers(4, VOCAB_SIZE, size=length)
+    return np.stack([looping, varied])
+
+
+def test_detector_fires_on_a_loop_only():
+    rows = streams(120)
+    for row, should_loop in [(0, True), (1, False)]:
+        detector = RepetitionDetector(NGRAM_SIZE, WINDOW, threshold=0.5)
+        states = [detector.update(token) for token in rows[row]]
+        assert any(states) == should_loop
+        assert (detector.loop_steps > 0) == should_loop
+    # A single repeated phrase is not a loop: the window has to fill up first
+    detector = RepetitionDetector(NGRAM_SIZE, WINDOW, threshold=0.5)
+    assert not any(detector.update(token) for token in list(rows[1, :10]) * 2)
+
+
+def test_processor_matches_the_detector_and_boosts_looping_rows():
+    prompt_length, length = 6, 120
+    rows = streams(prompt_length + length)
+    input_ids = torch.from_numpy(rows[:, :prompt_length])
+    processor = IncrementalThinkingEffortProcessor(END_ID, thinking_effort=1.0, repetition_boost=4.0, **SETTINGS)
+    closure = thinking_effort_processor(1.0, END_ID, repetition_boost=4.0, **SETTINGS)
+    detectors = [RepetitionDetector(NGRAM_SIZE, WINDOW, threshold=0.5) for _ in rows]
+    for detector, row in zip(detectors, rows):
+        detector.prime(row[prompt_length - NGRAM_SIZE : prompt_length])
+
+    for step in range(length):
+        if step:
+            looping = [detector.update(row[input_ids.size(1) - 1]) for detector, row in zip(detectors, rows)]
+        else:
+            looping = [False, False]
+        scores = processor(input_ids, torch.ones(2, VOCAB_SIZE))
+        # At effort 1.0 the end token is only scaled while looping
+        assert scores[:, END_ID].tolist() == [4.0 if flag else 1.0 for flag in looping]
+        assert processor.repetition_stats() == [detector.stats() for detector in detectors]
+        closure(input_ids[0].numpy(), np.ones(VOCAB_SIZE))
+        assert closure.repetition_stats() == detectors[0].stats()
+        input_ids = torch.from_numpy(rows[:, : input_ids.size(1) + 1])
+
+    stats = processor.repetition_stats()
+    assert stats[0]["looping"] and stats[0]["loop_steps"] > 0
+    assert stats[1] == {"repetition_score": 0.0, "looping": False, "loop_steps": 0}
+
+
+def test_detector_state_round_trips():
+    rows = streams(80)
+    detector = RepetitionDetector(NGRAM_SIZE, WINDOW)
+    for token in rows[0, :50]:
+        detector.update(token)
+    resumed = RepetitionDetector(NGRAM_SIZE, WINDOW)
+    resumed.load_state_dict(detector.state_dict())
+    for token in rows[0, 50:]:
+        assert resumed.update(token) == detector.update(token)
+        assert resumed.stats() == detector.stats()
+
+
+@pytest.mark.parametrize("ngram_size, window", [(0, 8), (4, 0)])
+def test_invalid_sizes_are_rejected(ngram_size, window):
+    with pytest.raises(ValueError):
+        RepetitionDetector(ngram_size, window)
@@ -0,0 +1,145 @@
+"""
+Tests of the OpenAI-compatible server's request handling, on the tiny random model.
+"""
+import asyncio
+import json
+
+import pytest
+
+from thinking_effort import ByteTokenizer, build_tiny_random_model
+from thinking_effort.server import BatchingEngine, GenerationRequest, ThinkingEffortServer
+
+
+class BufferWriter:
+    """The subset of `asyncio.StreamWriter` the server uses, writing to memory."""
+
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(scope="module")
+def tiny_model():
+    tokenizer = ByteTokenizer()
+    model = build_tiny_random_model(vocab_size=tokenizer.vocab_size)
+    return model, tokenizer
+
+
+def send(tiny_model, requests, batch_window=0.0):
+    """Sends raw HTTP requests concurrently to one fresh server and returns (status, response body) for each."""
+    model, tokenizer = tiny_model
+
+    async def handle(server, path, body):
+        reader = asyncio.StreamReader()
+        reader.feed_data(
+            f"POST {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+        )
+        reader.feed_eof()
+        writer = BufferWriter()
+        await server.handle_connection(reader, writer)
+        head, _, payload = writer.data.partition(b"\r\n\r\n")
+        return int(head.split(b" ")[1]), payload
+
+    async def run():
+        # The engine's queue and worker belong to the running event loop
+        engine = BatchingEngine(
+            model, tokenizer, tokenizer.convert_tokens_to_ids("</think>"), batch_window=batch_window
+        )
+        server = ThinkingEffortServer(engine, "tiny-random")
+        responses = await asyncio.gather(*(handle(server, path, body) for path, body in requests))
+        await engine.stop()
+        return responses
+
+    return asyncio.run(run())
+
+
+def request(tiny_model, path, body):
+    """Sends one raw HTTP request to a fresh server and returns (status, response body)."""
+    return send(tiny_model, [(path, body)])[0]
+
+
+@pytest.mark.parametrize(
+    "path, body",
+    [
+        ("/v1/completions", b"[]"),
+        ("/v1/completions", b'"prompt"'),
+        ("/v1/chat/completions", b"{}"),
+        ("/v1/chat/completions", b'{"messages": "hello"}'),
+        ("/v1/chat/completions", b'{"messages": [1, 2]}'),
+        ("/v1/completions", b'{"prompt": "hi", "max_tokens": [1]}'),
+        ("/v1/completions", b'{"prompt": "hi", "max_tokens": 0}'),
+        ("/v1/completions", b'{"prompt": "hi", "max_tokens": 2.5}'),
+        ("/v1/completions", b'{"prompt": "hi", "temperature": -0.5}'),
+        ("/v1/completions", b'{"prompt": "hi", "temperature": NaN}'),
+        ("/v1/completions", b'{"prompt": "hi", "scale_factor": 0}'),
+        ("/v1/completions", b'{"prompt": "hi", "thinking_effort": "high"}'),
+        ("/v1/completions", b'{"prompt": "hi", "max_thinking_tokens": -1}'),
+        ("/v1/completions", b'{"prompt": "hi", "max_thinking_tokens": "10"}'),
+        ("/v1/completions", b'{"prompt": "hi", "max_thinking_tokens": true}'),
+        ("/v1/completions", b"{not json"),
+    ],
+)
+def test_malformed_requests_get_400(tiny_model, path, body):
+    status, payload = request(tiny_model, path, body)
+    assert status == 400
+    assert "error" in json.loads(payload)
+
+
+def test_streamed_text_matches_full_decode(tiny_model):
+    body = json.dumps({"prompt": "Hello", "max_tokens": 40, "temperature": 0, "stream": True}).encode()
+    status, payload = request(tiny_model, "/v1/completions", body)
+    assert status == 200
+    events = [line[len(b"data: ") :] for line in payload.split(b"\n\n") if line.startswith(b"data: ")]
+    assert events[-1] == b"[DONE]"
+    chunks = [json.loads(event) for event in events[:-1]]
+    streamed = "".join(chunk["choices"][0]["text"] for chunk in chunks)
+
+    body = json.dumps({"prompt": "Hello", "max_tokens": 40, "temperature": 0}).encode()
+    status, payload = request(tiny_model, "/v1/completions", body)
+    assert status == 200
+    assert streamed == json.loads(payload)["choices"][0]["text"]
+
+
+def test_malformed_request_does_not_fail_the_requests_sent_with_it(tiny_model):
+    valid = json.dumps({"prompt": "Hello", "max_tokens": 20, "temperature": 0, "max_thinking_tokens": 5}).encode()
+    malformed = json.dumps({"prompt": "Hello", "max_tokens": 20, "max_thinking_tokens": "5"}).encode()
+    (status, payload), (bad_status, _) = send(
+        tiny_model, [("/v1/completions", valid), ("/v1/completions", malformed)], batch_window=0.05
+    )
+    assert bad_status == 400
+    assert status == 200
+    choice = json.loads(payload)["choices"][0]
+    assert choice["finish_reason"] in ("stop", "length") and choice["text"]
+
+
+def test_failing_request_is_isolated_from_its_batch(tiny_model):
+    model, tokenizer = tiny_model
+    prompt_ids = tokenizer.encode("Hello")
+
+    async def run():
+        engine = BatchingEngine(model, tokenizer, tokenizer.convert_tokens_to_ids("</think>"), batch_window=0.05)
+        # Bypasses request parsing, so the bad budget only fails inside `generate`
+        requests = [
+            GenerationRequest(prompt_ids, max_tokens=10, temperature=0),
+            GenerationRequest(prompt_ids, max_tokens=10, temperature=0, max_thinking_tokens="abc"),
+            GenerationRequest(prompt_ids, max_tokens=10, temperature=0),
+        ]
+
+        async def collect(request):
+            return [token async for token in engine.submit(request)]
+
+        tokens = await asyncio.gather(*(collect(request) for request in requests))
+        await engine.stop()
+        return requests, tokens
+
+    requests, tokens = asyncio.run(run())
+    assert [request.finish_reason for request in requests] == ["length", "error", "length"]
+    assert len(tokens[0]) == len(tokens[2]) == 10 and tokens[1] == []
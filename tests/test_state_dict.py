@@ -0,0 +1,97 @@
+"""
+Tests of `state_dict` / `load_state_dict`: a processor restored from a JSON round trip of the
+exported state must continue exactly like the one that exported it, for the torch processor
+and the llama-cpp-python closure.
+"""
+import json
+
+import numpy as np
+import pytest
+import torch
+
+from thinking_effort import IncrementalThinkingEffortProcessor, thinking_effort_processor
+
+VOCAB_SIZE = 64
+END_MARKERS = [[3, 4], [5]]
+SETTINGS = {
+    "end_markers": END_MARKERS,
+    "max_thinking_tokens": 40,
+    "schedule": "linear",
+    "repetition_ngram_size": 3,
+    "repetition_window": 16,
+    "adaptive_top_k": 8,
+}
+
+
+def token_stream(rows, length, seed):
+    # A short alphabet, so n-grams repeat and marker prefixes (token 3) come up regularly
+    rng = np.random.default_rng(seed)
+    tokens = rng.integers(6, 9, size=(rows, length))
+    tokens[:, ::7] = 3
+    return torch.from_numpy(tokens)
+
+
+def round_trip(state):
+    return json.loads(json.dumps(state))
+
+
+@pytest.mark.parametrize("max_rollback", [64, 0])
+def test_torch_processor_resumes_bit_identically(max_rollback):
+    tokens = token_stream(3, 50, seed=0)
+    # Row 0 ends with the two-token marker, row 1 with the single-token one
+    tokens[0, 29] = 4
+    tokens[1, 30] = 5
+    scores = torch.randn(50, 3, VOCAB_SIZE, generator=torch.Generator().manual_seed(0))
+    efforts = [0.5, 1.0, 1.5]
+    processor = IncrementalThinkingEffortProcessor(
+        None, thinking_effort=efforts, max_rollback=max_rollback, **SETTINGS
+    )
+    for step in range(5, 25):
+        processor(tokens[:, :step], scores[step].clone())
+
+    state = round_trip(processor.state_dict())
+    resumed = IncrementalThinkingEffortProcessor(None, thinking_effort=efforts, max_rollback=max_rollback, **SETTINGS)
+    resumed.load_state_dict(state)
+    assert resumed.state_dict() == state
+    for step in range(25, 50):
+        expected = processor(tokens[:, :step], scores[step].clone())
+        torch.testing.assert_close(resumed(tokens[:, :step], scores[step].clone()), expected, rtol=0, atol=0)
+    assert resumed.repetition_stats() == processor.repetition_stats()
+    assert resumed.state_dict() == processor.state_dict()
+
+
+def test_state_before_the_first_call_round_trips():
+    processor = IncrementalThinkingEffortProcessor(None, **SETTINGS)
+    resumed = IncrementalThinkingEffortProcessor(None, **SETTINGS)
+    resumed.load_state_dict(round_trip(processor.state_dict()))
+    assert resumed.finished is None
+
+
+def test_closure_resumes_bit_identically():
+    tokens = token_stream(1, 50, seed=1)[0].numpy().astype(np.intc)
+    rng = np.random.default_rng(1)
+    logits = rng.standard_normal((50, VOCAB_SIZE))
+    processor = thinking_effort_processor(0.8, None, **SETTINGS)
+    for step in range(5, 25):
+        processor(tokens[:step], logits[step].copy())
+
+    state = round_trip(processor.state_dict())
+    resumed = thinking_effort_processor(0.8, None, **SETTINGS)
+    resumed.load_state_dict(state)
+    for step in range(25, 50):
+        expected = processor(tokens[:step], logits[step].copy())
+        np.testing.assert_array_equal(resumed(tokens[:step], logits[step].copy()), expected)
+    assert resumed.repetition_stats() == processor.repetition_stats()
+    assert resumed.confidence() == processor.confidence()
+    assert resumed.state_dict() == processor.state_dict()
+
+
+def test_unknown_versions_are_rejected():
+    processor = IncrementalThinkingEffortProcessor(3)
+    processor(torch.tensor([[6, 7]]), torch.randn(1, VOCAB_SIZE))
+    state = processor.state_dict()
+    state["version"] += 1
+    with pytest.raises(ValueError):
+        IncrementalThinkingEffortProcessor(3).load_state_dict(state)
+    with pytest.raises(ValueError):
+        thinking_effort_processor(1.0, 3).load_state_dict(state)
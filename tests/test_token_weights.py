@@ -0,0 +1,51 @@
+"""
+Tests of `token_weights`: extra tokens are scaled by `scale ** weight` while a row is thinking,
+in the torch processor and the llama-cpp-python closure, and left alone once it has finished.
+"""
+import numpy as np
+import pytest
+import torch
+
+from thinking_effort import IncrementalThinkingEffortProcessor, thinking_effort_processor
+
+VOCAB_SIZE = 16
+END_ID = 3
+WEIGHTS = {5: 1.0, 6: -2.0, 7: 0.5}
+
+
+def test_weighted_tokens_follow_the_row_scale():
+    efforts, factor = [0.0, 0.5, 1.5], 4.0
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(8, VOCAB_SIZE, (3, 4), generator=generator)
+    processor = IncrementalThinkingEffortProcessor(
+        END_ID, thinking_effort=efforts, scale_factor=factor, token_weights=WEIGHTS
+    )
+    closures = [thinking_effort_processor(effort, END_ID, factor, token_weights=WEIGHTS) for effort in efforts]
+    for step in range(5):
+        scores = torch.rand(3, VOCAB_SIZE, generator=generator, dtype=torch.float64) + 1.0
+        actual = processor(input_ids, scores.clone())
+        expected = scores.clone()
+        for row, effort in enumerate(efforts):
+            closure_actual = closures[row](input_ids[row].numpy(), scores[row].numpy().copy())
+            np.testing.assert_allclose(closure_actual, actual[row].numpy(), rtol=1e-12)
+            if row == 0 and step > 2:
+                # Row 0 emitted the end token: nothing is scaled any more
+                continue
+            scale = factor ** (1.0 - effort)
+            expected[row, END_ID] *= scale
+            for token, weight in WEIGHTS.items():
+                expected[row, token] *= scale**weight
+        torch.testing.assert_close(actual, expected, rtol=1e-12, atol=0)
+        tokens = torch.randint(8, VOCAB_SIZE, (3, 1), generator=generator)
+        if step == 2:
+            tokens[0, 0] = END_ID
+        input_ids = torch.cat([input_ids, tokens], dim=-1)
+
+
+def test_end_marker_tokens_cannot_be_weighted():
+    with pytest.raises(ValueError):
+        IncrementalThinkingEffortProcessor(END_ID, token_weights={END_ID: 1.0})
+    with pytest.raises(ValueError):
+        IncrementalThinkingEffortProcessor(None, end_markers=[[5, 9]], token_weights={9: -1.0})
+    with pytest.raises(ValueError):
+        thinking_effort_processor(1.0, END_ID, token_weights={END_ID: 1.0})
@@ -0,0 +1,174 @@
+"""
+Thinking effort control for reasoning models, for Hugging Face Transformers and llama-cpp-python.
+
+Everything public is available from this package, but the backends are imported lazily:
+`import thinking_effort` only loads the backend-independent core (standard library only).
+torch and transformers are imported the first time a Transformers name is accessed, and
+NumPy the first time a llama-cpp-python name is, so llama-cpp workers and command line tools
+never pay for torch.
+
+Submodules:
+    core: backend-independent helpers (schedules, marker matching, telemetry, controller, splitters).
+    transformers_backend: logits processors and generation helpers for Transformers (torch).
+    llamacpp_backend: logits processors and helpers for llama-cpp-python (NumPy).
+    calibration: offline effort calibration (`python -m thinking_effort.calibration`).
+    evaluation: parallel, resumable effort-sweep harness (`python -m thinking_effort.evaluation`).
+    server: OpenAI-compatible micro-batching server (`python -m thinking_effort.server`).
+"""
+import importlib
+
+from .core import (
+    CONTENT,
+    EFFORT_SCHEDULES,
+    REASONING,
+    CallbackExporter,
+    ChatTurn,
+    EndMarkerMatcher,
+    IncrementalDetokenizer,
+    MetricsExporter,
+    PrometheusTextExporter,
+    RepetitionDetector,
+    TextThinkingSplitter,
+    ThinkingEffortController,
+    ThinkingMetrics,
+    ThinkingSplitter,
+    effort_to_scale,
+    end_step_from_counts,
+    format_prometheus,
+    chatml_prompt,
+    get_effort_schedule,
+    longest_common_prefix,
+    scheduled_effort,
+    split_thinking_text,
+)
+
+__version__ = "0.1.0"
+
+# Public names of the backend modules, imported on first access (see `__getattr__`)
+_LAZY_NAMES = {
+    "transformers_backend": [
+        "AdaptiveConfidence",
+        "BranchStreamer",
+        "ByteTokenizer",
+        "ControllerLogitsProcessor",
+        "IncrementalThinkingEffortProcessor",
+        "PhasedGenerationOutput",
+        "RepetitionTracker",
+        "ScaleComponent",
+        "ThinkingChatSession",
+        "ThinkingEffortProcessor",
+        "ThinkingEndStoppingCriteria",
+        "ThinkingSplitStreamer",
+        "build_tiny_random_model",
+        "generate_effort_fanout",
+        "generate_with_answer_lookup",
+    ],
+    "llamacpp_backend": [
+        "LlamaChatSession",
+        "ThinkingEffortProcessorFactory",
+        "batched_thinking_effort_processor",
+        "controller_logits_processor",
+        "create_completion_with_effort_bias",
+        "effort_fanout",
+        "effort_to_logit_bias",
+        "split_completion_stream",
+        "split_token_stream",
+        "thinking_effort_processor",
+        "thinking_effort_processor_for_target",
+    ],
+    "calibration": [
+        "DEFAULT_CACHE_DIR",
+        "CalibrationCache",
+        "EffortCurve",
+        "calibrate",
+        "llamacpp_generate_fn",
+        "model_identity",
+        "sweep",
+        "transformers_generate_fn",
+    ],
+    "evaluation": [
+        "LlamaCppRunner",
+        "ResultsLog",
+        "TransformersRunner",
+        "build_runner",
+        "contains_score",
+        "format_report",
+        "load_prompts",
+        "run_sweep",
+        "summarize",
+        "sweep_grid",
+    ],
+}
+_LAZY_MODULES = {name: module for module, names in _LAZY_NAMES.items() for name in names}
+
+BACKENDS = ("transformers", "llama_cpp")
+
+
+def __getattr__(name):
+    module_name = _LAZY_MODULES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    # Cache it, so later accesses are plain attribute lookups
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_MODULES))
+
+
+def create_processor(backend, end_thinking_token_id, thinking_effort=1.0, scale_factor=2, **kwargs):
+    """
+    Creates the thinking effort processor of a backend, importing only that backend.
+
+    Args:
+        backend (str): "transformers" for an `IncrementalThinkingEffortProcessor` (a
+            `LogitsProcessor` for `generate`), or "llama_cpp" for a `thinking_effort_processor`
+            closure (for llama-cpp-python's `logits_processor`).
+        end_thinking_token_id (int or None): The end-of-thinking token ID.
+        thinking_effort (float, optional): The thinking effort (default=1.0).
+        scale_factor (float, optional): The scale factor (default=2).
+        **kwargs: Other arguments of the backend's processor (max_thinking_tokens, schedule,
+            end_markers, metrics, ...).
+    """
+    if backend == "transformers":
+        from .transformers_backend import IncrementalThinkingEffortProcessor
+
+        return IncrementalThinkingEffortProcessor(
+            end_thinking_token_id, thinking_effort=thinking_effort, scale_factor=scale_factor, **kwargs
+        )
+    if backend == "llama_cpp":
+        from .llamacpp_backend import thinking_effort_processor
+
+        return thinking_effort_processor(thinking_effort, end_thinking_token_id, scale_factor, **kwargs)
+    raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+
+
+__all__ = [
+    "BACKENDS",
+    "CONTENT",
+    "EFFORT_SCHEDULES",
+    "REASONING",
+    "CallbackExporter",
+    "ChatTurn",
+    "EndMarkerMatcher",
+    "IncrementalDetokenizer",
+    "MetricsExporter",
+    "PrometheusTextExporter",
+    "RepetitionDetector",
+    "TextThinkingSplitter",
+    "ThinkingEffortController",
+    "ThinkingMetrics",
+    "ThinkingSplitter",
+    "create_processor",
+    "effort_to_scale",
+    "end_step_from_counts",
+    "format_prometheus",
+    "chatml_prompt",
+    "get_effort_schedule",
+    "longest_common_prefix",
+    "scheduled_effort",
+    "split_thinking_text",
+    *_LAZY_MODULES,
+]
@@ -0,0 +1,406 @@
+"""
+Offline calibration of `thinking_effort` / `scale_factor` against the thinking length of a model.
+
+A calibration sweeps a grid of efforts and scale factors over a prompt set, records how many
+thinking tokens each run used, and fits a per-model `EffortCurve`. The curve is cached on disk
+keyed by model identity and calibration settings (prompts, grid, generation budget and
+temperature), and can then turn a target number of thinking tokens (e.g. derived
+from a latency SLO) back into a thinking effort:
+
+    curve = calibrate(transformers_generate_fn(model, tokenizer, think_end_token_id), prompts,
+                      model_identity(model), efforts=[0.0, 0.5, 1.0, 1.5], scale_factors=[2, 4])
+    processor = IncrementalThinkingEffortProcessor.from_target_tokens(think_end_token_id, 800, curve)
+
+Run `python -m thinking_effort.calibration --help` for the command line version (use
+`--tiny-random` to try it without downloading a model).
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "thinking_effort", "calibration")
+
+
+class EffortCurve:
+    """
+    Maps a thinking effort to the expected number of thinking tokens for one model.
+
+    The processors scale the end-of-thinking logit by `scale_factor ** (1 - thinking_effort)`,
+    so effort and scale factor only matter through the log-scale
+        x = (1 - thinking_effort) * ln(scale_factor)
+    and the curve is the log-linear fit
+        ln(1 + thinking_tokens) = intercept + slope * x
+    over all calibration samples, regardless of which scale factor produced them.
+
+    Args:
+        intercept (float): Fitted intercept (expected ln(1 + tokens) with no scaling).
+        slope (float): Fitted slope; negative when stronger scaling shortens thinking.
+        model_id (str, optional): The identity of the calibrated model.
+        samples (list, optional): The raw calibration samples.
+        settings (dict, optional): The calibration settings the samples were produced with.
+    """
+
+    def __init__(self, intercept, slope, model_id=None, samples=None, settings=None):
+        self.intercept = intercept
+        self.slope = slope
+        self.model_id = model_id
+        self.samples = list(samples or [])
+        self.settings = settings
+
+    @staticmethod
+    def log_scale(thinking_effort, scale_factor):
+        return (1.0 - thinking_effort) * math.log(scale_factor)
+
+    @classmethod
+    def fit(cls, samples, model_id=None, settings=None):
+        """
+        Fits the curve by least squares.
+
+        Args:
+            samples (list of dict): Each with "thinking_effort", "scale_factor" and "thinking_tokens".
+            model_id (str, optional): Stored with the curve.
+            settings (dict, optional): Stored with the curve.
+        """
+        xs = [cls.log_scale(s["thinking_effort"], s["scale_factor"]) for s in samples]
+        ys = [math.log1p(s["thinking_tokens"]) for s in samples]
+        if len(samples) < 2:
+            raise ValueError("At least two calibration samples are needed")
+        mean_x = sum(xs) / len(xs)
+        mean_y = sum(ys) / len(ys)
+        variance = sum((x - mean_x) ** 2 for x in xs)
+        if variance == 0.0:
+            raise ValueError("The calibration grid needs at least two distinct effort/scale_factor settings")
+        slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+        return cls(mean_y - slope * mean_x, slope, model_id=model_id, samples=samples, settings=settings)
+
+    def predict(self, thinking_effort, scale_factor=2):
+        """Returns the expected number of thinking tokens for an effort setting."""
+        return math.expm1(self.intercept + self.slope * self.log_scale(thinking_effort, scale_factor))
+
+    def effort_for_tokens(self, target_thinking_tokens, scale_factor=2):
+        """
+        Returns the thinking effort expected to produce `target_thinking_tokens`.
+
+        Raises:
+            ValueError: When the curve is flat (the model did not react to the scaling) or
+                `scale_factor` is 1 (no scaling at all).
+        """
+        if self.slope == 0.0:
+            raise ValueError("The calibration curve is flat; the effort cannot be inverted")
+        if scale_factor <= 0 or scale_factor == 1:
+            raise ValueError("scale_factor must be positive and different from 1")
+        x = (math.log1p(target_thinking_tokens) - self.intercept) / self.slope
+        return 1.0 - x / math.log(scale_factor)
+
+    def to_dict(self):
+        return {
+            "model_id": self.model_id,
+            "intercept": self.intercept,
+            "slope": self.slope,
+            "samples": self.samples,
+            "settings": self.settings,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["intercept"],
+            data["slope"],
+            model_id=data.get("model_id"),
+            samples=data.get("samples"),
+            settings=data.get("settings"),
+        )
+
+
+def model_identity(model):
+    """
+    Returns a string identifying a model for the calibration cache.
+
+    - Strings (names or paths) are used as they are, with the size and modification time
+      appended when they point to a file (e.g. a GGUF), so a replaced file is recalibrated.
+    - Hugging Face models use `name_or_path` plus a hash of their config.
+    - llama-cpp-python `Llama` objects use their `model_path`.
+    """
+    if isinstance(model, str):
+        if os.path.isfile(model):
+            stat = os.stat(model)
+            return f"{os.path.abspath(model)}:{stat.st_size}:{int(stat.st_mtime)}"
+        return model
+    config = getattr(model, "config", None)
+    if config is not None and hasattr(config, "to_json_string"):
+        config_hash = hashlib.sha256(config.to_json_string().encode("utf-8")).hexdigest()[:16]
+        return f"{getattr(config, 'name_or_path', '') or type(model).__name__}:{config_hash}"
+    if hasattr(model, "model_path"):
+        return model_identity(model.model_path)
+    raise TypeError(f"Cannot derive a model identity from {type(model).__name__}; pass a string instead")
+
+
+def _canonical(settings):
+    # The settings as they read back from JSON (tuples become lists), so they compare equal after a round trip
+    return json.loads(json.dumps(settings or {}, sort_keys=True))
+
+
+def _prompts_digest(prompts):
+    """
+    Returns a short hash of a prompt set, for the calibration settings. Prompts may be strings,
+    token ID lists or tensors.
+    """
+    digest = hashlib.sha256()
+    for prompt in prompts:
+        if hasattr(prompt, "tolist"):
+            prompt = prompt.tolist()
+        digest.update(json.dumps(prompt).encode("utf-8") + b"\n")
+    return digest.hexdigest()[:16]
+
+
+class CalibrationCache:
+    """
+    Stores one `EffortCurve` per model and calibration settings, as a JSON file named after a
+    hash of both. The settings are stored in the file as well and checked on load, so a curve is
+    only reused for the exact settings it was calibrated with.
+
+    Args:
+        directory (str, optional): Where the curves are stored (default: ~/.cache/thinking_effort/calibration).
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or DEFAULT_CACHE_DIR
+
+    def path_for(self, model_id, settings=None):
+        key = json.dumps([model_id, _canonical(settings)], sort_keys=True)
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def load(self, model_id, settings=None):
+        """Returns the cached curve for `model_id` calibrated with `settings`, or None."""
+        try:
+            with open(self.path_for(model_id, settings), encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        if data.get("model_id") != model_id or _canonical(data.get("settings")) != _canonical(settings):
+            return None
+        return EffortCurve.from_dict(data)
+
+    def save(self, curve):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(curve.model_id, curve.settings)
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump({**curve.to_dict(), "created": time.time()}, f)
+        os.replace(temporary_path, path)
+        return path
+
+
+def sweep(generate_fn, prompts, efforts, scale_factors=(2,)):
+    """
+    Runs every prompt at every (thinking_effort, scale_factor) combination.
+
+    Args:
+        generate_fn (callable):
+            `generate_fn(prompt, thinking_effort, scale_factor) -> thinking_tokens`, see
+            `transformers_generate_fn` and `llamacpp_generate_fn`.
+        prompts (list): The prompts, in whatever form `generate_fn` accepts.
+        efforts (iterable of float): The thinking efforts to try.
+        scale_factors (iterable of float, optional): The scale factors to try (default=(2,)).
+
+    Returns:
+        list of dict: One sample per run.
+    """
+    samples = []
+    for scale_factor in scale_factors:
+        for thinking_effort in efforts:
+            for prompt_index, prompt in enumerate(prompts):
+                thinking_tokens = generate_fn(prompt, thinking_effort, scale_factor)
+                samples.append(
+                    {
+                        "prompt_index": prompt_index,
+                        "thinking_effort": thinking_effort,
+                        "scale_factor": scale_factor,
+                        "thinking_tokens": thinking_tokens,
+                    }
+                )
+    return samples
+
+
+def calibrate(
+    generate_fn,
+    prompts,
+    model_id,
+    efforts=(0.0, 0.5, 1.0, 1.5),
+    scale_factors=(2,),
+    cache=None,
+    refresh=False,
+    settings=None,
+):
+    """
+    Returns the `EffortCurve` of a model, sweeping and fitting it only when it is not cached.
+
+    Args:
+        generate_fn (callable): See `sweep`.
+        prompts (list): The calibration prompts.
+        model_id (str): The model identity (see `model_identity`).
+        efforts (iterable of float, optional): The efforts to sweep.
+        scale_factors (iterable of float, optional): The scale factors to sweep.
+        cache (CalibrationCache, optional): Defaults to the cache in ~/.cache/thinking_effort.
+        refresh (bool, optional): Ignore a cached curve and recalibrate.
+        settings (dict, optional): What else shapes the samples but is hidden in `generate_fn`,
+            e.g. {"max_new_tokens": 2048, "temperature": 0.6}. Together with the prompts, efforts
+            and scale factors it is part of the cache key, so changing any of them recalibrates.
+    """
+    cache = cache or CalibrationCache()
+    settings = _canonical(
+        {
+            **(settings or {}),
+            "prompts": _prompts_digest(prompts),
+            "efforts": list(efforts),
+            "scale_factors": list(scale_factors),
+        }
+    )
+    if not refresh:
+        curve = cache.load(model_id, settings)
+        if curve is not None:
+            return curve
+    curve = EffortCurve.fit(sweep(generate_fn, prompts, efforts, scale_factors), model_id=model_id, settings=settings)
+    cache.save(curve)
+    return curve
+
+
+def transformers_generate_fn(model, tokenizer, end_thinking_token_id, max_new_tokens=2048, **generate_kwargs):
+    """
+    Returns a `generate_fn` running Hugging Face `model.generate` with an
+    `IncrementalThinkingEffortProcessor`.
+
+    Prompts may be strings (formatted with the tokenizer's chat template as a single user
+    message) or already tokenized `input_ids` tensors of shape (1, seq_length). Runs that hit
+    `max_new_tokens` before the end of thinking count as `max_new_tokens` thinking tokens.
+    """
+    import torch
+
+    from .transformers_backend import IncrementalThinkingEffortProcessor
+
+    def generate_fn(prompt, thinking_effort, scale_factor):
+        if isinstance(prompt, str):
+            input_ids = tokenizer.apply_chat_template(
+                [{"role": "user", "content": prompt}], add_generation_prompt=True, return_tensors="pt"
+            )
+        else:
+            input_ids = prompt
+        processor = IncrementalThinkingEffortProcessor(
+            end_thinking_token_id, thinking_effort=thinking_effort, scale_factor=scale_factor
+        )
+        with torch.no_grad():
+            output = model.generate(
+                input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                max_new_tokens=max_new_tokens,
+                logits_processor=[processor],
+                **generate_kwargs,
+            )
+        if processor.finished is not None and bool(processor.finished[0]):
+            return int(processor.thinking_tokens[0])
+        return output.shape[1] - input_ids.shape[1]
+
+    return generate_fn
+
+
+def llamacpp_generate_fn(llm, end_thinking_token_id, max_tokens=2048, **completion_kwargs):
+    """
+    Returns a `generate_fn` running llama-cpp-python `create_completion` with the
+    `thinking_effort_processor` closure. Prompts are complete prompt strings.
+    """
+    from .core import ThinkingMetrics
+    from .llamacpp_backend import thinking_effort_processor
+
+    def generate_fn(prompt, thinking_effort, scale_factor):
+        metrics = ThinkingMetrics()
+        processor = thinking_effort_processor(thinking_effort, end_thinking_token_id, scale_factor, metrics=metrics)
+        llm.create_completion(prompt, max_tokens=max_tokens, logits_processor=[processor], **completion_kwargs)
+        return metrics.collect()[0]["thinking_tokens"]
+
+    return generate_fn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate thinking_effort against thinking length for a model.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--model", help="Hugging Face model name or path")
+    source.add_argument("--gguf", help="Path to a GGUF model (llama-cpp-python)")
+    source.add_argument("--tiny-random", action="store_true", help="Use a tiny random model (no download)")
+    parser.add_argument("--prompts", help="Text file with one prompt per line (required unless --tiny-random)")
+    parser.add_argument("--end-thinking-token-id", type=int, help="</think> token id (default: looked up)")
+    parser.add_argument("--efforts", type=float, nargs="+", default=[0.0, 0.5, 1.0, 1.5])
+    parser.add_argument("--scale-factors", type=float, nargs="+", default=[2.0])
+    parser.add_argument("--max-new-tokens", type=int, default=2048)
+    parser.add_argument("--temperature", type=float, default=0.6)
+    parser.add_argument("--cache-dir", help="Calibration cache directory")
+    parser.add_argument("--refresh", action="store_true", help="Recalibrate even if a cached curve exists")
+    parser.add_argument("--target-tokens", type=int, nargs="*", default=[], help="Print the efforts for these targets")
+    args = parser.parse_args()
+
+    if args.tiny_random:
+        import torch
+
+        from .transformers_backend import build_tiny_random_model
+
+        model = build_tiny_random_model(vocab_size=64)
+        end_thinking_token_id = args.end_thinking_token_id if args.end_thinking_token_id is not None else 7
+        prompts = [torch.randint(8, 64, (1, 16), generator=torch.Generator().manual_seed(i)) for i in range(4)]
+        generate_fn = transformers_generate_fn(
+            model, None, end_thinking_token_id, args.max_new_tokens, do_sample=True, temperature=args.temperature, pad_token_id=0
+        )
+        model_id = model_identity(model)
+    else:
+        if not args.prompts:
+            parser.error("--prompts is required")
+        with open(args.prompts, encoding="utf-8") as f:
+            prompts = [line.strip() for line in f if line.strip()]
+        if args.model:
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(args.model)
+            model = AutoModelForCausalLM.from_pretrained(args.model).eval()
+            end_thinking_token_id = args.end_thinking_token_id
+            if end_thinking_token_id is None:
+                end_thinking_token_id = tokenizer.convert_tokens_to_ids("</think>")
+            generate_fn = transformers_generate_fn(
+                model, tokenizer, end_thinking_token_id, args.max_new_tokens, do_sample=True, temperature=args.temperature
+            )
+            model_id = model_identity(model)
+        else:
+            from llama_cpp import Llama
+
+            if args.end_thinking_token_id is None:
+                parser.error("--end-thinking-token-id is required with --gguf")
+            llm = Llama(model_path=args.gguf, n_ctx=args.max_new_tokens + 4096, verbose=False)
+            end_thinking_token_id = args.end_thinking_token_id
+            generate_fn = llamacpp_generate_fn(llm, end_thinking_token_id, args.max_new_tokens, temperature=args.temperature)
+            model_id = model_identity(args.gguf)
+
+    cache = CalibrationCache(args.cache_dir)
+    curve = calibrate(
+        generate_fn,
+        prompts,
+        model_id,
+        args.efforts,
+        args.scale_factors,
+        cache=cache,
+        refresh=args.refresh,
+        settings={"max_new_tokens": args.max_new_tokens, "temperature": args.temperature},
+    )
+    print(f"model: {model_id}")
+    print(f"cache: {cache.path_for(model_id, curve.settings)}")
+    print(f"fit:   ln(1 + tokens) = {curve.intercept:.4f} + {curve.slope:.4f} * (1 - effort) * ln(scale_factor)")
+    for scale_factor in args.scale_factors:
+        for thinking_effort in args.efforts:
+            print(f"  effort={thinking_effort:<5g} scale_factor={scale_factor:<5g} -> {curve.predict(thinking_effort, scale_factor):.1f} tokens")
+    for target in args.target_tokens:
+        for scale_factor in args.scale_factors:
+            print(f"  target={target} scale_factor={scale_factor:g} -> effort {curve.effort_for_tokens(target, scale_factor):.3f}")
+
+
+if __name__ == "__main__":
+    main()
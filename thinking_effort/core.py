@@ -0,0 +1,1087 @@
+"""
+Backend-independent pieces shared by the Transformers and llama-cpp thinking effort processors.
+
+Nothing in this module imports torch or numpy: the helpers only use Python arithmetic operators,
+so they work the same on Python floats, NumPy arrays and torch tensors.
+"""
+import os
+from collections import deque
+
+
+def effort_to_scale(thinking_effort, scale_factor=2):
+    """
+    Converts a thinking effort into the multiplier applied to the end-of-thinking logit.
+
+    Args:
+        thinking_effort (float): The thinking effort (0 = minimal thinking, 1 = unchanged).
+        scale_factor (float, optional): The base of the exponent (default=2).
+
+    Returns:
+        float: `scale_factor ** (1.0 - thinking_effort)`.
+    """
+    return scale_factor ** (1.0 - thinking_effort)
+
+
+# Curves mapping budget progress p in [0, 1] to how far the effort has moved from
+# `thinking_effort` (0.0) towards `final_thinking_effort` (1.0).
+EFFORT_SCHEDULES = {
+    "constant": lambda progress: progress * 0.0,
+    "linear": lambda progress: progress,
+    "quadratic": lambda progress: progress * progress,
+    "cubic": lambda progress: progress * progress * progress,
+    "sqrt": lambda progress: progress ** 0.5,
+}
+
+
+def get_effort_schedule(schedule):
+    """
+    Resolves an effort schedule.
+
+    Args:
+        schedule (str, callable or None):
+            One of the names in `EFFORT_SCHEDULES`, or a callable taking the budget progress
+            (a float, NumPy array or torch tensor with values in [0, 1]) and returning values
+            in [0, 1]. None is the same as "constant".
+
+    Returns:
+        callable: The schedule function.
+    """
+    if schedule is None:
+        return EFFORT_SCHEDULES["constant"]
+    if callable(schedule):
+        return schedule
+    try:
+        return EFFORT_SCHEDULES[schedule]
+    except KeyError:
+        raise ValueError(
+            f"Unknown effort schedule {schedule!r}, expected one of {sorted(EFFORT_SCHEDULES)} or a callable"
+        ) from None
+
+
+def scheduled_effort(thinking_effort, final_thinking_effort, progress, schedule_fn):
+    """
+    Returns the effort to use after a fraction `progress` of the thinking budget was spent.
+
+    The effort moves from `thinking_effort` (progress 0) to `final_thinking_effort`
+    (progress 1) following `schedule_fn`. With the default `final_thinking_effort=0.0` the
+    end-of-thinking token is boosted more and more as the budget runs out.
+    """
+    return thinking_effort + (final_thinking_effort - thinking_effort) * schedule_fn(progress)
+
+
+class EndMarkerMatcher:
+    """
+    An incremental matcher for one or more end-of-thinking markers, each a sequence of token IDs.
+
+    The markers are compiled into an Aho-Corasick automaton whose transitions are fully
+    expanded over the tokens that appear in the markers, so advancing a sequence by one token
+    is a single dict lookup, independent of the context length. The state of a sequence is
+    just an int (0 is the initial state).
+
+    Args:
+        markers (iterable):
+            The end markers. Each marker is a sequence of token IDs, or a plain int for a
+            single-token marker. E.g. `[[151668]]` for QwQ's `</think>`, or
+            `[[522, 26865, 29], [151668]]` for a model that may spell it out in three tokens.
+
+    Attributes:
+        transitions (list of dict): transitions[state][token] -> next state. Tokens that are
+            not in any marker lead back to state 0.
+        accepting (list of bool): Whether reaching the state completes a marker.
+        next_tokens (list of tuple): The tokens that extend the partial match of each state,
+            i.e. where the end-of-thinking bias should go next.
+        alphabet (tuple): All token IDs used by the markers.
+        max_length (int): The length of the longest marker.
+        depths (list of int): The number of trailing tokens each state has matched.
+    """
+
+    def __init__(self, markers):
+        markers = [(marker,) if isinstance(marker, int) else tuple(int(t) for t in marker) for marker in markers]
+        if not markers or any(len(marker) == 0 for marker in markers):
+            raise ValueError("At least one non-empty end marker is required")
+        self.markers = markers
+        self.max_length = max(len(marker) for marker in markers)
+
+        # Build the trie
+        children = [{}]
+        accepting = [False]
+        depths = [0]
+        for marker in markers:
+            state = 0
+            for token in marker:
+                if token not in children[state]:
+                    children.append({})
+                    accepting.append(False)
+                    depths.append(depths[state] + 1)
+                    children[state][token] = len(children) - 1
+                state = children[state][token]
+            accepting[state] = True
+        self.depths = depths
+
+        self.alphabet = tuple(sorted({token for marker in markers for token in marker}))
+        self.next_tokens = [tuple(child) for child in children]
+
+        # Breadth-first pass computing failure links and the fully expanded transitions
+        transitions = [dict(children[0])]
+        transitions.extend({} for _ in range(len(children) - 1))
+        failure = [0] * len(children)
+        queue = deque(children[0].values())
+        while queue:
+            state = queue.popleft()
+            accepting[state] = accepting[state] or accepting[failure[state]]
+            for token in self.alphabet:
+                child = children[state].get(token)
+                if child is None:
+                    target = transitions[failure[state]].get(token, 0)
+                    if target:
+                        transitions[state][token] = target
+                else:
+                    transitions[state][token] = child
+                    failure[child] = transitions[failure[state]].get(token, 0) if state else 0
+                    queue.append(child)
+
+        self.transitions = transitions
+        self.accepting = accepting
+
+    @property
+    def num_states(self):
+        return len(self.transitions)
+
+    @property
+    def single_token(self):
+        """The token ID if there is exactly one single-token marker, otherwise None."""
+        if len(self.markers) == 1 and len(self.markers[0]) == 1:
+            return self.markers[0][0]
+        return None
+
+    def step(self, state, token):
+        """Advances `state` by one token and returns the new state (O(1))."""
+        return self.transitions[state].get(token, 0)
+
+    def scan(self, tokens, state=0):
+        """
+        Feeds a sequence of tokens.
+
+        Returns:
+            tuple: (final state, whether any marker was completed along the way).
+        """
+        matched = False
+        transitions = self.transitions
+        accepting = self.accepting
+        for token in tokens:
+            state = transitions[state].get(token, 0)
+            matched = matched or accepting[state]
+        return state, matched
+
+    def find_end(self, tokens, context=()):
+        """
+        Finds where the first marker completed within `tokens` ends.
+
+        Args:
+            tokens (sequence of int): The tokens to search, e.g. a sequence's generated tokens.
+            context (sequence of int, optional): The tokens preceding them, e.g. the tail of the
+                prompt. A marker started there and completed in `tokens` counts.
+
+        Returns:
+            int or None: The number of tokens up to and including the end of that marker, or
+                None when no marker is completed.
+        """
+        state, _ = self.scan(context)
+        for index, token in enumerate(tokens):
+            state = self.transitions[state].get(token, 0)
+            if self.accepting[state]:
+                return index + 1
+        return None
+
+    def dense_tables(self):
+        """
+        Returns the automaton as rectangular tables, for vectorized backends.
+
+        Returns:
+            tuple: (alphabet, table, accepting, next_tokens, has_next) where
+                - table[state][k] is the next state for token `alphabet[k - 1]`, and column 0 is
+                  used for every token outside the alphabet;
+                - next_tokens[state] is padded to the same width by repeating its first entry
+                  (or 0 when the state has no continuation, see has_next).
+        """
+        table = [
+            [0] + [self.transitions[state].get(token, 0) for token in self.alphabet]
+            for state in range(self.num_states)
+        ]
+        width = max(len(tokens) for tokens in self.next_tokens)
+        next_tokens = [
+            list(tokens) + [tokens[0]] * (width - len(tokens)) if tokens else [0] * width
+            for tokens in self.next_tokens
+        ]
+        has_next = [bool(tokens) for tokens in self.next_tokens]
+        return list(self.alphabet), table, list(self.accepting), next_tokens, has_next
+
+
+# Polynomial rolling hash of n-grams, shared by the pure-Python and torch repetition detectors.
+# Intermediate products stay below 2**63 for token IDs up to 2**31.
+NGRAM_HASH_BASE = 1000003
+NGRAM_HASH_MODULUS = 2**31 - 1
+
+
+class RepetitionDetector:
+    """
+    Detects sustained repetition ("Wait, let me re-check..." loops) in one token stream.
+
+    A rolling hash of the last `ngram_size` tokens is updated in O(1) per token. Each n-gram is
+    flagged as repeated when the same n-gram already occurred within the last `window` tokens,
+    and the repetition score is the fraction of flagged n-grams over that window, kept as a
+    running sum so the update stays O(1). The stream is considered looping while the score is
+    at least `threshold`; as the window has to fill up first, a single repeated phrase does not
+    trigger it.
+
+    Args:
+        ngram_size (int, optional): Length of the hashed n-grams (default=8).
+        window (int, optional): Number of recent tokens the score is computed over (default=256).
+        threshold (float, optional): Score from which the stream counts as looping (default=0.5).
+
+    Attributes:
+        score (float): The current repetition score, in [0, 1].
+        looping (bool): Whether the score is at or above the threshold.
+        loop_steps (int): How many updates ended in the looping state.
+    """
+
+    def __init__(self, ngram_size=8, window=256, threshold=0.5):
+        if ngram_size < 1 or window < 1:
+            raise ValueError("ngram_size and window must be positive")
+        self.ngram_size = ngram_size
+        self.window = window
+        self.threshold = threshold
+        self._outgoing_weight = pow(NGRAM_HASH_BASE, ngram_size - 1, NGRAM_HASH_MODULUS)
+        self.reset()
+
+    def reset(self):
+        self._tokens = deque([0] * self.ngram_size, maxlen=self.ngram_size)
+        self._hash = 0
+        self._position = 0
+        # hash -> position of its latest occurrence, and the (hash, position, flag) of the window
+        self._last_seen = {}
+        self._recent = deque()
+        self._repeated = 0
+        self.loop_steps = 0
+
+    def _roll(self, token):
+        outgoing = self._tokens[0]
+        self._tokens.append(token)
+        rolled = (self._hash - outgoing * self._outgoing_weight) % NGRAM_HASH_MODULUS
+        self._hash = (rolled * NGRAM_HASH_BASE + token) % NGRAM_HASH_MODULUS
+
+    def prime(self, tokens):
+        """Feeds context tokens (e.g. the prompt tail) into the n-gram without scoring them."""
+        for token in tokens:
+            self._roll(int(token))
+
+    def update(self, token):
+        """Feeds one generated token and returns whether the stream is now looping."""
+        self._roll(int(token))
+        position = self._position
+        self._position += 1
+
+        last = self._last_seen.get(self._hash)
+        repeated = last is not None and position - last <= self.window
+        self._last_seen[self._hash] = position
+        self._recent.append((self._hash, position, repeated))
+        self._repeated += repeated
+        if len(self._recent) > self.window:
+            old_hash, old_position, old_repeated = self._recent.popleft()
+            self._repeated -= old_repeated
+            if self._last_seen.get(old_hash) == old_position:
+                del self._last_seen[old_hash]
+
+        looping = self.looping
+        self.loop_steps += looping
+        return looping
+
+    @property
+    def score(self):
+        return self._repeated / self.window
+
+    @property
+    def looping(self):
+        return self.score >= self.threshold
+
+    def stats(self):
+        """Returns the detection statistics as a dict (repetition_score, looping, loop_steps)."""
+        return {"repetition_score": self.score, "looping": self.looping, "loop_steps": self.loop_steps}
+
+    def state_dict(self):
+        """
+        Returns the detector state as a JSON-serializable dict: the n-gram tail, the rolling hash
+        and the (hash, position, flag) entries of the window, so its size is bounded by `window`.
+        """
+        return {
+            "tokens": list(self._tokens),
+            "hash": self._hash,
+            "position": self._position,
+            "recent": [list(entry) for entry in self._recent],
+            "repeated": self._repeated,
+            "loop_steps": self.loop_steps,
+        }
+
+    def load_state_dict(self, state):
+        """Restores a state returned by `state_dict` (of a detector with the same arguments)."""
+        self._tokens = deque(state["tokens"], maxlen=self.ngram_size)
+        self._hash = state["hash"]
+        self._position = state["position"]
+        self._recent = deque((entry_hash, position, bool(flag)) for entry_hash, position, flag in state["recent"])
+        # Only n-grams of the window are remembered, each at its latest position
+        self._last_seen = {entry_hash: position for entry_hash, position, _ in self._recent}
+        self._repeated = state["repeated"]
+        self.loop_steps = state["loop_steps"]
+
+
+# Version of the processor and controller state records (see `state_dict` methods)
+STATE_DICT_VERSION = 1
+
+
+def _check_state_dict_version(state_dict):
+    version = state_dict.get("version")
+    if version != STATE_DICT_VERSION:
+        raise ValueError(f"Unsupported state_dict version {version!r} (expected {STATE_DICT_VERSION})")
+
+
+def end_step_from_counts(thinking_tokens, finished):
+    """
+    Returns the generation step (0-based) at which the end marker was emitted, or None.
+
+    The thinking-token count includes the end marker, so the marker was emitted at step
+    `thinking_tokens - 1`. Sequences that are still thinking, or whose prompt already
+    contained the marker (no thinking tokens), have no end step.
+    """
+    if finished and thinking_tokens > 0:
+        return thinking_tokens - 1
+    return None
+
+
+REASONING = "reasoning"
+CONTENT = "content"
+
+
+class IncrementalDetokenizer:
+    """
+    Turns a stream of token IDs into text with O(1) amortized work per token.
+
+    Only a short window of recent tokens is decoded on each step: the text of the window minus
+    the text of its already emitted part. Text ending in an incomplete UTF-8 sequence (decoded
+    as U+FFFD) is held back until the following tokens complete it, and the tokens before the
+    window are dropped, so long outputs are never re-decoded. Tokens that add no text (skipped
+    special tokens) are kept as context only, up to `max_pending` of them, so the window stays
+    short even over long runs of them.
+
+    Args:
+        decode (callable): Decodes a list of token IDs to a string, e.g.
+            `lambda ids: tokenizer.decode(ids)` or `llm.detokenize(ids).decode("utf-8", "replace")`.
+        max_pending (int, optional): How many tokens may be held back waiting for a complete
+            character before the replacement characters are emitted anyway (default=8).
+    """
+
+    def __init__(self, decode, max_pending=8):
+        self.decode = decode
+        self.max_pending = max_pending
+        self._ids = []
+        # _ids[:_read_offset] is already emitted; _ids[:_prefix_offset] is context only
+        self._prefix_offset = 0
+        self._read_offset = 0
+
+    def add(self, token):
+        """Feeds one token and returns the newly completed text (possibly empty)."""
+        self._ids.append(int(token))
+        prefix_text = self.decode(self._ids[self._prefix_offset : self._read_offset])
+        text = self.decode(self._ids[self._prefix_offset :])
+        if text.endswith("\ufffd") and len(self._ids) - self._read_offset < self.max_pending:
+            return ""
+        if len(text) > len(prefix_text):
+            # Keep the last emitted token as decoding context (e.g. for leading spaces)
+            del self._ids[: self._read_offset]
+            self._prefix_offset = 0
+            self._read_offset = len(self._ids)
+            return text[len(prefix_text) :]
+        # The new tokens add no text (e.g. skipped special tokens): they join the context, of
+        # which at most `max_pending` tokens are kept, so the decoded window stays bounded
+        excess = len(self._ids) - self.max_pending
+        if excess > 0:
+            del self._ids[:excess]
+        self._prefix_offset = 0
+        self._read_offset = len(self._ids)
+        return ""
+
+    def flush(self):
+        """Returns whatever text is still held back, and forgets the stream."""
+        prefix_text = self.decode(self._ids[self._prefix_offset : self._read_offset])
+        text = self.decode(self._ids[self._prefix_offset :])
+        self._ids = []
+        self._prefix_offset = self._read_offset = 0
+        return text[len(prefix_text) :]
+
+
+class ThinkingSplitter:
+    """
+    Routes generated tokens into a "reasoning" and a "content" text channel.
+
+    The end-of-thinking marker is detected with the same `EndMarkerMatcher` the processors use,
+    so multi-token markers work: tokens that may be the start of a marker are held back until
+    the marker either completes (it is then dropped, and the following tokens go to the content
+    channel) or fails to match (they are released to the reasoning channel). Each channel has
+    its own `IncrementalDetokenizer`, so the whole output is never re-decoded.
+
+    Args:
+        decode (callable): Decodes a list of token IDs to a string.
+        end_thinking_token_id (int, optional): The end-of-thinking token ID.
+        end_markers (iterable, optional): Several and/or multi-token end markers, instead of
+            `end_thinking_token_id`.
+        thinking (bool, optional): Whether the stream starts in the thinking phase, i.e. the
+            prompt ends with the opening <think> (default=True).
+    """
+
+    def __init__(self, decode, end_thinking_token_id=None, end_markers=None, thinking=True):
+        if end_markers is None:
+            if end_thinking_token_id is None:
+                raise ValueError("Either end_thinking_token_id or end_markers is required")
+            end_markers = [[end_thinking_token_id]]
+        self.matcher = EndMarkerMatcher(end_markers)
+        self.decode = decode
+        self.channel = REASONING if thinking else CONTENT
+        self._detokenizer = IncrementalDetokenizer(decode)
+        self._state = 0
+        self._pending = []
+
+    def _emit(self, tokens, pieces):
+        for token in tokens:
+            text = self._detokenizer.add(token)
+            if text:
+                pieces.append((self.channel, text))
+
+    def feed(self, token):
+        """Feeds one generated token and returns the (channel, text) pieces it completes."""
+        pieces = []
+        if self.channel == CONTENT:
+            self._emit([token], pieces)
+            return pieces
+
+        token = int(token)
+        self._pending.append(token)
+        self._state = self.matcher.step(self._state, token)
+        if self.matcher.accepting[self._state]:
+            # Release what precedes the completed marker, drop the marker and switch channels
+            marker = max(
+                (marker for marker in self.matcher.markers if self._pending[-len(marker) :] == list(marker)), key=len
+            )
+            self._emit(self._pending[: -len(marker)], pieces)
+            text = self._detokenizer.flush()
+            if text:
+                pieces.append((self.channel, text))
+            self._pending = []
+            self.channel = CONTENT
+            self._detokenizer = IncrementalDetokenizer(self.decode)
+            return pieces
+
+        # Only the tokens of the current partial match can still belong to a marker
+        keep = self.matcher.depths[self._state]
+        released = len(self._pending) - keep
+        if released:
+            self._emit(self._pending[:released], pieces)
+            del self._pending[:released]
+        return pieces
+
+    def finish(self):
+        """Flushes held-back tokens and text at the end of the stream."""
+        pieces = []
+        self._emit(self._pending, pieces)
+        self._pending = []
+        text = self._detokenizer.flush()
+        if text:
+            pieces.append((self.channel, text))
+        return pieces
+
+
+class TextThinkingSplitter:
+    """
+    The text-level counterpart of `ThinkingSplitter`, for streams that only carry text (e.g.
+    llama-cpp-python completion chunks or `TextIteratorStreamer`).
+
+    The end marker may be split across chunks, so a chunk suffix that could start the marker is
+    held back until the next chunk decides; the work per chunk is bounded by the marker length.
+
+    Args:
+        end_thinking_text (str, optional): The text of the end marker (default="</think>").
+        thinking (bool, optional): Whether the stream starts in the thinking phase (default=True).
+    """
+
+    def __init__(self, end_thinking_text="</think>", thinking=True):
+        self.end_thinking_text = end_thinking_text
+        self.channel = REASONING if thinking else CONTENT
+        self._carry = ""
+
+    def feed(self, text):
+        """Feeds a chunk of text and returns the (channel, text) pieces it completes."""
+        if self.channel == CONTENT:
+            return [(CONTENT, text)] if text else []
+
+        marker = self.end_thinking_text
+        # Only the carried-over suffix and the new chunk can contain a marker start
+        buffer = self._carry + text
+        index = buffer.find(marker)
+        if index >= 0:
+            self._carry = ""
+            self.channel = CONTENT
+            before, after = buffer[:index], buffer[index + len(marker) :]
+            return [(channel, piece) for channel, piece in ((REASONING, before), (CONTENT, after)) if piece]
+
+        keep = 0
+        for length in range(min(len(marker) - 1, len(buffer)), 0, -1):
+            if marker.startswith(buffer[-length:]):
+                keep = length
+                break
+        self._carry = buffer[len(buffer) - keep :]
+        released = buffer[: len(buffer) - keep]
+        return [(REASONING, released)] if released else []
+
+    def finish(self):
+        """Flushes the held-back text at the end of the stream."""
+        carry, self._carry = self._carry, ""
+        return [(self.channel, carry)] if carry else []
+
+
+def split_thinking_text(chunks, end_thinking_text="</think>", thinking=True):
+    """
+    Wraps a stream of text chunks and yields (channel, text) pairs, channel being "reasoning"
+    or "content". Works with any iterable of strings, e.g. a Transformers `TextIteratorStreamer`
+    (which keeps special tokens such as </think> by default).
+    """
+    splitter = TextThinkingSplitter(end_thinking_text, thinking)
+    for chunk in chunks:
+        yield from splitter.feed(chunk)
+    yield from splitter.finish()
+
+
+def longest_common_prefix(a, b):
+    """Returns the length of the longest common prefix of two token sequences."""
+    length = min(len(a), len(b))
+    for index in range(length):
+        if a[index] != b[index]:
+            return index
+    return length
+
+
+def chatml_prompt(messages, add_generation_prompt=True, thinking=True):
+    """
+    Renders chat messages with the Qwen-style ChatML template of the examples.
+
+    Args:
+        messages (list of dict): Messages with "role" and "content".
+        add_generation_prompt (bool, optional): Open an assistant turn at the end (default=True).
+        thinking (bool, optional): End the generation prompt with the opening <think> (default=True).
+
+    Returns:
+        str: The prompt text.
+    """
+    text = "".join(f"<|im_start|>{message['role']}\n{message['content']}<|im_end|>\n" for message in messages)
+    if add_generation_prompt:
+        text += "<|im_start|>assistant\n" + ("<think>\n" if thinking else "")
+    return text
+
+
+class ChatTurn:
+    """
+    One turn of a multi-turn thinking session (`ThinkingChatSession` for Transformers,
+    `LlamaChatSession` for llama-cpp-python).
+
+    Attributes:
+        prompt_tokens (int): Length of the rendered prompt (answer-only history and new message).
+        reused_tokens (int): Leading prompt tokens that were already in the KV cache.
+        generated_ids (list of int): The generated tokens: thinking, end marker and answer.
+        thinking_end (int or None): Generated tokens up to and including the end marker, i.e. the
+            </think> boundary, or None when the turn never left the thinking phase.
+        reasoning (str): The thinking text, without the end marker.
+        answer (str): The answer text, the only part of the turn kept in the history.
+        time_to_first_token (float): Seconds from the start of the turn to the first generated token.
+        seconds (float): Wall time of the whole turn.
+    """
+
+    def __init__(
+        self,
+        prompt_tokens,
+        reused_tokens,
+        generated_ids,
+        thinking_end,
+        reasoning,
+        answer,
+        time_to_first_token,
+        seconds,
+    ):
+        self.prompt_tokens = prompt_tokens
+        self.reused_tokens = reused_tokens
+        self.generated_ids = generated_ids
+        self.thinking_end = thinking_end
+        self.reasoning = reasoning
+        self.answer = answer
+        self.time_to_first_token = time_to_first_token
+        self.seconds = seconds
+
+    @property
+    def prefilled_tokens(self):
+        """Prompt tokens that had to be evaluated this turn."""
+        return self.prompt_tokens - self.reused_tokens
+
+    @classmethod
+    def from_generation(cls, matcher, prompt_ids, reused_tokens, generated_ids, decode, time_to_first_token, seconds):
+        """
+        Splits the generated tokens at the first complete end marker and builds the turn.
+
+        Args:
+            matcher (EndMarkerMatcher): The matcher of the session's processors.
+            prompt_ids (list of int): The prompt, whose tail may already hold part of a marker.
+            reused_tokens (int): Leading prompt tokens found in the KV cache.
+            generated_ids (list of int): The generated tokens.
+            decode (callable): Decodes token IDs to text, without special tokens.
+            time_to_first_token (float): Seconds to the first generated token.
+            seconds (float): Wall time of the turn.
+        """
+        state, _ = matcher.scan(prompt_ids[max(len(prompt_ids) - matcher.max_length, 0) :])
+        thinking_end = None
+        for index, token in enumerate(generated_ids):
+            state = matcher.step(state, token)
+            if matcher.accepting[state]:
+                thinking_end = index + 1
+                break
+        if thinking_end is None:
+            reasoning, answer = decode(generated_ids), ""
+        else:
+            # The longest marker ending at the boundary (part of it may sit in the prompt)
+            tokens = list(prompt_ids) + list(generated_ids[:thinking_end])
+            marker = max(
+                (marker for marker in matcher.markers if tokens[len(tokens) - len(marker) :] == list(marker)), key=len
+            )
+            reasoning = decode(generated_ids[: max(thinking_end - len(marker), 0)])
+            answer = decode(generated_ids[thinking_end:]).strip()
+        return cls(
+            len(prompt_ids),
+            reused_tokens,
+            list(generated_ids),
+            thinking_end,
+            reasoning,
+            answer,
+            time_to_first_token,
+            seconds,
+        )
+
+
+class _RequestState:
+    # Mutable per-request state of a `ThinkingEffortController`
+    __slots__ = (
+        # Settings
+        "thinking_effort",
+        "scale_factor",
+        "max_thinking_tokens",
+        "schedule",
+        "schedule_fn",
+        "final_thinking_effort",
+        # The prompt's last tokens and whether it already contains a complete marker
+        "prompt_tail",
+        "prompt_matched",
+        # Progress
+        "marker_state",
+        "finished",
+        "started",
+        "thinking_tokens",
+    )
+
+
+class ThinkingEffortController:
+    """
+    Engine-agnostic thinking effort state, keyed by request ID instead of batch row.
+
+    Continuous batching engines add requests to and evict them from the running batch at any
+    step and may reorder rows, so per-row state breaks there. The controller keeps one small
+    state per request (marker automaton state, thinking-token count, settings) in a dict, so
+    `add`, `remove` and `reset` are O(1) apart from priming with the prompt, and the same
+    instance serves any number of successive requests. Thin adapters connect it to the
+    backends: `ControllerLogitsProcessor` for Transformers, `controller_logits_processor` for
+    llama-cpp-python, and `request_processor` for engines with per-request logits processors
+    taking the generated tokens.
+
+    Args:
+        end_thinking_token_id (int, optional): The end-of-thinking token ID.
+        end_markers (iterable, optional): Several and/or multi-token end markers (see
+            `EndMarkerMatcher`), instead of `end_thinking_token_id`.
+        metrics (ThinkingMetrics, optional): Registers the controller as a metrics source; each
+            record is one active request, with the request ID as `sequence`.
+        metrics_name (str, optional): The name used in the metrics records.
+        **defaults: Default settings for `add` (thinking_effort, scale_factor,
+            max_thinking_tokens, schedule, final_thinking_effort).
+    """
+
+    _SETTINGS = {
+        "thinking_effort": 1.0,
+        "scale_factor": 2,
+        "max_thinking_tokens": None,
+        "schedule": "constant",
+        "final_thinking_effort": 0.0,
+    }
+
+    def __init__(self, end_thinking_token_id=None, end_markers=None, metrics=None, metrics_name=None, **defaults):
+        if end_markers is None:
+            if end_thinking_token_id is None:
+                raise ValueError("Either end_thinking_token_id or end_markers is required")
+            end_markers = [[end_thinking_token_id]]
+        self.matcher = EndMarkerMatcher(end_markers)
+        unknown = set(defaults) - set(self._SETTINGS)
+        if unknown:
+            raise TypeError(f"Unknown settings: {sorted(unknown)}")
+        self.defaults = {**self._SETTINGS, **defaults}
+        self._requests = {}
+        if metrics is not None:
+            metrics.register(self, metrics_name)
+
+    def __contains__(self, request_id):
+        return request_id in self._requests
+
+    def __len__(self):
+        return len(self._requests)
+
+    @property
+    def request_ids(self):
+        return list(self._requests)
+
+    def add(self, request_id, prompt_tokens=None, **settings):
+        """
+        Starts tracking a request.
+
+        Args:
+            request_id (hashable): The engine's ID for the request.
+            prompt_tokens (sequence of int, optional): The prompt. It is scanned once, so a
+                prompt that already closes its thinking block (or ends inside a marker) is
+                handled. Without it the request starts in the thinking phase.
+            **settings: Overrides of the controller defaults for this request.
+        """
+        unknown = set(settings) - set(self._SETTINGS)
+        if unknown:
+            raise TypeError(f"Unknown settings: {sorted(unknown)}")
+        settings = {**self.defaults, **settings}
+        if settings["schedule"] not in (None, "constant") and settings["max_thinking_tokens"] is None:
+            raise ValueError("A non-constant effort schedule requires max_thinking_tokens")
+
+        state = _RequestState()
+        for name, value in settings.items():
+            setattr(state, name, value)
+        state.schedule_fn = get_effort_schedule(state.schedule)
+        state.prompt_tail = [int(token) for token in (prompt_tokens or ())]
+        state.prompt_matched = self.matcher.scan(state.prompt_tail)[1]
+        # Only the tail matters from now on (see `reset`)
+        state.prompt_tail = state.prompt_tail[-self.matcher.max_length :]
+        self._requests[request_id] = state
+        self._restart(state)
+
+    def _restart(self, state):
+        state.marker_state = self.matcher.scan(state.prompt_tail)[0]
+        state.finished = state.prompt_matched
+        state.started = False
+        state.thinking_tokens = 0
+
+    def remove(self, request_id):
+        """Stops tracking a request (finished, cancelled or evicted). Unknown IDs are ignored."""
+        self._requests.pop(request_id, None)
+
+    def reset(self, request_id=None):
+        """Restarts one request (e.g. after preemption with recomputation), or all of them."""
+        states = self._requests.values() if request_id is None else [self._requests[request_id]]
+        for state in states:
+            self._restart(state)
+
+    def observe(self, request_id, token):
+        """
+        Reports the last token of a request's sequence before its next sampling step, for
+        adapters called once per step. The first call after `add` sees the end of the prompt
+        and is ignored; every later call consumes one generated token.
+        """
+        state = self._requests[request_id]
+        if not state.started:
+            state.started = True
+        elif not state.finished:
+            self._consume(state, int(token))
+
+    def sync(self, request_id, output_token_ids):
+        """
+        Reports all tokens generated so far for a request, for interfaces that pass them
+        (rather than the prompt-prefixed sequence). Only the tokens not consumed yet are fed,
+        so skipped steps are fine; a shorter list (rolled back) replays it from the prompt.
+        """
+        state = self._requests[request_id]
+        state.started = True
+        if len(output_token_ids) < state.thinking_tokens:
+            self._restart(state)
+            state.started = True
+        if state.finished:
+            return
+        for token in output_token_ids[state.thinking_tokens :]:
+            self._consume(state, int(token))
+            if state.finished:
+                break
+
+    def _consume(self, state, token):
+        state.thinking_tokens += 1
+        state.marker_state = self.matcher.step(state.marker_state, token)
+        state.finished = self.matcher.accepting[state.marker_state]
+
+    def bias(self, request_id):
+        """
+        Returns what to do to the next-token logits of a request: None once it left the
+        thinking phase, otherwise (token_ids, multiplier, forced) where `token_ids` are the
+        tokens continuing the end marker, `multiplier` the scale for their logits, and `forced`
+        whether the budget is spent (every other token must be masked out).
+        """
+        state = self._requests[request_id]
+        if state.finished:
+            return None
+        token_ids = self.matcher.next_tokens[state.marker_state]
+        budget = state.max_thinking_tokens
+        if budget is not None and state.thinking_tokens >= budget:
+            return token_ids, 1.0, True
+        effort = state.thinking_effort
+        if state.schedule not in (None, "constant"):
+            progress = min(state.thinking_tokens / budget, 1.0)
+            effort = scheduled_effort(state.thinking_effort, state.final_thinking_effort, progress, state.schedule_fn)
+        return token_ids, effort_to_scale(effort, state.scale_factor), False
+
+    def apply(self, request_id, logits):
+        """
+        Applies `bias` to a 1-D logits array of the request (NumPy array, torch tensor or any
+        object supporting item access and `logits[:] = value`), in place. Returns the logits.
+        """
+        action = self.bias(request_id)
+        if action is None:
+            return logits
+        token_ids, multiplier, forced = action
+        if forced:
+            logits[:] = float("-inf")
+            for token in token_ids:
+                logits[token] = 0.0
+            return logits
+        for token in token_ids:
+            logits[token] = logits[token] * multiplier
+        return logits
+
+    def request_processor(self, request_id):
+        """
+        Returns a per-request logits processor `(output_token_ids, logits) -> logits`, the
+        interface of engines that call one processor per request with the tokens it generated.
+        """
+
+        def processor(output_token_ids, logits):
+            self.sync(request_id, output_token_ids)
+            return self.apply(request_id, logits)
+
+        return processor
+
+    def state_dict(self, request_id):
+        """
+        Returns the state of a request as a small JSON-serializable dict (settings, prompt tail,
+        automaton state, thinking-token count), e.g. to store next to the KV cache of a preempted
+        request. A callable `schedule` is stored as is and makes the dict non-serializable.
+        """
+        state = self._requests[request_id]
+        return {
+            "version": STATE_DICT_VERSION,
+            **{name: getattr(state, name) for name in self._SETTINGS},
+            "prompt_tail": list(state.prompt_tail),
+            "prompt_matched": state.prompt_matched,
+            "marker_state": state.marker_state,
+            "finished": state.finished,
+            "started": state.started,
+            "thinking_tokens": state.thinking_tokens,
+        }
+
+    def load_state_dict(self, request_id, state_dict):
+        """
+        Starts tracking a request from a `state_dict` record (replacing any state it had), in
+        O(1): nothing is rescanned, and the next `observe`/`sync` call continues exactly where
+        the record was taken.
+        """
+        _check_state_dict_version(state_dict)
+        state = _RequestState()
+        for name in self._SETTINGS:
+            setattr(state, name, state_dict[name])
+        state.schedule_fn = get_effort_schedule(state.schedule)
+        for name in ("prompt_tail", "prompt_matched", "marker_state", "finished", "started", "thinking_tokens"):
+            setattr(state, name, state_dict[name])
+        state.prompt_tail = list(state.prompt_tail)
+        self._requests[request_id] = state
+
+    def stats(self, request_id):
+        """Returns the thinking_tokens, finished and end_step of a request."""
+        state = self._requests[request_id]
+        return {
+            "thinking_tokens": state.thinking_tokens,
+            "finished": state.finished,
+            "end_step": end_step_from_counts(state.thinking_tokens, state.finished),
+        }
+
+    def metrics_records(self):
+        """One telemetry record per active request (see `ThinkingMetrics`)."""
+        return [
+            {
+                "sequence": str(request_id),
+                "thinking_effort": state.thinking_effort,
+                "scale_factor": state.scale_factor,
+                "processor_seconds": 0.0,
+                **self.stats(request_id),
+            }
+            for request_id, state in self._requests.items()
+        ]
+
+
+class ThinkingMetrics:
+    """
+    Opt-in telemetry for the thinking effort processors.
+
+    Pass an instance as `metrics=` to `IncrementalThinkingEffortProcessor` or
+    `thinking_effort_processor`. The processors register themselves and time every call, but
+    per-sequence figures are only read (and, for torch, copied to the host) when `collect()`
+    or `export()` is called, so the generation loop never blocks on telemetry.
+
+    Args:
+        exporters (list, optional):
+            `MetricsExporter` instances (or plain callables taking the list of records) that
+            `export()` feeds.
+        step_hooks (list, optional):
+            Callables invoked after every processor call as `hook(source_name, seconds)`.
+            They run on the hot path, so keep them cheap.
+        labels (dict, optional):
+            Constant labels added to every record, e.g. `{"model": "qwq-32b"}`.
+
+    Each record is a dict with the keys: processor, sequence, thinking_effort, scale_factor,
+    thinking_tokens, finished, end_step and processor_seconds (the cumulative wall time spent
+    in the processor while the sequence was generated), plus the constant labels. Processors
+    with repetition detection also report repetition_score and loop_steps.
+    """
+
+    def __init__(self, exporters=None, step_hooks=None, labels=None):
+        self.exporters = [
+            exporter if isinstance(exporter, MetricsExporter) else CallbackExporter(exporter)
+            for exporter in (exporters or [])
+        ]
+        self.step_hooks = list(step_hooks or [])
+        self.labels = dict(labels or {})
+        self._sources = {}
+
+    def register(self, source, name=None):
+        """
+        Registers a metrics source, i.e. an object with a `metrics_records()` method returning
+        the per-sequence records. Returns the name the source is reported under.
+        """
+        if name is None:
+            name = f"processor{len(self._sources)}"
+        self._sources[name] = source
+        return name
+
+    def unregister(self, name):
+        self._sources.pop(name, None)
+
+    def record_step(self, name, seconds):
+        """Called by the processors after each call."""
+        for hook in self.step_hooks:
+            hook(name, seconds)
+
+    def collect(self):
+        """Returns the current records of every registered source."""
+        records = []
+        for name, source in self._sources.items():
+            for record in source.metrics_records():
+                records.append({**self.labels, "processor": name, **record})
+        return records
+
+    def export(self):
+        """Collects the records once and hands them to every exporter. Returns the records."""
+        records = self.collect()
+        for exporter in self.exporters:
+            exporter.export(records)
+        return records
+
+
+class MetricsExporter:
+    """Base class for metrics exporters: `export(records)` receives the list of records."""
+
+    def export(self, records):
+        raise NotImplementedError(f"{self.__class__} must implement export()")
+
+
+class CallbackExporter(MetricsExporter):
+    """Adapts a plain callable taking the list of records into an exporter."""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def export(self, records):
+        self.callback(records)
+
+
+def _prometheus_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_prometheus(records, prefix="thinking_effort"):
+    """
+    Renders metrics records in the Prometheus text exposition format.
+
+    Every per-sequence figure becomes a gauge labelled with the record's string fields
+    (processor, sequence and the constant labels). No client library is needed.
+    """
+    gauges = [
+        ("thinking_tokens", "Tokens generated during the thinking phase.", lambda r: r["thinking_tokens"]),
+        ("finished", "Whether the sequence left the thinking phase (1) or not (0).", lambda r: int(r["finished"])),
+        ("end_step", "Generation step at which the end-of-thinking marker was emitted.", lambda r: r["end_step"]),
+        ("thinking_effort", "Thinking effort requested for the sequence.", lambda r: r["thinking_effort"]),
+        ("scale_factor", "Scale factor requested for the sequence.", lambda r: r["scale_factor"]),
+        ("processor_seconds", "Cumulative wall time spent in the processor.", lambda r: r["processor_seconds"]),
+        ("repetition_score", "Fraction of repeated n-grams in the recent window.", lambda r: r.get("repetition_score")),
+        ("loop_steps", "Steps during which a repetition loop was detected.", lambda r: r.get("loop_steps")),
+        ("confidence", "Smoothed top-k confidence driving the adaptive effort.", lambda r: r.get("confidence")),
+    ]
+    numeric = {name for name, _, _ in gauges}
+
+    lines = []
+    for name, help_text, value_of in gauges:
+        metric = f"{prefix}_{name}"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        for record in records:
+            value = value_of(record)
+            if value is None:
+                continue
+            labels = ",".join(
+                f'{key}="{_prometheus_label_value(label)}"'
+                for key, label in sorted(record.items())
+                if key not in numeric
+            )
+            lines.append(f"{metric}{{{labels}}} {float(value):g}")
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusTextExporter(MetricsExporter):
+    """
+    Writes the records in the Prometheus text format, e.g. for the node_exporter textfile
+    collector. Works offline: nothing is served, the text is just produced.
+
+    Args:
+        path (str, optional): File to (atomically) overwrite on every export. When None, the
+            text is only kept in `last_output`.
+        prefix (str, optional): Metric name prefix (default="thinking_effort").
+    """
+
+    def __init__(self, path=None, prefix="thinking_effort"):
+        self.path = path
+        self.prefix = prefix
+        self.last_output = ""
+
+    def export(self, records):
+        self.last_output = format_prometheus(records, self.prefix)
+        if self.path is not None:
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                f.write(self.last_output)
+            os.replace(temporary_path, self.path)
+        return self.last_output
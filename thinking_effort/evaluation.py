@@ -0,0 +1,685 @@
+"""
+Effort-sweep evaluation harness: runs a prompt set at a grid of `thinking_effort` /
+`scale_factor` settings and records thinking length, latency and answer quality per run.
+
+Runs are written to a JSONL file as they complete, one record per line, so an interrupted
+sweep resumes where it stopped: on restart, runs whose ID is already in the file (for the same
+model and generation settings) are skipped. The grid itself is not part of that check, so a
+finished sweep can be extended with new efforts by running it again. The work is spread either
+across a process pool (`--workers`, one model per worker) or across batched rows of one model
+(`--batch-size`, rows of one batch share the prompt and carry per-row efforts), or both.
+
+The report groups the runs by setting and marks the latency/quality Pareto frontier (or the
+latency/thinking-length one when the prompts have no reference answers):
+
+    python -m thinking_effort.evaluation --tiny-random --efforts 0 0.5 1 1.5 --scale-factors 2 4 --output sweep.jsonl
+    python -m thinking_effort.evaluation --model deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B --prompts prompts.jsonl \
+        --efforts 0 0.25 0.5 1 --batch-size 8 --output sweep.jsonl
+    python -m thinking_effort.evaluation --gguf qwq.gguf --end-thinking-token-id 151668 --prompts prompts.txt \
+        --workers 4 --output sweep.jsonl
+
+Prompt files are either plain text (one prompt per line) or JSONL with a "prompt" and an
+optional "reference" (a string or a list of accepted answers). `--tiny-random` uses a tiny
+randomly initialized model and a few built-in prompts, so the whole pipeline runs without a
+download (the answers are of course meaningless).
+"""
+import argparse
+import concurrent.futures
+import copy
+import functools
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import re
+import time
+import zlib
+from collections.abc import Mapping
+
+TINY_RANDOM_PROMPTS = [
+    {"prompt": "What is 2 + 2?", "reference": "4"},
+    {"prompt": "Name the capital of France.", "reference": "Paris"},
+    {"prompt": "Is 17 a prime number? Answer yes or no.", "reference": "yes"},
+    {"prompt": "Spell the word 'cat' backwards.", "reference": "tac"},
+]
+
+
+def load_prompts(path):
+    """
+    Reads a prompt file.
+
+    Files ending in .jsonl hold one JSON object per line with a "prompt" and an optional
+    "reference"; anything else is plain text with one prompt per line.
+
+    Returns:
+        list of dict: Each with "prompt" and "reference" (None when there is none).
+    """
+    prompts = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                data = json.loads(line)
+                prompts.append({"prompt": data["prompt"], "reference": data.get("reference")})
+            else:
+                prompts.append({"prompt": line, "reference": None})
+    return prompts
+
+
+def sweep_grid(num_prompts, efforts, scale_factors=(2,), repeats=1):
+    """
+    Returns the runs of a sweep: every prompt at every (thinking_effort, scale_factor), `repeats` times.
+
+    Each run has a stable "run_id" derived from its coordinates, which is what resuming matches on.
+    """
+    runs = []
+    for scale_factor in scale_factors:
+        for thinking_effort in efforts:
+            for prompt_index in range(num_prompts):
+                for repeat in range(repeats):
+                    runs.append(
+                        {
+                            "run_id": f"p{prompt_index}-e{thinking_effort:g}-s{scale_factor:g}-r{repeat}",
+                            "prompt_index": prompt_index,
+                            "thinking_effort": thinking_effort,
+                            "scale_factor": scale_factor,
+                            "repeat": repeat,
+                        }
+                    )
+    return runs
+
+
+def _normalize(text):
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def contains_score(answer, reference):
+    """
+    Default quality score: 1.0 when a normalized reference (lowercase, punctuation removed)
+    appears in the normalized answer, else 0.0. A run that never left the thinking phase has no
+    answer and scores 0.0; without a reference the score is None.
+
+    Args:
+        answer (str or None): The text after the end of thinking.
+        reference (str, list of str or None): The accepted answer(s).
+    """
+    if reference is None:
+        return None
+    if answer is None:
+        return 0.0
+    references = [reference] if isinstance(reference, str) else reference
+    answer = f" {_normalize(answer)} "
+    return float(any(f" {_normalize(r)} " in answer for r in references))
+
+
+class ResultsLog:
+    """
+    Append-only JSONL log of sweep records, which doubles as the checkpoint.
+
+    Every record carries the fingerprint of the sweep configuration (model, generation settings,
+    prompts); records of another configuration are ignored when resuming. Each record is flushed
+    and fsynced on its own, and a truncated last line (a crash mid-write) is dropped on load.
+
+    Args:
+        path (str): The JSONL file.
+        config (dict): The JSON-serializable sweep configuration.
+    """
+
+    def __init__(self, path, config):
+        self.path = path
+        self.config = config
+        self.fingerprint = hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def load(self):
+        """Returns the records of this configuration already in the file."""
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding="utf-8") as f:
+            lines = f.read().split("\n")
+        records = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Only the last line can be partial; anything after it would be a new record
+                continue
+            if record.get("fingerprint") == self.fingerprint:
+                records.append(record)
+        if lines and lines[-1]:
+            # Terminate a partial last line, so the next record starts on a line of its own
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n")
+        return records
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def append(self, record):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({**record, "fingerprint": self.fingerprint}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _run_seed(seed, run):
+    # Depends only on the run, so its result does not depend on its batch, worker or resume
+    return (seed + zlib.crc32(run["run_id"].encode("utf-8"))) % 2**31
+
+
+# Sampling parameters of `generate` that `TransformersRunner` applies itself, row by row
+_SAMPLING_KWARGS = {"do_sample", "temperature", "top_k", "top_p"}
+
+
+def _row_sampler(generators, generation_config):
+    # A logits processor sampling each row with its own generator, after the temperature, top-k
+    # and top-p warpers of `generation_config`; every other token is set to -inf, so greedy
+    # decoding in `generate` then picks the sampled one
+    import torch
+    from transformers import TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper
+
+    warpers = []
+    if generation_config.temperature is not None and generation_config.temperature != 1.0:
+        warpers.append(TemperatureLogitsWarper(generation_config.temperature))
+    if generation_config.top_k:
+        warpers.append(TopKLogitsWarper(generation_config.top_k))
+    if generation_config.top_p is not None and generation_config.top_p < 1.0:
+        warpers.append(TopPLogitsWarper(generation_config.top_p))
+
+    def sample(input_ids, scores):
+        for warper in warpers:
+            scores = warper(input_ids, scores)
+        probs = scores.float().softmax(dim=-1)
+        tokens = torch.stack(
+            [torch.multinomial(probs[row], 1, generator=generator) for row, generator in enumerate(generators)]
+        )
+        return torch.full_like(scores, float("-inf")).scatter_(1, tokens, 0.0)
+
+    return sample
+
+
+class TransformersRunner:
+    """
+    Runs sweep rows on a Hugging Face model with an `IncrementalThinkingEffortProcessor`.
+
+    All rows of one call share the prompt, so they run as one batch without padding, each with
+    its own effort, scale factor and seed: when sampling, every row draws from its own random
+    generator, so a run's output does not depend on the runs batched with it. Per-row latency is the time until the row emitted its last
+    token (its EOS), read from a per-step clock, so rows that finish early are not charged for
+    the rest of the batch.
+
+    Args:
+        model: The causal LM.
+        tokenizer: Its tokenizer (chat template, decoding and EOS).
+        end_thinking_token_id (int): The end-of-thinking token ID.
+        max_new_tokens (int, optional): Generation budget per run (default=2048).
+        **generate_kwargs: Passed to `model.generate` (e.g. do_sample, temperature).
+    """
+
+    def __init__(self, model, tokenizer, end_thinking_token_id, max_new_tokens=2048, **generate_kwargs):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.end_thinking_token_id = end_thinking_token_id
+        self.max_new_tokens = max_new_tokens
+        self.generate_kwargs = generate_kwargs
+
+    def encode(self, prompt):
+        input_ids = self.tokenizer.apply_chat_template(
+            [{"role": "user", "content": prompt}], add_generation_prompt=True, return_tensors="pt"
+        )
+        if isinstance(input_ids, Mapping):
+            input_ids = input_ids["input_ids"]
+        return input_ids
+
+    def __call__(self, prompt, runs, seeds):
+        """
+        Args:
+            prompt (str): The prompt shared by the rows.
+            runs (list of dict): The rows, each with "thinking_effort" and "scale_factor".
+            seeds (list of int): Sampling seed of each row.
+
+        Returns:
+            list of dict: Per row, "thinking_tokens", "thinking_finished", "output_tokens",
+            "latency_seconds" and "answer".
+        """
+        import torch
+
+        from .transformers_backend import IncrementalThinkingEffortProcessor
+
+        input_ids = self.encode(prompt).repeat(len(runs), 1)
+        processor = IncrementalThinkingEffortProcessor(
+            self.end_thinking_token_id,
+            thinking_effort=[run["thinking_effort"] for run in runs],
+            scale_factor=[run["scale_factor"] for run in runs],
+        )
+        clock = []
+
+        def step_clock(_, scores):
+            clock.append(time.perf_counter())
+            return scores
+
+        logits_processor = [processor, step_clock]
+        generate_kwargs = {key: value for key, value in self.generate_kwargs.items() if key not in _SAMPLING_KWARGS}
+        config = copy.deepcopy(self.model.generation_config)
+        config.update(**self.generate_kwargs)
+        if config.do_sample:
+            generators = [torch.Generator(device=self.model.device).manual_seed(seed) for seed in seeds]
+            logits_processor.append(_row_sampler(generators, config))
+        start = time.perf_counter()
+        with torch.no_grad():
+            output = self.model.generate(
+                input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                max_new_tokens=self.max_new_tokens,
+                logits_processor=logits_processor,
+                pad_token_id=self.tokenizer.pad_token_id,
+                do_sample=False,
+                **generate_kwargs,
+            )
+        end = time.perf_counter()
+        prompt_tokens = input_ids[0].tolist()
+        results = []
+        for row, generated in enumerate(output[:, input_ids.shape[1] :].tolist()):
+            length = len(generated)
+            if self.tokenizer.eos_token_id in generated:
+                length = generated.index(self.tokenizer.eos_token_id) + 1
+            generated = generated[:length]
+            thinking_end = processor.matcher.find_end(generated, prompt_tokens)
+            answer = None
+            if thinking_end is not None:
+                answer = self.tokenizer.decode(generated[thinking_end:], skip_special_tokens=True).strip()
+            results.append(
+                {
+                    "thinking_tokens": int(processor.thinking_tokens[row]) if thinking_end is not None else length,
+                    "thinking_finished": thinking_end is not None,
+                    "output_tokens": length,
+                    # The clock ticks before each sampling step, so tick `length` follows the row's last token
+                    "latency_seconds": (clock[length] if length < len(clock) else end) - start,
+                    "answer": answer,
+                }
+            )
+        return results
+
+
+class LlamaCppRunner:
+    """
+    Runs sweep rows on a llama-cpp-python `Llama` with the `thinking_effort_processor` closure.
+
+    llama-cpp-python has no batched sampling, so the rows of a call run one after another.
+
+    Args:
+        llm (llama_cpp.Llama): The model.
+        end_thinking_token_id (int): The end-of-thinking token ID.
+        max_tokens (int, optional): Generation budget per run (default=2048).
+        prompt_template (str, optional): Formats the prompt into a completion prompt (default:
+            ChatML with an opened thinking block).
+        end_thinking_text (str, optional): The text of the end-of-thinking marker (default="</think>").
+        **completion_kwargs: Passed to `create_completion` (e.g. temperature).
+    """
+
+    def __init__(
+        self,
+        llm,
+        end_thinking_token_id,
+        max_tokens=2048,
+        prompt_template="<|im_start|>user\n{prompt}<|im_end|>\n<|im_start|>assistant\n<think>\n",
+        end_thinking_text="</think>",
+        **completion_kwargs,
+    ):
+        self.llm = llm
+        self.end_thinking_token_id = end_thinking_token_id
+        self.max_tokens = max_tokens
+        self.prompt_template = prompt_template
+        self.end_thinking_text = end_thinking_text
+        self.completion_kwargs = completion_kwargs
+
+    def __call__(self, prompt, runs, seeds):
+        """Same contract as `TransformersRunner.__call__`."""
+        from .core import ThinkingMetrics, split_thinking_text
+        from .llamacpp_backend import thinking_effort_processor
+
+        results = []
+        for run, seed in zip(runs, seeds):
+            metrics = ThinkingMetrics()
+            processor = thinking_effort_processor(
+                run["thinking_effort"], self.end_thinking_token_id, run["scale_factor"], metrics=metrics
+            )
+            start = time.perf_counter()
+            completion = self.llm.create_completion(
+                self.prompt_template.format(prompt=prompt),
+                max_tokens=self.max_tokens,
+                logits_processor=[processor],
+                seed=seed,
+                **self.completion_kwargs,
+            )
+            latency = time.perf_counter() - start
+            record = metrics.collect()[0]
+            channels = {"reasoning": "", "content": ""}
+            for channel, text in split_thinking_text([completion["choices"][0]["text"]], self.end_thinking_text):
+                channels[channel] += text
+            results.append(
+                {
+                    "thinking_tokens": record["thinking_tokens"],
+                    "thinking_finished": record["finished"],
+                    "output_tokens": completion["usage"]["completion_tokens"],
+                    "latency_seconds": latency,
+                    "answer": channels["content"].strip() if record["finished"] else None,
+                }
+            )
+        return results
+
+
+def build_runner(config):
+    """
+    Builds a runner from a sweep configuration, as produced by the command line.
+
+    Module-level and driven by plain data, so `functools.partial(build_runner, config)` can be
+    sent to pool workers, each of which builds its own model.
+
+    Args:
+        config (dict): "source" ("tiny-random", "transformers" or "gguf"), "model",
+            "end_thinking_token_id", "max_new_tokens", "temperature" and "threads" (optional).
+    """
+    if config["source"] == "gguf":
+        from llama_cpp import Llama
+
+        llm = Llama(
+            model_path=config["model"],
+            n_ctx=config["max_new_tokens"] + 4096,
+            n_threads=config.get("threads"),
+            verbose=False,
+        )
+        return LlamaCppRunner(
+            llm, config["end_thinking_token_id"], config["max_new_tokens"], temperature=config["temperature"]
+        )
+
+    import torch
+
+    if config.get("threads"):
+        torch.set_num_threads(config["threads"])
+    if config["source"] == "tiny-random":
+        from .transformers_backend import ByteTokenizer, build_tiny_random_model
+
+        tokenizer = ByteTokenizer()
+        model = build_tiny_random_model(vocab_size=tokenizer.vocab_size)
+    else:
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(config["model"])
+        model = AutoModelForCausalLM.from_pretrained(config["model"], torch_dtype="auto").eval()
+    end_thinking_token_id = config.get("end_thinking_token_id")
+    if end_thinking_token_id is None:
+        end_thinking_token_id = tokenizer.convert_tokens_to_ids("</think>")
+    return TransformersRunner(
+        model, tokenizer, end_thinking_token_id, config["max_new_tokens"], do_sample=True, temperature=config["temperature"]
+    )
+
+
+# The runner of a pool worker, built once by `_init_worker`
+_worker_runner = None
+
+
+def _init_worker(runner_factory):
+    global _worker_runner
+    _worker_runner = runner_factory()
+
+
+def _run_batch(runner, prompt, runs, seed):
+    start = time.time()
+    seeds = [_run_seed(seed, run) for run in runs]
+    results = runner(prompt, runs, seeds)
+    return [
+        {**run, **result, "seed": run_seed, "batch_size": len(runs), "started": start}
+        for run, result, run_seed in zip(runs, results, seeds)
+    ]
+
+
+def _run_batch_in_worker(prompt, runs, seed):
+    return _run_batch(_worker_runner, prompt, runs, seed)
+
+
+def _batches(runs, batch_size):
+    # Rows of a batch share the prompt; runs keep their order otherwise
+    by_prompt = {}
+    for run in runs:
+        by_prompt.setdefault(run["prompt_index"], []).append(run)
+    for prompt_runs in by_prompt.values():
+        for index in range(0, len(prompt_runs), batch_size):
+            yield prompt_runs[index : index + batch_size]
+
+
+def run_sweep(
+    runner_factory,
+    prompts,
+    runs,
+    log,
+    workers=0,
+    batch_size=1,
+    seed=0,
+    score_fn=contains_score,
+    restart=False,
+    on_record=None,
+):
+    """
+    Runs the pending runs of a sweep and appends their records to `log`.
+
+    Args:
+        runner_factory (callable): Returns a runner (`TransformersRunner`, `LlamaCppRunner` or any
+            callable with the same contract). Called once in-process, or once per worker; with
+            workers it must be picklable (e.g. `functools.partial(build_runner, config)`).
+        prompts (list of dict): As returned by `load_prompts`.
+        runs (list of dict): As returned by `sweep_grid`.
+        log (ResultsLog): Where the records go; runs already in it are skipped.
+        workers (int, optional): Size of the process pool, 0 runs in-process (default=0).
+        batch_size (int, optional): Rows per batch (default=1).
+        seed (int, optional): Base sampling seed (default=0); each run's seed is derived from it
+            and the run ID.
+        score_fn (callable, optional): `score_fn(answer, reference) -> float or None`.
+        restart (bool, optional): Discard the existing records instead of resuming.
+        on_record (callable, optional): Called with each new record, e.g. for progress output.
+
+    Returns:
+        list of dict: All records of the sweep, resumed and new.
+    """
+    if restart:
+        log.clear()
+    records = log.load()
+    done = {record["run_id"] for record in records}
+    pending = [run for run in runs if run["run_id"] not in done]
+    batches = list(_batches(pending, max(1, batch_size)))
+
+    def finish(batch_records):
+        for record in batch_records:
+            reference = prompts[record["prompt_index"]].get("reference")
+            record["quality"] = score_fn(record["answer"], reference)
+            log.append(record)
+            records.append(record)
+            if on_record is not None:
+                on_record(record)
+
+    if workers > 0 and batches:
+        context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=context, initializer=_init_worker, initargs=(runner_factory,)
+        ) as executor:
+            futures = [
+                executor.submit(_run_batch_in_worker, prompts[batch[0]["prompt_index"]]["prompt"], batch, seed)
+                for batch in batches
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                finish(future.result())
+    elif batches:
+        runner = runner_factory()
+        for batch in batches:
+            finish(_run_batch(runner, prompts[batch[0]["prompt_index"]]["prompt"], batch, seed))
+    return records
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+def summarize(records):
+    """
+    Aggregates sweep records per (scale_factor, thinking_effort) and marks the Pareto frontier.
+
+    A setting is on the frontier when no other setting is at least as fast (mean latency) and at
+    least as good, and strictly better in one of the two. "Good" is the mean quality when the
+    records are scored, else the mean thinking length (how much thinking the latency buys).
+
+    Returns:
+        list of dict: One row per setting, sorted by scale factor and effort.
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault((record["scale_factor"], record["thinking_effort"]), []).append(record)
+    rows = []
+    for (scale_factor, thinking_effort), group in sorted(groups.items()):
+        latencies = [record["latency_seconds"] for record in group]
+        scores = [record["quality"] for record in group if record.get("quality") is not None]
+        output_tokens = sum(record["output_tokens"] for record in group)
+        rows.append(
+            {
+                "thinking_effort": thinking_effort,
+                "scale_factor": scale_factor,
+                "runs": len(group),
+                "thinking_tokens": sum(record["thinking_tokens"] for record in group) / len(group),
+                "finished": sum(bool(record["thinking_finished"]) for record in group) / len(group),
+                "latency_seconds": sum(latencies) / len(group),
+                "latency_p50": _percentile(latencies, 0.5),
+                "latency_p90": _percentile(latencies, 0.9),
+                "tokens_per_second": output_tokens / sum(latencies) if sum(latencies) else 0.0,
+                "quality": sum(scores) / len(scores) if scores else None,
+            }
+        )
+    scored = all(row["quality"] is not None for row in rows)
+    objective = "quality" if scored else "thinking_tokens"
+    for row in rows:
+        row["frontier"] = not any(
+            other["latency_seconds"] <= row["latency_seconds"]
+            and other[objective] >= row[objective]
+            and (other["latency_seconds"] < row["latency_seconds"] or other[objective] > row[objective])
+            for other in rows
+        )
+    return rows
+
+
+def format_report(rows):
+    """Formats `summarize` rows as a table, frontier settings marked with "*"."""
+    lines = [
+        f"{'scale':>6}{'effort':>8}{'runs':>6}{'think tok':>11}{'finished':>10}{'lat mean':>10}"
+        f"{'lat p50':>9}{'lat p90':>9}{'tok/s':>8}{'quality':>9}  frontier"
+    ]
+    for row in rows:
+        quality = "-" if row["quality"] is None else f"{row['quality']:.3f}"
+        lines.append(
+            f"{row['scale_factor']:>6g}{row['thinking_effort']:>8g}{row['runs']:>6}{row['thinking_tokens']:>11.1f}"
+            f"{row['finished']:>10.0%}{row['latency_seconds']:>10.3f}{row['latency_p50']:>9.3f}"
+            f"{row['latency_p90']:>9.3f}{row['tokens_per_second']:>8.1f}{quality:>9}  {'*' if row['frontier'] else ''}"
+        )
+    return "\n".join(lines)
+
+
+def _file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--model", help="Hugging Face model name or path")
+    source.add_argument("--gguf", help="Path to a GGUF model (llama-cpp-python)")
+    source.add_argument("--tiny-random", action="store_true", help="Tiny random model and built-in prompts (no download)")
+    parser.add_argument("--prompts", help="Prompt file, .txt (one per line) or .jsonl with prompt/reference")
+    parser.add_argument("--output", required=True, help="JSONL file for the run records (resumed if it exists)")
+    parser.add_argument("--restart", action="store_true", help="Discard existing records instead of resuming")
+    parser.add_argument("--end-thinking-token-id", type=int, help="</think> token id (default: looked up)")
+    parser.add_argument("--efforts", type=float, nargs="+", default=[0.0, 0.5, 1.0, 1.5])
+    parser.add_argument("--scale-factors", type=float, nargs="+", default=[2.0])
+    parser.add_argument("--repeats", type=int, default=1, help="Runs per prompt and setting")
+    parser.add_argument("--max-new-tokens", type=int, help="Generation budget (default: 2048, 64 with --tiny-random)")
+    parser.add_argument("--temperature", type=float, default=0.6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=0, help="Process pool size, one model per worker (default: in-process)")
+    parser.add_argument("--batch-size", type=int, default=1, help="Rows per batch (Transformers only)")
+    parser.add_argument("--threads", type=int, help="Threads per model (default: CPU count / workers)")
+    parser.add_argument("--summary", help="Also write the report rows as JSON to this file")
+    args = parser.parse_args()
+
+    if args.tiny_random:
+        source_name, model = "tiny-random", None
+    elif args.model:
+        source_name, model = "transformers", args.model
+    else:
+        source_name, model = "gguf", os.path.abspath(args.gguf)
+        if args.end_thinking_token_id is None:
+            parser.error("--end-thinking-token-id is required with --gguf")
+        if args.batch_size > 1:
+            parser.error("--batch-size needs a Transformers model; use --workers with --gguf")
+    if args.prompts:
+        prompts = load_prompts(args.prompts)
+        prompts_id = _file_digest(args.prompts)
+    elif args.tiny_random:
+        prompts, prompts_id = TINY_RANDOM_PROMPTS, "tiny-random"
+    else:
+        parser.error("--prompts is required")
+    threads = args.threads
+    if threads is None and args.workers > 0:
+        threads = max(1, (os.cpu_count() or 1) // args.workers)
+    config = {
+        "source": source_name,
+        "model": model,
+        "end_thinking_token_id": args.end_thinking_token_id,
+        "max_new_tokens": args.max_new_tokens or (64 if args.tiny_random else 2048),
+        "temperature": args.temperature,
+        "seed": args.seed,
+        "prompts": prompts_id,
+        "threads": threads,
+    }
+    # Parallelism does not change what a run measures, so it stays out of the fingerprint
+    log = ResultsLog(args.output, {key: value for key, value in config.items() if key != "threads"})
+    runs = sweep_grid(len(prompts), args.efforts, args.scale_factors, args.repeats)
+
+    progress = {"count": 0}
+
+    def on_record(record):
+        progress["count"] += 1
+        print(
+            f"[{progress['count']}] {record['run_id']}: {record['thinking_tokens']} thinking tokens, "
+            f"{record['latency_seconds']:.2f}s",
+            flush=True,
+        )
+
+    start = time.perf_counter()
+    records = run_sweep(
+        functools.partial(build_runner, config),
+        prompts,
+        runs,
+        log,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        seed=args.seed,
+        restart=args.restart,
+        on_record=on_record,
+    )
+    print(f"{progress['count']} new runs in {time.perf_counter() - start:.1f}s, {len(records)} records in {args.output}\n")
+    run_ids = {run["run_id"] for run in runs}
+    rows = summarize([record for record in records if record["run_id"] in run_ids])
+    print(format_report(rows))
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
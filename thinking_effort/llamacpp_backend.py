@@ -0,0 +1,1164 @@
+import itertools
+import math
+import threading
+import time
+import uuid
+import weakref
+from collections.abc import Mapping
+
+import numpy as np
+
+from .core import (
+    STATE_DICT_VERSION,
+    ChatTurn,
+    EndMarkerMatcher,
+    IncrementalDetokenizer,
+    RepetitionDetector,
+    ThinkingSplitter,
+    TextThinkingSplitter,
+    _check_state_dict_version,
+    chatml_prompt,
+    effort_to_scale,
+    end_step_from_counts,
+    get_effort_schedule,
+    longest_common_prefix,
+    scheduled_effort,
+)
+
+
+def _last_token_ids(input_ids, count=1):
+    """
+    Extracts the last `count` token IDs of `input_ids` (all of them when `count` is None) as a
+    list of Python ints.
+
+    llama-cpp may pass `input_ids` as either a Python list or a NumPy array (possibly with
+    shape (batch, seq_length)), so the tokens are extracted carefully and converted to Python
+    ints. This avoids errors when comparing them to token IDs.
+    """
+    if isinstance(input_ids, list):
+        tokens = input_ids[-count:] if count is not None else input_ids
+    elif hasattr(input_ids, "shape"):
+        # shape could be (seq_length,) or (batch, seq_length)
+        if len(input_ids.shape) == 2:
+            # Last row
+            input_ids = input_ids[-1]
+        tokens = input_ids[-count:] if count is not None else input_ids
+    else:
+        # fallback if it's just a scalar or another structure
+        tokens = [input_ids]
+    # Convert from scalar array to Python int
+    return [int(token) for token in tokens]
+
+
+def thinking_effort_processor(
+    thinking_effort,
+    end_thinking_token_id,
+    scale_factor=2,
+    max_thinking_tokens=None,
+    schedule="constant",
+    final_thinking_effort=0.0,
+    end_markers=None,
+    metrics=None,
+    metrics_name=None,
+    repetition_ngram_size=None,
+    repetition_window=256,
+    repetition_threshold=0.5,
+    repetition_boost=4.0,
+    token_weights=None,
+    adaptive_top_k=None,
+    adaptive_smoothing=0.95,
+    adaptive_strength=1.0,
+    adaptive_pivot=0.5,
+):
+    """
+    Creates a callable logit-processor that modifies the probability of an 'end thinking' token
+    based on the specified thinking effort. Typically used with llama-cpp or similar backends
+    that support a custom logits_processor.
+
+    Args:
+        thinking_effort (float):
+            A value between 0 and 1 that controls how much thinking to do.
+            - Higher values (closer to 1) encourage more thinking by reducing the probability
+              scaling of the end_thinking_token_id (i.e., minimal scaling).
+            - Lower values (closer to 0) encourage less thinking by more strongly scaling up
+              the probability of the end_thinking_token_id (i.e., large scaling).
+        end_thinking_token_id (int):
+            The token ID that marks the end of the "thinking" phase (e.g. </think>). On QwQ model, for example, this is 151668.
+        scale_factor (float, optional):
+            Controls the intensity of the scaling effect (default=2).
+            - At thinking_effort=0.0, the end_thinking_token_id logit is multiplied by
+              scale_factor^(1 - 0.0) = scale_factor (forcing the end token more likely).
+            - At thinking_effort=1.0, the end_thinking_token_id logit is multiplied by
+              scale_factor^(1 - 1.0) = 1 (no extra forcing).
+        max_thinking_tokens (int, optional):
+            Hard cap on the number of generated thinking tokens. Once reached, every logit except
+            the end_thinking_token_id is set to -inf so the end token is forced. None (default)
+            means no cap.
+        schedule (str or callable, optional):
+            How the effort moves towards `final_thinking_effort` as the budget is consumed:
+            "constant" (default, no change), "linear", "quadratic", "cubic", "sqrt", or a callable
+            mapping the progress (thinking tokens / max_thinking_tokens, in [0, 1]) to [0, 1].
+            A non-constant schedule requires `max_thinking_tokens`.
+        final_thinking_effort (float, optional):
+            The effort reached when the budget is exhausted (default=0.0).
+        end_markers (iterable, optional):
+            Several and/or multi-token end markers, each a sequence of token IDs (see
+            `thinking_effort.core.EndMarkerMatcher`). Replaces `end_thinking_token_id`, which
+            may then be None. The scale (or, over budget, the forcing) is applied to the next
+            token of whichever marker is partially matched.
+        metrics (thinking_effort.core.ThinkingMetrics, optional):
+            Opt-in telemetry. The processor is registered under `metrics_name` and reports its
+            thinking-token count, the step at which the end marker was emitted and the
+            cumulative wall time spent in the processor.
+        metrics_name (str, optional):
+            The name used for this processor in the metrics records.
+        repetition_ngram_size (int, optional):
+            Enables repetition-loop detection with n-grams of this length (see
+            `thinking_effort.core.RepetitionDetector`). None (default) disables it.
+        repetition_window (int, optional):
+            Number of recent tokens the repetition score is computed over (default=256).
+        repetition_threshold (float, optional):
+            Fraction of repeated n-grams in the window from which the sequence counts as
+            looping (default=0.5).
+        repetition_boost (float, optional):
+            Extra multiplier on the end-of-thinking scale while looping (default=4.0).
+        token_weights (dict, optional):
+            Extra tokens steered by the same effort, as {token_id: weight}. While thinking, the
+            logit of each token is multiplied by `scale ** weight` (negative weights suppress
+            tokens such as "Wait", positive ones favor wrap-up tokens). The map is compiled into
+            NumPy index and weight arrays and applied with one fancy-indexing update per call.
+            End marker tokens cannot be listed.
+        adaptive_top_k (int, optional):
+            Enables the entropy-adaptive mode with this many top logits (e.g. 20). Each call,
+            the confidence is one minus the normalized entropy of the softmax over the
+            `adaptive_top_k` largest logits (found with `np.partition`, no full-vocabulary
+            softmax), smoothed with an exponential moving average, and the scale is multiplied
+            by `scale_factor ** (adaptive_strength * (confidence - adaptive_pivot))`: confident
+            sequences wrap up sooner, uncertain ones keep thinking. None (default) disables it.
+        adaptive_smoothing (float, optional):
+            Decay of the (bias-corrected) confidence moving average, in [0, 1) (default=0.95).
+        adaptive_strength (float, optional):
+            Effort shift per unit of smoothed confidence (default=1.0).
+        adaptive_pivot (float, optional):
+            The confidence at which the effort is left unchanged (default=0.5).
+
+    Returns:
+        function:
+            A logit processor function with signature (input_ids, logits) -> logits.
+            With `metrics`, it also has a `metrics_records()` attribute. With repetition
+            detection, it has a `repetition_stats()` attribute returning the detector's stats.
+            In the adaptive mode, it has a `confidence()` attribute returning the current
+            smoothed confidence (None before the first call). It always has `state_dict()` and
+            `load_state_dict(state)` attributes, which export and import the generation state
+            (phase, thinking-token count, marker automaton state, confidence and repetition
+            detector) as a small JSON-serializable dict, e.g. to save next to `Llama.save_state()`
+            when a request is preempted. Loading is O(1) in the sequence length; the settings are
+            not part of the dict, so load it into a closure created with the same arguments.
+            Its `matcher` attribute is the `EndMarkerMatcher` of its end markers.
+
+    Implementation Details:
+        - The returned processor examines the most recent token in `input_ids` and feeds it to an
+          incremental marker automaton (O(1) per call). Once an end marker is complete, we record
+          that the end-of-thinking token has been generated and cease further scaling.
+        - Because llama-cpp may pass `input_ids` as either a Python list or a NumPy array (possibly
+          with shape (batch, seq_length)), the processor carefully extracts the last token as a
+          Python int. This avoids errors when comparing it to `end_thinking_token_id`.
+        - On the first call, the last few prompt tokens (as many as the longest marker) are fed
+          instead, so a prompt ending in the middle of a marker is handled.
+        - Once the end token is generated, the processor stops modifying logits altogether.
+        - The number of thinking tokens is counted incrementally: every call after the first
+          one corresponds to exactly one newly sampled token.
+    """
+    if schedule not in (None, "constant") and max_thinking_tokens is None:
+        raise ValueError("A non-constant effort schedule requires max_thinking_tokens")
+    schedule_fn = get_effort_schedule(schedule)
+
+    # Compute how strongly to scale the end_thinking_token_id
+    scale = effort_to_scale(thinking_effort, scale_factor)
+
+    if end_markers is None:
+        end_markers = [[end_thinking_token_id]]
+    matcher = EndMarkerMatcher(end_markers)
+
+    weight_ids = weight_values = None
+    if token_weights:
+        if set(token_weights) & set(matcher.alphabet):
+            raise ValueError("token_weights cannot include end marker tokens, they are driven by the effort directly")
+        weight_ids = np.fromiter(token_weights.keys(), dtype=np.intp, count=len(token_weights))
+        weight_values = np.fromiter(token_weights.values(), dtype=np.float64, count=len(token_weights))
+
+    detector = None
+    if repetition_ngram_size is not None:
+        detector = RepetitionDetector(repetition_ngram_size, repetition_window, repetition_threshold)
+
+    if adaptive_top_k is not None and adaptive_top_k < 2:
+        raise ValueError("adaptive_top_k must be at least 2")
+    if not 0.0 <= adaptive_smoothing < 1.0:
+        raise ValueError("adaptive_smoothing must be in [0, 1)")
+
+    # We store the mutable generation state in a dict so the closure can update it
+    state = {
+        "token_generated": False,
+        "started": False,
+        "thinking_tokens": 0,
+        "marker_state": 0,
+        "confidence": 0.0,
+        "confidence_updates": 0,
+    }
+
+    def smoothed_confidence():
+        if not state["confidence_updates"]:
+            return None
+        return state["confidence"] / (1.0 - adaptive_smoothing ** state["confidence_updates"])
+
+    def update_confidence(logits):
+        # Normalized entropy of the softmax over the top-k logits, found by a partial sort
+        k = min(adaptive_top_k, len(logits))
+        top = np.partition(np.asarray(logits, dtype=np.float32), -k)[-k:].astype(np.float64)
+        probs = np.exp(top - top.max())
+        probs /= probs.sum()
+        nonzero = probs[probs > 0.0]
+        entropy = -float(np.dot(nonzero, np.log(nonzero)))
+        confidence = 1.0 - entropy / math.log(k)
+        state["confidence"] = adaptive_smoothing * state["confidence"] + (1.0 - adaptive_smoothing) * confidence
+        state["confidence_updates"] += 1
+
+    def processor(input_ids, logits):
+        """
+        This inner function is the actual logit processor used at generation time.
+        
+        Args:
+            input_ids: Could be a Python list of token IDs or a NumPy array of shape
+                       (seq_length,) or (batch_size, seq_length).
+            logits:    A 1D array or similar structure with the current token logits.
+
+        Returns:
+            Modified logits with the end_thinking_token scaled unless we've already
+            seen that token.
+        """
+        # If we've already generated the end token, do nothing further
+        if state["token_generated"]:
+            return logits
+
+        # Every call but the first one follows a token sampled during the thinking phase
+        looping = False
+        if state["started"]:
+            state["thinking_tokens"] += 1
+            new_tokens = _last_token_ids(input_ids)
+            if detector is not None:
+                looping = detector.update(new_tokens[-1])
+        else:
+            # Prime the matcher with the prompt tail, in case it ends inside a marker
+            new_tokens = _last_token_ids(input_ids, matcher.max_length)
+            if detector is not None:
+                detector.prime(_last_token_ids(input_ids, repetition_ngram_size))
+        state["started"] = True
+
+        marker_state, matched = matcher.scan(new_tokens, state["marker_state"])
+        state["marker_state"] = marker_state
+
+        # If we've just generated the end_thinking_token, record that fact and do no more scaling
+        if matched:
+            state["token_generated"] = True
+            return logits
+
+        # The next token of whichever marker is partially matched
+        next_tokens = matcher.next_tokens[marker_state]
+
+        if adaptive_top_k is not None:
+            update_confidence(logits)
+
+        if max_thinking_tokens is not None:
+            # Out of budget: only the end marker may be sampled
+            if state["thinking_tokens"] >= max_thinking_tokens:
+                logits[:] = float("-inf")
+                for token in next_tokens:
+                    logits[token] = 0.0
+                return logits
+
+        step_scale = scale
+        if max_thinking_tokens is not None and schedule not in (None, "constant"):
+            progress = min(state["thinking_tokens"] / max_thinking_tokens, 1.0)
+            effort = scheduled_effort(thinking_effort, final_thinking_effort, progress, schedule_fn)
+            step_scale = effort_to_scale(effort, scale_factor)
+        if adaptive_top_k is not None:
+            # Confident sequences get a lower effort, uncertain ones a higher effort
+            step_scale *= scale_factor ** (adaptive_strength * (smoothed_confidence() - adaptive_pivot))
+        if looping:
+            # Stuck in a repetition loop: push harder towards the end marker
+            step_scale *= repetition_boost
+        if weight_ids is not None:
+            logits[weight_ids] *= step_scale**weight_values
+
+        # Multiply the logits of the marker's next token(s) by the scale
+        for token in next_tokens:
+            logits[token] *= step_scale
+        return logits
+
+    def state_dict():
+        return {
+            "version": STATE_DICT_VERSION,
+            **state,
+            "repetition": None if detector is None else detector.state_dict(),
+        }
+
+    def load_state_dict(saved):
+        _check_state_dict_version(saved)
+        for key in state:
+            state[key] = saved[key]
+        if detector is not None:
+            detector.load_state_dict(saved["repetition"])
+
+    processor.matcher = matcher
+    processor.state_dict = state_dict
+    processor.load_state_dict = load_state_dict
+    if detector is not None:
+        processor.repetition_stats = detector.stats
+    if adaptive_top_k is not None:
+        processor.confidence = smoothed_confidence
+
+    if metrics is None:
+        return processor
+
+    timing = {"processor_seconds": 0.0}
+
+    def instrumented_processor(input_ids, logits):
+        start = time.perf_counter()
+        logits = processor(input_ids, logits)
+        elapsed = time.perf_counter() - start
+        timing["processor_seconds"] += elapsed
+        metrics.record_step(name, elapsed)
+        return logits
+
+    def metrics_records():
+        record = {
+            "sequence": "0",
+            "thinking_effort": thinking_effort,
+            "scale_factor": scale_factor,
+            "thinking_tokens": state["thinking_tokens"],
+            "finished": state["token_generated"],
+            "end_step": end_step_from_counts(state["thinking_tokens"], state["token_generated"]),
+            "processor_seconds": timing["processor_seconds"],
+        }
+        if detector is not None:
+            record["repetition_score"] = detector.score
+            record["loop_steps"] = detector.loop_steps
+        if adaptive_top_k is not None:
+            record["confidence"] = smoothed_confidence()
+        return [record]
+
+    instrumented_processor.metrics_records = metrics_records
+    instrumented_processor.matcher = matcher
+    instrumented_processor.state_dict = state_dict
+    instrumented_processor.load_state_dict = load_state_dict
+    if detector is not None:
+        instrumented_processor.repetition_stats = detector.stats
+    if adaptive_top_k is not None:
+        instrumented_processor.confidence = smoothed_confidence
+    name = metrics.register(instrumented_processor, metrics_name)
+    return instrumented_processor
+
+
+def thinking_effort_processor_for_target(target_thinking_tokens, curve, end_thinking_token_id, scale_factor=2, **kwargs):
+    """
+    Creates a `thinking_effort_processor` from a target number of thinking tokens instead of
+    an effort, using a model's calibration curve (see `thinking_effort.calibration.EffortCurve`).
+
+    Args:
+        target_thinking_tokens (int): The expected thinking length.
+        curve (EffortCurve): The model's calibration curve.
+        end_thinking_token_id (int): The token ID that marks the end of the "thinking" phase.
+        scale_factor (float, optional): The scale factor to solve the effort for (default=2).
+        **kwargs: Other `thinking_effort_processor` arguments.
+    """
+    thinking_effort = curve.effort_for_tokens(target_thinking_tokens, scale_factor)
+    return thinking_effort_processor(thinking_effort, end_thinking_token_id, scale_factor, **kwargs)
+
+
+def effort_to_logit_bias(thinking_effort, reference_logit, scale_factor=2):
+    """
+    Converts a thinking effort into an additive logit bias for the end-of-thinking token.
+
+    llama.cpp's logit-bias sampler only adds an offset, while the processor closure multiplies
+    the logit by `scale = scale_factor ** (1 - thinking_effort)`. The two agree exactly for the
+    logit the bias is computed from:
+        reference_logit * scale == reference_logit + (scale - 1) * reference_logit
+    so the bias has to be recomputed from the current logit at every step, as
+    `create_completion_with_effort_bias` does.
+
+    Args:
+        thinking_effort (float): Same meaning as in `thinking_effort_processor`.
+        reference_logit (float): The current end-of-thinking logit.
+        scale_factor (float, optional): Same meaning as in `thinking_effort_processor` (default=2).
+
+    Returns:
+        float: The additive bias `(scale - 1) * reference_logit`.
+    """
+    return (effort_to_scale(thinking_effort, scale_factor) - 1.0) * reference_logit
+
+
+def _sampler_chain(llm, temperature, top_k, top_p, min_p, typical_p, seed):
+    # llama.cpp's sampler chain with the stages of `Llama.create_completion`, headed by an (empty)
+    # inner chain that holds the logit-bias stage, so that stage can be swapped every step
+    # without rebuilding the others (the dist stage keeps its RNG state)
+    import llama_cpp
+
+    params = llama_cpp.llama_sampler_chain_default_params()
+    chain = llama_cpp.llama_sampler_chain_init(params)
+    bias_chain = llama_cpp.llama_sampler_chain_init(params)
+    llama_cpp.llama_sampler_chain_add(chain, bias_chain)
+    if temperature <= 0:
+        llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_greedy())
+        return chain, bias_chain
+    llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_top_k(top_k))
+    llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_typical(typical_p, 1))
+    llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_top_p(top_p, 1))
+    llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_min_p(min_p, 1))
+    llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_temp(temperature))
+    seed = llama_cpp.LLAMA_DEFAULT_SEED if seed is None else seed
+    llama_cpp.llama_sampler_chain_add(chain, llama_cpp.llama_sampler_init_dist(seed))
+    return chain, bias_chain
+
+
+def _set_logit_bias(bias_chain, n_vocab, token_id, bias):
+    # Replaces the logit-bias stage held by `bias_chain` (None removes it)
+    import llama_cpp
+
+    if llama_cpp.llama_sampler_chain_n(bias_chain):
+        llama_cpp.llama_sampler_free(llama_cpp.llama_sampler_chain_remove(bias_chain, 0))
+    if bias is not None:
+        entries = (llama_cpp.llama_logit_bias * 1)(llama_cpp.llama_logit_bias(token_id, bias))
+        llama_cpp.llama_sampler_chain_add(bias_chain, llama_cpp.llama_sampler_init_logit_bias(n_vocab, 1, entries))
+
+
+def _stop_position(text, stop):
+    # (index of the first complete stop sequence or None, length of the text that is safe to emit)
+    positions = [text.find(sequence) for sequence in stop]
+    positions = [position for position in positions if position >= 0]
+    if positions:
+        return min(positions), min(positions)
+    # Hold back a tail that may be the start of a stop sequence
+    held = 0
+    for sequence in stop:
+        for length in range(min(len(sequence) - 1, len(text)), held, -1):
+            if text.endswith(sequence[:length]):
+                held = length
+                break
+    return None, len(text) - held
+
+
+def create_completion_with_effort_bias(
+    llm,
+    prompt,
+    thinking_effort,
+    end_thinking_token_id,
+    scale_factor=2,
+    max_tokens=16,
+    stop=None,
+    temperature=0.8,
+    top_k=40,
+    top_p=0.95,
+    min_p=0.05,
+    typical_p=1.0,
+    seed=None,
+):
+    """
+    Streams a completion whose thinking effort is applied as a logit-bias stage of llama.cpp's
+    sampler chain, instead of a Python logits processor that receives the full logits array.
+
+    The loop runs on llama-cpp-python's low-level API: `llm.eval` for the forward passes and
+    `llama_sampler_sample` on a sampler chain with the same stages as `llm.create_completion`
+    (greedy when `temperature` <= 0). While the sequence is thinking, the chain starts with a
+    `llama_sampler_init_logit_bias` stage for `end_thinking_token_id` whose bias is recomputed
+    from the current end-of-thinking logit before every token (`effort_to_logit_bias`), so the
+    biased logit equals the closure's scaled logit at every step, not only the first one. The
+    only per-token Python work is reading that one logit and swapping the stage; the logits
+    array is never copied.
+
+    The end of thinking is detected on the sampled token IDs. The stage is then removed and the
+    answer continues from the generated tokens, with the KV cache as is (nothing is
+    re-tokenized or re-evaluated). An end-of-generation token ends the completion in either
+    phase; during thinking it is not mistaken for the end of thinking.
+
+    The evaluated prefix shared with the previous completion on `llm` is reused, as in
+    `llm.generate`.
+
+    Args:
+        llm (llama_cpp.Llama): The loaded model.
+        prompt (str or list of int): The prompt, normally ending with the opening <think> of the
+            chat template.
+        thinking_effort (float): Same meaning as in `thinking_effort_processor`.
+        end_thinking_token_id (int): The token ID of the end-of-thinking marker.
+        scale_factor (float, optional): Same meaning as in `thinking_effort_processor` (default=2).
+        max_tokens (int, optional): Total token budget for thinking and answer (default=16);
+            None or <= 0 for the rest of the context.
+        stop (str or list, optional): Stop sequences, applied to the answer phase only.
+        temperature, top_k, top_p, min_p, typical_p (optional): Sampling parameters, with the
+            defaults of `llm.create_completion`.
+        seed (int, optional): Seed of the sampler (default: random).
+
+    Yields:
+        dict: Completion chunks, in the format of `llm.create_completion(stream=True)`; the last
+            one has the finish_reason ("stop" or "length") and the token `usage`.
+    """
+    import llama_cpp
+
+    if isinstance(prompt, str):
+        prompt_tokens = llm.tokenize(prompt.encode("utf-8"), special=True)
+    else:
+        prompt_tokens = [int(token) for token in prompt]
+    if max_tokens is None or max_tokens <= 0:
+        max_tokens = llm.n_ctx() - len(prompt_tokens)
+    stop = [stop] if isinstance(stop, str) else list(stop or [])
+    vocab = llama_cpp.llama_model_get_vocab(llm.model)
+    n_vocab = llm.n_vocab()
+    scale = effort_to_scale(thinking_effort, scale_factor)
+    completion_id = f"cmpl-{uuid.uuid4()}"
+    created = int(time.time())
+
+    def chunk(text, finish_reason=None):
+        return {
+            "id": completion_id,
+            "object": "text_completion",
+            "created": created,
+            "model": llm.model_path,
+            "choices": [{"text": text, "index": 0, "logprobs": None, "finish_reason": finish_reason}],
+        }
+
+    # Keep the evaluated prefix; the last prompt token is evaluated again for fresh logits
+    evaluated = llm.input_ids[: llm.n_tokens].tolist()
+    llm.n_tokens = min(longest_common_prefix(evaluated, prompt_tokens), len(prompt_tokens) - 1)
+    llm.eval(prompt_tokens[llm.n_tokens :])
+
+    detokenizer = IncrementalDetokenizer(lambda ids: llm.detokenize(ids).decode("utf-8", errors="replace"))
+    thinking = prompt_tokens[-1] != end_thinking_token_id
+    answer_text = ""
+    generated = 0
+    finish_reason = "length"
+    stopped = False
+    chain, bias_chain = _sampler_chain(llm, temperature, top_k, top_p, min_p, typical_p, seed)
+    try:
+        while generated < max_tokens:
+            if thinking and scale != 1.0:
+                end_logit = llama_cpp.llama_get_logits_ith(llm.ctx, -1)[end_thinking_token_id]
+                bias = effort_to_logit_bias(thinking_effort, end_logit, scale_factor)
+                _set_logit_bias(bias_chain, n_vocab, end_thinking_token_id, bias)
+            token = llama_cpp.llama_sampler_sample(chain, llm.ctx, -1)
+            if llama_cpp.llama_vocab_is_eog(vocab, token):
+                finish_reason = "stop"
+                break
+            generated += 1
+            text = detokenizer.add(token)
+            if thinking:
+                if token == end_thinking_token_id:
+                    thinking = False
+                    _set_logit_bias(bias_chain, n_vocab, end_thinking_token_id, None)
+                if text:
+                    yield chunk(text)
+            elif text:
+                answer_text += text
+                position, safe = _stop_position(answer_text, stop)
+                if safe:
+                    yield chunk(answer_text[:safe])
+                answer_text = answer_text[safe:]
+                if position is not None:
+                    stopped = True
+                    break
+            if generated < max_tokens:
+                llm.eval([token])
+    finally:
+        llama_cpp.llama_sampler_free(chain)
+
+    text = ""
+    if stopped:
+        finish_reason = "stop"
+    else:
+        # Text held back for a possible stop sequence or an incomplete character
+        text = answer_text + detokenizer.flush()
+        position = _stop_position(text, stop)[0] if not thinking else None
+        if position is not None:
+            text, finish_reason = text[:position], "stop"
+    final = chunk(text, finish_reason)
+    final["usage"] = {
+        "prompt_tokens": len(prompt_tokens),
+        "completion_tokens": generated,
+        "total_tokens": len(prompt_tokens) + generated,
+    }
+    yield final
+
+
+def effort_fanout(
+    llm,
+    prompt,
+    thinking_efforts,
+    end_thinking_token_id,
+    scale_factor=2,
+    max_tokens=16,
+    processor_kwargs=None,
+    **kwargs,
+):
+    """
+    Streams completions of one prompt at several thinking efforts, ingesting the prompt only once.
+
+    The prompt is evaluated once and the context state is saved with `llm.save_state()`. Every
+    branch restores that state with `llm.load_state()` and runs with its own
+    `thinking_effort_processor`; llama-cpp-python then recognizes the evaluated prompt as a
+    prefix and only feeds its last token. A `Llama` instance has one context, so the branches
+    run one after another.
+
+    Args:
+        llm (llama_cpp.Llama): The loaded model.
+        prompt (str): The prompt, normally ending with the opening <think> of the chat template.
+        thinking_efforts (list of float): One thinking effort per branch.
+        end_thinking_token_id (int): The token ID of the end-of-thinking marker.
+        scale_factor (float, optional): Same meaning as in `thinking_effort_processor` (default=2).
+        max_tokens (int, optional): Token budget of each branch (default=16).
+        processor_kwargs (dict, optional): Extra `thinking_effort_processor` arguments, e.g.
+            `max_thinking_tokens` or `end_markers`.
+        **kwargs: Forwarded to every `llm.create_completion` call (temperature, seed, ...).
+
+    Yields:
+        tuple: (branch index, completion chunk), the chunk being in the same format as
+        `llm.create_completion(stream=True)`.
+    """
+    from llama_cpp import LogitsProcessorList
+
+    prompt_tokens = llm.tokenize(prompt.encode("utf-8"), special=True)
+    # Everything but the last token, which each completion feeds itself to get fresh logits
+    llm.reset()
+    llm.eval(prompt_tokens[:-1])
+    prefix_state = llm.save_state()
+
+    for branch, thinking_effort in enumerate(thinking_efforts):
+        if branch:
+            llm.load_state(prefix_state)
+        processor = thinking_effort_processor(
+            thinking_effort, end_thinking_token_id, scale_factor, **(processor_kwargs or {})
+        )
+        for chunk in llm.create_completion(
+            prompt_tokens,
+            max_tokens=max_tokens,
+            logits_processor=LogitsProcessorList([processor]),
+            stream=True,
+            **kwargs,
+        ):
+            yield branch, chunk
+
+
+def controller_logits_processor(controller, request_id, **settings):
+    """
+    Adapts a request-keyed `thinking_effort.core.ThinkingEffortController` to llama-cpp-python's
+    logits-processor interface, so one controller can serve many requests (and `Llama`
+    instances) without sharing any per-request closure state.
+
+    Args:
+        controller (ThinkingEffortController): The shared state.
+        request_id (hashable): The request this processor serves. When the controller does
+            not know it yet, it is added on the first call with the prompt from `input_ids`.
+        **settings: Per-request settings used when the request is added (thinking_effort,
+            scale_factor, max_thinking_tokens, ...).
+
+    Returns:
+        function:
+            A logit processor function with signature (input_ids, logits) -> logits.
+    """
+
+    def processor(input_ids, logits):
+        if request_id not in controller:
+            controller.add(request_id, _last_token_ids(input_ids, None), **settings)
+        controller.observe(request_id, _last_token_ids(input_ids)[0])
+        return controller.apply(request_id, logits)
+
+    return processor
+
+
+def split_completion_stream(stream, end_thinking_text="</think>", thinking=True):
+    """
+    Wraps `llm.create_completion(stream=True)` (or `create_completion_with_effort_bias`) and
+    yields (channel, text) pairs, channel being "reasoning" or "content".
+
+    The chunks only carry text, already detokenized by llama-cpp-python, so the marker is found
+    in the text (see `thinking_effort.core.TextThinkingSplitter`), even when split across chunks.
+
+    Args:
+        stream (iterable): The completion chunks.
+        end_thinking_text (str, optional): The text of the end marker (default="</think>").
+        thinking (bool, optional): Whether the stream starts in the thinking phase (default=True).
+    """
+    splitter = TextThinkingSplitter(end_thinking_text, thinking)
+    for chunk in stream:
+        yield from splitter.feed(chunk["choices"][0]["text"])
+    yield from splitter.finish()
+
+
+def split_token_stream(llm, tokens, end_thinking_token_id=None, end_markers=None, thinking=True):
+    """
+    Splits a stream of token IDs (e.g. from `llm.generate`) into (channel, text) pairs, using
+    the processors' marker matcher and incremental detokenization with `llm.detokenize`.
+
+    Args:
+        llm (llama_cpp.Llama): The model, used for detokenization.
+        tokens (iterable of int): The generated tokens.
+        end_thinking_token_id (int, optional): The end-of-thinking token ID.
+        end_markers (iterable, optional): Several and/or multi-token end markers instead.
+        thinking (bool, optional): Whether the stream starts in the thinking phase (default=True).
+    """
+    splitter = ThinkingSplitter(
+        lambda ids: llm.detokenize(ids).decode("utf-8", errors="replace"), end_thinking_token_id, end_markers, thinking
+    )
+    for token in tokens:
+        yield from splitter.feed(token)
+    yield from splitter.finish()
+
+
+def _row_values(value, n_seq, default, name):
+    """
+    Expands a per-sequence argument into a float64 array of length `n_seq`: a scalar shared by
+    every sequence, a sequence with one entry per row, or a mapping {row: value}. Missing rows
+    and None entries get `default`.
+    """
+    if value is None:
+        return np.full(n_seq, default, dtype=np.float64)
+    if np.ndim(value) == 0 and not isinstance(value, Mapping):
+        return np.full(n_seq, float(value), dtype=np.float64)
+    if isinstance(value, Mapping):
+        for row in value:
+            if not 0 <= row < n_seq:
+                raise ValueError(f"{name} has an entry for row {row}, but there are {n_seq} sequences")
+        value = [value.get(row) for row in range(n_seq)]
+    values = [default if v is None else float(v) for v in value]
+    if len(values) != n_seq:
+        raise ValueError(f"{name} has {len(values)} entries, but there are {n_seq} sequences")
+    return np.array(values, dtype=np.float64)
+
+
+def batched_thinking_effort_processor(
+    thinking_effort=1.0,
+    end_thinking_token_id=None,
+    scale_factor=2,
+    max_thinking_tokens=None,
+    schedule="constant",
+    final_thinking_effort=0.0,
+    end_markers=None,
+):
+    """
+    Creates a NumPy-native logit processor for several sequences decoded together, e.g. parallel
+    sequences of one llama.cpp context (`n_seq_max > 1`) driven with the low-level batch API.
+
+    Each row behaves exactly like its own `thinking_effort_processor` closure (same arguments,
+    same logits), but the phase, thinking-token count and marker automaton state are per-row
+    arrays, and the logits of all rows are updated in place with a few vectorized fancy-indexing
+    operations instead of one Python call per sequence.
+
+    Args:
+        thinking_effort (float, sequence or dict, optional):
+            As in `thinking_effort_processor`, shared by all rows or per row (a sequence with one
+            entry per row, or {row: value} with the others at the default). Default is 1.0.
+        end_thinking_token_id (int or None):
+            The end-of-thinking token ID. May be None when `end_markers` is given.
+        scale_factor (float, sequence or dict, optional): Same forms, default is 2.
+        max_thinking_tokens (int, sequence or dict, optional): Per-row budgets, None for no cap.
+        schedule (str or callable, optional): As in `thinking_effort_processor`, shared by all rows.
+        final_thinking_effort (float, sequence or dict, optional): Same forms, default is 0.0.
+        end_markers (iterable, optional): As in `thinking_effort_processor`.
+
+    Returns:
+        function:
+            A processor with signature (input_ids, logits) -> logits, where `logits` is a
+            (n_seq, vocab_size) array (or a 1-D array for a single sequence) and `input_ids` a
+            (n_seq, seq_length) array or a list of per-row token sequences (lengths may differ).
+            Only the newest token of each row is read, except on a row's first call, which
+            primes its matcher with the prompt tail. It also has the attributes
+            `reset(rows=None, **settings)` (restart some rows, e.g. when a slot is reused for a
+            new request, with the construction-time settings or the given overrides; before the
+            first call the overrides are kept for those rows), `stats()`, `state_dict()` and
+            `load_state_dict(state)`.
+
+    Implementation Details:
+        - The per-row arrays are created on the first call, from the number of logits rows.
+        - The marker automaton runs on its dense tables: the newest tokens are mapped to
+          alphabet columns with one `np.searchsorted` and advanced with one table lookup.
+        - The fixed cost of a call is a few NumPy operations (about 20 microseconds). In
+          `benchmarks/llamacpp_batched.py` the batched processor is slower than one closure per
+          sequence up to about 16 sequences, and only 1.3-2.4x faster at 64 sequences.
+        - Repetition detection, token weights and the adaptive mode are only available in the
+          single-sequence closure.
+    """
+    if schedule not in (None, "constant") and max_thinking_tokens is None:
+        raise ValueError("A non-constant effort schedule requires max_thinking_tokens")
+    schedule_fn = get_effort_schedule(schedule)
+    scheduled = schedule not in (None, "constant")
+
+    if end_markers is None:
+        if end_thinking_token_id is None:
+            raise ValueError("Either end_thinking_token_id or end_markers is required")
+        end_markers = [[end_thinking_token_id]]
+    matcher = EndMarkerMatcher(end_markers)
+    alphabet, table, accepting, next_tokens, _ = matcher.dense_tables()
+    alphabet = np.array(alphabet, dtype=np.int64)
+    table = np.array(table, dtype=np.int64)
+    accepting = np.array(accepting, dtype=bool)
+    next_tokens = np.array(next_tokens, dtype=np.intp)
+
+    settings = {
+        "thinking_effort": (thinking_effort, 1.0),
+        "scale_factor": (scale_factor, 2.0),
+        "max_thinking_tokens": (max_thinking_tokens, np.inf),
+        "final_thinking_effort": (final_thinking_effort, 0.0),
+    }
+    # Per-row arrays, created on the first call (see `init`)
+    state = {}
+    # (rows, overrides) of the `reset` calls made before the first call, applied by `init`
+    pending_resets = []
+
+    def set_settings(n_seq, selected, overrides):
+        for name, (value, default) in settings.items():
+            value = overrides.get(name, value)
+            state[name][selected] = _row_values(value, n_seq, default, name)[selected]
+        # Same expression as the closure, so the constant scales are bit-identical
+        state["scale"][selected] = [
+            effort_to_scale(effort, factor)
+            for effort, factor in zip(state["thinking_effort"][selected], state["scale_factor"][selected])
+        ]
+
+    def init(n_seq):
+        state.clear()
+        for name in settings:
+            state[name] = np.empty(n_seq, dtype=np.float64)
+        state["scale"] = np.empty(n_seq, dtype=np.float64)
+        set_settings(n_seq, np.arange(n_seq), {})
+        for rows, overrides in pending_resets:
+            set_settings(n_seq, np.arange(n_seq) if rows is None else np.atleast_1d(rows), overrides)
+        pending_resets.clear()
+        state["started"] = np.zeros(n_seq, dtype=bool)
+        state["finished"] = np.zeros(n_seq, dtype=bool)
+        state["thinking_tokens"] = np.zeros(n_seq, dtype=np.int64)
+        state["marker_state"] = np.zeros(n_seq, dtype=np.int64)
+
+    def newest_tokens(input_ids, selected):
+        if isinstance(input_ids, np.ndarray) and input_ids.ndim == 2:
+            return input_ids[selected, -1].astype(np.int64)
+        return np.fromiter((int(input_ids[row][-1]) for row in selected), dtype=np.int64, count=len(selected))
+
+    def processor(input_ids, logits):
+        if logits.ndim == 1:
+            # A single sequence, as passed by llama-cpp-python's high-level API (a view, so the
+            # update stays in place)
+            update([input_ids], logits[None, :])
+            return logits
+        return update(input_ids, logits)
+
+    def update(input_ids, logits):
+        n_seq = logits.shape[0]
+        if not state or state["finished"].shape[0] != n_seq:
+            init(n_seq)
+        started = state["started"]
+        finished = state["finished"]
+        marker_state = state["marker_state"]
+        thinking_tokens = state["thinking_tokens"]
+        budgets = state["max_thinking_tokens"]
+
+        # Every call but a row's first follows a token sampled while it was thinking
+        stepping = (started & ~finished).nonzero()[0]
+        if stepping.size:
+            tokens = newest_tokens(input_ids, stepping)
+            positions = np.minimum(alphabet.searchsorted(tokens), alphabet.size - 1)
+            columns = np.where(alphabet[positions] == tokens, positions + 1, 0)
+            thinking_tokens[stepping] += 1
+            states = table[marker_state[stepping], columns]
+            marker_state[stepping] = states
+            finished[stepping] = accepting[states]
+        if stepping.size < n_seq:
+            # Rows seen for the first time: prime the matcher with the prompt tail
+            for row in (~started).nonzero()[0]:
+                marker_state[row], finished[row] = matcher.scan(_last_token_ids(input_ids[row], matcher.max_length))
+            started[:] = True
+
+        thinking = (~finished).nonzero()[0]
+        if not thinking.size:
+            return logits
+        columns = next_tokens[marker_state[thinking]]
+
+        # Out of budget: only the end marker may be sampled
+        forced = thinking_tokens[thinking] >= budgets[thinking]
+        if forced.any():
+            forced_rows = thinking[forced]
+            logits[forced_rows] = -np.inf
+            logits[forced_rows[:, None], columns[forced]] = 0.0
+            keep = ~forced
+            thinking, columns = thinking[keep], columns[keep]
+
+        if scheduled:
+            progress = np.minimum(thinking_tokens[thinking] / budgets[thinking], 1.0)
+            effort = scheduled_effort(
+                state["thinking_effort"][thinking], state["final_thinking_effort"][thinking], progress, schedule_fn
+            )
+            scales = effort_to_scale(effort, state["scale_factor"][thinking])
+        else:
+            scales = state["scale"][thinking]
+        # Padding columns repeat a row's first next token, so duplicates write identical values
+        scales = scales.astype(logits.dtype)[:, None]
+        if logits.flags.c_contiguous:
+            # One gather and one scatter over flat indices (the reshape is a view)
+            flat = logits.reshape(-1)
+            indices = (thinking * logits.shape[1])[:, None] + columns
+            flat[indices] = flat[indices] * scales
+        else:
+            logits[thinking[:, None], columns] = logits[thinking[:, None], columns] * scales
+        return logits
+
+    def reset(rows=None, **overrides):
+        unknown = set(overrides) - set(settings)
+        if unknown:
+            raise TypeError(f"Unknown settings: {sorted(unknown)}")
+        if not state:
+            # The rows do not exist yet; `settings` always keeps the construction-time values
+            if rows is None:
+                pending_resets.clear()
+            pending_resets.append((rows, overrides))
+            return
+        n_seq = state["finished"].shape[0]
+        selected = np.arange(n_seq) if rows is None else np.atleast_1d(rows)
+        set_settings(n_seq, selected, overrides)
+        state["started"][selected] = False
+        state["finished"][selected] = False
+        state["thinking_tokens"][selected] = 0
+        state["marker_state"][selected] = 0
+
+    def stats():
+        if not state:
+            return []
+        return [
+            {"thinking_tokens": tokens, "finished": done, "end_step": end_step_from_counts(tokens, done)}
+            for tokens, done in zip(state["thinking_tokens"].tolist(), state["finished"].tolist())
+        ]
+
+    def state_dict():
+        saved = {"version": STATE_DICT_VERSION}
+        for name in ("started", "finished", "thinking_tokens", "marker_state"):
+            saved[name] = state[name].tolist() if state else None
+        return saved
+
+    def load_state_dict(saved):
+        _check_state_dict_version(saved)
+        if saved["finished"] is None:
+            state.clear()
+            return
+        init(len(saved["finished"]))
+        dtypes = {"started": bool, "finished": bool, "thinking_tokens": np.int64, "marker_state": np.int64}
+        for name, dtype in dtypes.items():
+            state[name][:] = np.array(saved[name], dtype=dtype)
+
+    processor.reset = reset
+    processor.stats = stats
+    processor.state_dict = state_dict
+    processor.load_state_dict = load_state_dict
+    return processor
+
+
+class ThinkingEffortProcessorFactory:
+    """
+    Hands out independent `thinking_effort_processor` closures from shared defaults, safely from
+    many threads, so one loaded `Llama` can serve concurrent requests.
+
+    A closure holds the state of one generation, so sharing one between requests mixes their
+    phases up. The factory creates a fresh closure per request (registering it with the metrics
+    under a unique name) and `create_completion` serializes the requests on each `Llama`: a
+    llama.cpp context evaluates one sequence at a time and llama-cpp-python is not thread-safe,
+    so every `Llama` instance gets its own lock, held for the whole (possibly streamed) completion.
+    Requests on different `Llama` instances run in parallel.
+
+    Args:
+        end_thinking_token_id (int, optional): The end-of-thinking token ID.
+        end_markers (iterable, optional): Several and/or multi-token end markers instead.
+        metrics (thinking_effort.core.ThinkingMetrics, optional): Every processor is registered
+            as "request<N>".
+        **defaults: Default `thinking_effort_processor` arguments (thinking_effort,
+            scale_factor, max_thinking_tokens, schedule, repetition_ngram_size, ...).
+    """
+
+    def __init__(self, end_thinking_token_id=None, end_markers=None, metrics=None, **defaults):
+        if end_thinking_token_id is None and end_markers is None:
+            raise ValueError("Either end_thinking_token_id or end_markers is required")
+        self.end_thinking_token_id = end_thinking_token_id
+        self.end_markers = end_markers
+        self.metrics = metrics
+        self.defaults = {"thinking_effort": 1.0, "scale_factor": 2, **defaults}
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._llm_locks = weakref.WeakKeyDictionary()
+
+    def processor(self, **settings):
+        """Returns a new closure for one request; `settings` override the defaults."""
+        kwargs = {**self.defaults, **settings}
+        thinking_effort = kwargs.pop("thinking_effort")
+        scale_factor = kwargs.pop("scale_factor")
+        with self._lock:
+            request = next(self._ids)
+            if self.metrics is not None:
+                kwargs.setdefault("metrics", self.metrics)
+                kwargs.setdefault("metrics_name", f"request{request}")
+            return thinking_effort_processor(
+                thinking_effort, self.end_thinking_token_id, scale_factor, end_markers=self.end_markers, **kwargs
+            )
+
+    def lock_for(self, llm):
+        """Returns the lock serializing the use of `llm`."""
+        with self._lock:
+            lock = self._llm_locks.get(llm)
+            if lock is None:
+                lock = self._llm_locks[llm] = threading.Lock()
+            return lock
+
+    def create_completion(self, llm, prompt, processor_kwargs=None, stream=False, **kwargs):
+        """
+        Runs `llm.create_completion` with a fresh processor while holding the lock of `llm`.
+
+        Args:
+            llm (llama_cpp.Llama): The shared model.
+            prompt (str or list of int): The prompt.
+            processor_kwargs (dict, optional): Per-request processor settings (thinking_effort, ...).
+            stream (bool, optional): Stream the chunks; the lock is then held until the stream
+                is exhausted or closed.
+            **kwargs: Forwarded to `llm.create_completion` (max_tokens, temperature, ...).
+        """
+        processor = self.processor(**(processor_kwargs or {}))
+        logits_processor = [processor, *(kwargs.pop("logits_processor", None) or [])]
+        if stream:
+            return self._stream(llm, prompt, logits_processor, kwargs)
+        with self.lock_for(llm):
+            return llm.create_completion(prompt, logits_processor=logits_processor, **kwargs)
+
+    def _stream(self, llm, prompt, logits_processor, kwargs):
+        with self.lock_for(llm):
+            yield from llm.create_completion(prompt, logits_processor=logits_processor, stream=True, **kwargs)
+
+
+class LlamaChatSession:
+    """
+    A multi-turn chat with thinking-effort control that keeps only the answers of earlier turns
+    in the history, while keeping the llama.cpp KV cache warm.
+
+    Chat templates of thinking models drop the thinking of earlier assistant turns, so the new
+    prompt diverges from the evaluated tokens right where the previous turn's thinking began.
+    The session renders the answer-only history, tokenizes it and hands the tokens to
+    `llm.generate`, which keeps the longest evaluated prefix and only evaluates the rest (the
+    previous answer and the new message). Each turn records where its </think> boundary was
+    (see `thinking_effort.core.ChatTurn`). The context is the `Llama` instance's only one, so
+    interleaving other completions on it between turns costs the prefix.
+
+    Args:
+        llm (llama_cpp.Llama): The loaded model.
+        end_thinking_token_id (int, optional): The end-of-thinking token ID. May be None when
+            `processor_kwargs` has `end_markers`.
+        thinking_effort (float, optional): Default effort of the turns (default=1.0).
+        scale_factor (float, optional): Default scale factor of the turns (default=2).
+        messages (list of dict, optional): Initial history, e.g. a system message.
+        template (callable, optional): Renders a message list to the prompt text, ending with the
+            opening <think> (default: `thinking_effort.core.chatml_prompt`).
+        reuse_cache (bool, optional): Keep the evaluated prefix across turns (default=True).
+            False re-ingests the whole conversation every turn, as a baseline.
+        stop_token_ids (list of int, optional): Tokens ending a turn (default: `llm.token_eos()`).
+        processor_kwargs (dict, optional): Default `thinking_effort_processor` arguments
+            (max_thinking_tokens, end_markers, ...).
+        **generate_kwargs: Default `llm.generate` sampling arguments (temp, top_k, top_p, ...).
+
+    Attributes:
+        messages (list of dict): The answer-only history.
+        turns (list of ChatTurn): One record per completed turn.
+    """
+
+    def __init__(
+        self,
+        llm,
+        end_thinking_token_id=None,
+        thinking_effort=1.0,
+        scale_factor=2,
+        messages=None,
+        template=chatml_prompt,
+        reuse_cache=True,
+        stop_token_ids=None,
+        processor_kwargs=None,
+        **generate_kwargs,
+    ):
+        self.llm = llm
+        self.end_thinking_token_id = end_thinking_token_id
+        self.thinking_effort = thinking_effort
+        self.scale_factor = scale_factor
+        self.template = template
+        self.reuse_cache = reuse_cache
+        self.stop_token_ids = stop_token_ids
+        self.processor_kwargs = dict(processor_kwargs or {})
+        self.generate_kwargs = generate_kwargs
+        self.reset(messages)
+
+    def reset(self, messages=None):
+        """Starts a new conversation, dropping the history and the evaluated tokens."""
+        self.messages = list(messages or [])
+        self.turns = []
+        self.llm.reset()
+
+    def _decode(self, ids):
+        return self.llm.detokenize(ids).decode("utf-8", errors="replace")
+
+    def send(self, content, max_tokens=256, thinking_effort=None, processor_kwargs=None, **generate_kwargs):
+        """
+        Adds a user message, generates the assistant turn and appends its answer to the history.
+
+        Args:
+            content (str): The user message.
+            max_tokens (int, optional): Token budget of the turn, thinking included (default=256).
+            thinking_effort (float, optional): Effort of this turn (default: the session's).
+            processor_kwargs (dict, optional): Processor arguments overriding the session's.
+            **generate_kwargs: `llm.generate` arguments overriding the session's.
+
+        Returns:
+            ChatTurn
+        """
+        from llama_cpp import LogitsProcessorList
+
+        start = time.perf_counter()
+        messages = self.messages + [{"role": "user", "content": content}]
+        prompt_ids = self.llm.tokenize(self.template(messages).encode("utf-8"), special=True)
+
+        if self.reuse_cache:
+            # `llm.generate` feeds the last prompt token again, for fresh logits
+            evaluated = self.llm.input_ids[: self.llm.n_tokens].tolist()
+            reused = min(longest_common_prefix(evaluated, prompt_ids), len(prompt_ids) - 1)
+        else:
+            self.llm.reset()
+            reused = 0
+
+        processor = thinking_effort_processor(
+            self.thinking_effort if thinking_effort is None else thinking_effort,
+            self.end_thinking_token_id,
+            self.scale_factor,
+            **{**self.processor_kwargs, **(processor_kwargs or {})},
+        )
+        stop_token_ids = set(self.stop_token_ids or [self.llm.token_eos()])
+        generated = []
+        first_token_time = None
+        for token in self.llm.generate(
+            prompt_ids,
+            logits_processor=LogitsProcessorList([processor]),
+            **{**self.generate_kwargs, **generate_kwargs},
+        ):
+            if first_token_time is None:
+                first_token_time = time.perf_counter()
+            generated.append(token)
+            if token in stop_token_ids or len(generated) >= max_tokens:
+                break
+        seconds = time.perf_counter() - start
+
+        turn = ChatTurn.from_generation(
+            processor.matcher,
+            prompt_ids,
+            reused,
+            generated,
+            self._decode,
+            (first_token_time or time.perf_counter()) - start,
+            seconds,
+        )
+        self.messages = messages + [{"role": "assistant", "content": turn.answer}]
+        self.turns.append(turn)
+        return turn
@@ -0,0 +1,468 @@
+"""
+An OpenAI-compatible asyncio server with `thinking_effort` / `scale_factor` as request parameters.
+
+Requests are queued and micro-batched: the engine waits up to `batch_window` seconds for up to
+`max_batch_size` requests, then runs them as the rows of one shared `model.generate` call with
+a single `IncrementalThinkingEffortProcessor` holding per-row effort, scale factor and budget.
+Tokens are streamed back to each client as server-sent events while the batch is generating.
+
+Endpoints:
+    POST /v1/completions        {"prompt": "...", "max_tokens": 256, "thinking_effort": 0.5, "stream": true, ...}
+    POST /v1/chat/completions   {"messages": [...], ...}
+    GET  /v1/models
+
+Extra request parameters: `thinking_effort` (default 1.0), `scale_factor` (default 2) and
+`max_thinking_tokens`. Responses report the number of thinking tokens in `usage`. Parameters are
+validated before a request is queued, and malformed ones are answered with 400.
+
+Usage:
+    python -m thinking_effort.server --model deepseek-ai/DeepSeek-R1-Distill-Qwen-1.5B --port 8000
+    python -m thinking_effort.server --tiny-random   # random weights + byte tokenizer, no download
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from transformers import LogitsProcessor, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+
+from .core import IncrementalDetokenizer
+from .transformers_backend import IncrementalThinkingEffortProcessor
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a request's token stream in its queue
+_END_OF_STREAM = None
+
+
+class PerRowTemperatureProcessor(LogitsProcessor):
+    """
+    Applies one sampling temperature per row. Rows with temperature 0 become greedy: every
+    logit but the largest is set to -inf.
+    """
+
+    def __init__(self, temperatures):
+        self.temperatures = temperatures
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        temperatures = torch.tensor(self.temperatures, dtype=scores.dtype, device=scores.device)
+        greedy = (temperatures == 0)[:, None]
+        scaled = scores / temperatures.clamp(min=1e-5)[:, None]
+        is_max = torch.zeros_like(scores, dtype=torch.bool).scatter_(1, scores.argmax(dim=-1, keepdim=True), True)
+        return torch.where(greedy, torch.where(is_max, 0.0, float("-inf")), scaled)
+
+
+class PerRowMaxTokensCriteria(StoppingCriteria):
+    """Stops each row after its own number of new tokens (`generate` only has one max_new_tokens)."""
+
+    def __init__(self, prompt_length, max_tokens):
+        self.prompt_length = prompt_length
+        self.max_tokens = max_tokens
+
+    def __call__(self, input_ids, scores, **kwargs):
+        limits = torch.tensor(self.max_tokens, device=input_ids.device)
+        return (input_ids.size(1) - self.prompt_length) >= limits
+
+
+class GenerationRequest:
+    """
+    One queued request. Generated token IDs are pushed to `queue` as they are produced, followed
+    by `_END_OF_STREAM`; `finish_reason` and `thinking_tokens` are set before the end marker.
+    """
+
+    def __init__(self, prompt_ids, max_tokens=256, temperature=1.0, thinking_effort=1.0, scale_factor=2, max_thinking_tokens=None):
+        self.id = uuid.uuid4().hex
+        self.prompt_ids = list(prompt_ids)
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.thinking_effort = thinking_effort
+        self.scale_factor = scale_factor
+        self.max_thinking_tokens = max_thinking_tokens
+        self.queue = asyncio.Queue()
+        self.finish_reason = None
+        self.thinking_tokens = 0
+        self.completion_tokens = 0
+
+
+class _BatchStreamer(BaseStreamer):
+    """
+    Routes the tokens `generate` produces for a batch to the per-request queues. Runs on the
+    generation thread, so the queues are fed through `loop.call_soon_threadsafe`.
+    """
+
+    def __init__(self, requests, eos_token_id, loop):
+        self.requests = requests
+        self.eos_token_id = eos_token_id
+        self.loop = loop
+        self.done = [False] * len(requests)
+        self.prompt_seen = False
+
+    def put(self, value):
+        # The first call carries the prompt
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        for row, token in enumerate(value.reshape(-1).tolist()):
+            if self.done[row]:
+                continue
+            request = self.requests[row]
+            request.completion_tokens += 1
+            if token == self.eos_token_id:
+                self.done[row] = True
+                request.finish_reason = "stop"
+                continue
+            self.loop.call_soon_threadsafe(request.queue.put_nowait, token)
+            if request.completion_tokens >= request.max_tokens:
+                self.done[row] = True
+                request.finish_reason = "length"
+
+    def end(self):
+        pass
+
+
+class BatchingEngine:
+    """
+    Queues generation requests and runs them in micro-batches on one model.
+
+    Args:
+        model: A Hugging Face causal LM.
+        tokenizer: Its tokenizer (needs `encode`/`decode`, plus `apply_chat_template` for chat).
+        end_thinking_token_id (int): The </think> token ID.
+        max_batch_size (int, optional): Maximum number of requests per batch (default=8).
+        batch_window (float, optional): Seconds to wait for more requests once one arrived (default=0.01).
+        pad_token_id (int, optional): Padding token (default: the tokenizer's pad or eos token).
+    """
+
+    def __init__(self, model, tokenizer, end_thinking_token_id, max_batch_size=8, batch_window=0.01, pad_token_id=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.end_thinking_token_id = end_thinking_token_id
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.eos_token_id = tokenizer.eos_token_id
+        if pad_token_id is None:
+            pad_token_id = getattr(tokenizer, "pad_token_id", None)
+        self.pad_token_id = pad_token_id if pad_token_id is not None else self.eos_token_id
+        self._pending = asyncio.Queue()
+        # Batches run one at a time on a dedicated thread, keeping the event loop responsive
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._worker = None
+        self.batches_run = 0
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.get_running_loop().create_task(self._batch_loop())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, request):
+        """
+        Queues a request and yields its generated token IDs as they are produced.
+        """
+        self.start()
+        await self._pending.put(request)
+        while True:
+            token = await request.queue.get()
+            if token is _END_OF_STREAM:
+                return
+            yield token
+
+    async def _next_batch(self):
+        batch = [await self._pending.get()]
+        deadline = asyncio.get_running_loop().time() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._pending.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._run(batch, loop)
+            finally:
+                for request in batch:
+                    request.queue.put_nowait(_END_OF_STREAM)
+
+    async def _run(self, batch, loop):
+        try:
+            await loop.run_in_executor(self._executor, self._run_batch, batch, loop)
+        except Exception:
+            logger.exception("Generation failed for a batch of %d requests", len(batch))
+            if len(batch) == 1:
+                batch[0].finish_reason = batch[0].finish_reason or "error"
+                return
+            # The failure cannot be pinned on one row: requests that got no tokens yet are run
+            # again alone, so a bad request only fails itself
+            for request in batch:
+                if request.completion_tokens == 0:
+                    await self._run([request], loop)
+                else:
+                    request.finish_reason = request.finish_reason or "error"
+
+    def _run_batch(self, batch, loop):
+        # Left-pad the prompts so every row ends at the same position
+        prompt_length = max(len(request.prompt_ids) for request in batch)
+        input_ids = torch.full((len(batch), prompt_length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), prompt_length), dtype=torch.long)
+        for row, request in enumerate(batch):
+            input_ids[row, prompt_length - len(request.prompt_ids) :] = torch.tensor(request.prompt_ids)
+            attention_mask[row, prompt_length - len(request.prompt_ids) :] = 1
+
+        device = self.model.device
+        max_tokens = [request.max_tokens for request in batch]
+        processor = IncrementalThinkingEffortProcessor(
+            self.end_thinking_token_id,
+            thinking_effort=[request.thinking_effort for request in batch],
+            scale_factor=[request.scale_factor for request in batch],
+            max_thinking_tokens=[request.max_thinking_tokens for request in batch],
+        )
+        with torch.no_grad():
+            self.model.generate(
+                input_ids.to(device),
+                attention_mask=attention_mask.to(device),
+                max_new_tokens=max(max_tokens),
+                do_sample=True,
+                temperature=1.0,
+                top_k=0,
+                top_p=1.0,
+                logits_processor=LogitsProcessorList(
+                    [processor, PerRowTemperatureProcessor([request.temperature for request in batch])]
+                ),
+                stopping_criteria=StoppingCriteriaList([PerRowMaxTokensCriteria(prompt_length, max_tokens)]),
+                streamer=_BatchStreamer(batch, self.eos_token_id, loop),
+                pad_token_id=self.pad_token_id,
+                eos_token_id=self.eos_token_id,
+            )
+        self.batches_run += 1
+
+        thinking_tokens = processor.thinking_tokens.tolist() if processor.thinking_tokens is not None else [0] * len(batch)
+        for request, count in zip(batch, thinking_tokens):
+            # Rows keep being processed (as padding) until the longest request is done
+            request.thinking_tokens = min(count, request.completion_tokens)
+            request.finish_reason = request.finish_reason or "length"
+
+
+def _parse_request(body, tokenizer, chat):
+    """Builds a `GenerationRequest` from an OpenAI-style JSON body."""
+    if not isinstance(body, dict):
+        raise ValueError("The request body must be a JSON object")
+    if chat:
+        messages = body.get("messages")
+        if not isinstance(messages, list) or not all(isinstance(message, dict) for message in messages):
+            raise ValueError("`messages` must be a list of message objects")
+        prompt_ids = tokenizer.apply_chat_template(body["messages"], add_generation_prompt=True, tokenize=True)
+        if hasattr(prompt_ids, "keys"):
+            # Recent tokenizers return a BatchEncoding
+            prompt_ids = prompt_ids["input_ids"]
+    else:
+        prompt = body.get("prompt", "")
+        if isinstance(prompt, list) and prompt and isinstance(prompt[0], int):
+            prompt_ids = prompt
+        else:
+            prompt_ids = tokenizer.encode(prompt, add_special_tokens=False)
+    if not prompt_ids:
+        raise ValueError("The prompt is empty")
+    max_tokens = body.get("max_tokens")
+    if max_tokens is None:
+        max_tokens = body.get("max_completion_tokens")
+    return GenerationRequest(
+        prompt_ids,
+        max_tokens=_parameter("max_tokens", 256 if max_tokens is None else max_tokens, integer=True, minimum=1),
+        temperature=_parameter("temperature", body.get("temperature", 1.0), minimum=0),
+        thinking_effort=_parameter("thinking_effort", body.get("thinking_effort", 1.0)),
+        scale_factor=_parameter("scale_factor", body.get("scale_factor", 2), minimum=0, inclusive=False),
+        max_thinking_tokens=_parameter(
+            "max_thinking_tokens", body.get("max_thinking_tokens"), integer=True, minimum=0, optional=True
+        ),
+    )
+
+
+def _parameter(name, value, integer=False, minimum=None, inclusive=True, optional=False):
+    """
+    Checks a numeric request parameter, so a malformed request is answered with 400 before it
+    joins a batch instead of failing the batch's `generate` call.
+    """
+    if value is None and optional:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int if integer else (int, float)):
+        raise ValueError(f"`{name}` must be {'an integer' if integer else 'a number'}")
+    if not math.isfinite(value):
+        raise ValueError(f"`{name}` must be finite")
+    if minimum is not None and (value < minimum if inclusive else value <= minimum):
+        raise ValueError(f"`{name}` must be {'>=' if inclusive else '>'} {minimum}")
+    return value if integer else float(value)
+
+
+class ThinkingEffortServer:
+    """
+    A minimal HTTP/1.1 front end for a `BatchingEngine` (one request per connection).
+
+    Args:
+        engine (BatchingEngine): The engine serving the requests.
+        model_name (str, optional): The name reported in responses and by /v1/models.
+    """
+
+    def __init__(self, engine, model_name="thinking-effort"):
+        self.engine = engine
+        self.model_name = model_name
+
+    async def serve(self, host="127.0.0.1", port=8000):
+        self.engine.start()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").strip()
+            if not request_line:
+                return
+            method, path, _ = request_line.split(" ", 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1")
+                if line in ("\r\n", "\n", ""):
+                    break
+                key, _, value = line.partition(":")
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            if method == "GET" and path == "/v1/models":
+                await self._send_json(writer, 200, {"object": "list", "data": [{"id": self.model_name, "object": "model"}]})
+            elif method == "POST" and path in ("/v1/completions", "/v1/chat/completions"):
+                await self._handle_completion(writer, json.loads(body or b"{}"), chat=path.endswith("chat/completions"))
+            else:
+                await self._send_json(writer, 404, {"error": {"message": f"Unknown route {method} {path}"}})
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            await self._send_json(writer, 400, {"error": {"message": str(e)}})
+        except Exception:
+            logger.exception("Request failed")
+            await self._send_json(writer, 500, {"error": {"message": "Internal server error"}})
+        finally:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    async def _send_json(self, writer, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}.get(status, "OK")
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+            + body
+        )
+
+    def _chunk(self, request, chat, text, finish_reason, created):
+        if chat:
+            delta = {"content": text} if text else {}
+            choice = {"index": 0, "delta": delta, "finish_reason": finish_reason}
+            return {"id": request.id, "object": "chat.completion.chunk", "created": created, "model": self.model_name, "choices": [choice]}
+        choice = {"index": 0, "text": text, "finish_reason": finish_reason}
+        return {"id": request.id, "object": "text_completion", "created": created, "model": self.model_name, "choices": [choice]}
+
+    def _usage(self, request):
+        return {
+            "prompt_tokens": len(request.prompt_ids),
+            "completion_tokens": request.completion_tokens,
+            "total_tokens": len(request.prompt_ids) + request.completion_tokens,
+            "thinking_tokens": request.thinking_tokens,
+        }
+
+    async def _handle_completion(self, writer, body, chat):
+        request = _parse_request(body, self.engine.tokenizer, chat)
+        created = int(time.time())
+        tokenizer = self.engine.tokenizer
+
+        if not body.get("stream"):
+            tokens = [token async for token in self.engine.submit(request)]
+            text = tokenizer.decode(tokens)
+            if chat:
+                choice = {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": request.finish_reason}
+                obj = "chat.completion"
+            else:
+                choice = {"index": 0, "text": text, "finish_reason": request.finish_reason}
+                obj = "text_completion"
+            payload = {"id": request.id, "object": obj, "created": created, "model": self.model_name, "choices": [choice], "usage": self._usage(request)}
+            await self._send_json(writer, 200, payload)
+            return
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n"
+        )
+        # Only a short window of recent tokens is decoded per token, and incomplete UTF-8
+        # sequences are held back until the next token completes them
+        detokenizer = IncrementalDetokenizer(tokenizer.decode)
+        async for token in self.engine.submit(request):
+            delta = detokenizer.add(token)
+            if not delta:
+                continue
+            writer.write(f"data: {json.dumps(self._chunk(request, chat, delta, None, created))}\n\n".encode("utf-8"))
+            await writer.drain()
+        delta = detokenizer.flush()
+        if delta:
+            writer.write(f"data: {json.dumps(self._chunk(request, chat, delta, None, created))}\n\n".encode("utf-8"))
+        final = self._chunk(request, chat, "", request.finish_reason, created)
+        final["usage"] = self._usage(request)
+        writer.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible server with per-request thinking_effort.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--model", help="Hugging Face model name or path")
+    source.add_argument("--tiny-random", action="store_true", help="Tiny random model with a byte tokenizer (no download)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--batch-window-ms", type=float, default=10.0)
+    args = parser.parse_args()
+
+    if args.tiny_random:
+        from .transformers_backend import ByteTokenizer, build_tiny_random_model
+
+        tokenizer = ByteTokenizer()
+        model = build_tiny_random_model(vocab_size=tokenizer.vocab_size)
+        model_name = "tiny-random"
+    else:
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(args.model)
+        model = AutoModelForCausalLM.from_pretrained(args.model).eval()
+        model_name = args.model
+
+    engine = BatchingEngine(
+        model,
+        tokenizer,
+        tokenizer.convert_tokens_to_ids("</think>"),
+        max_batch_size=args.max_batch_size,
+        batch_window=args.batch_window_ms / 1000.0,
+    )
+    print(f"Serving {model_name} on http://{args.host}:{args.port}")
+    asyncio.run(ThinkingEffortServer(engine, model_name).serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1730 @@
+import copy
+import math
+import queue
+import time
+from collections.abc import Mapping
+from numbers import Number
+
+from transformers import (
+    DynamicCache,
+    LogitsProcessor,
+    StoppingCriteria,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
+from transformers.generation.streamers import BaseStreamer
+import torch
+
+from .core import (
+    NGRAM_HASH_BASE,
+    NGRAM_HASH_MODULUS,
+    STATE_DICT_VERSION,
+    ChatTurn,
+    EndMarkerMatcher,
+    _check_state_dict_version,
+    ThinkingSplitter,
+    end_step_from_counts,
+    get_effort_schedule,
+    longest_common_prefix,
+    scheduled_effort,
+)
+
+
+def _is_scalar(value):
+    return isinstance(value, Number) or (isinstance(value, torch.Tensor) and value.dim() == 0)
+
+
+def _per_row_values(value, batch_size, default, name):
+    """
+    Expands `value` into a list of `batch_size` floats.
+
+    `value` may be a scalar (shared by every row), a sequence or 1-D tensor with one entry per
+    row, or a mapping {row_index: value}. Rows missing from a mapping, and None entries, get
+    `default`.
+    """
+    if value is None:
+        return [float(default)] * batch_size
+    if _is_scalar(value):
+        return [float(value)] * batch_size
+    if isinstance(value, Mapping):
+        for row in value:
+            if not 0 <= row < batch_size:
+                raise ValueError(f"{name} has an entry for row {row}, but the batch size is {batch_size}")
+        value = [value.get(row) for row in range(batch_size)]
+    elif isinstance(value, torch.Tensor):
+        value = value.tolist()
+    values = [float(default) if v is None else float(v) for v in value]
+    if len(values) != batch_size:
+        raise ValueError(f"{name} has {len(values)} entries, but the batch size is {batch_size}")
+    return values
+
+
+class ThinkingEffortProcessor(LogitsProcessor):
+    """
+    A custom LogitsProcessor for Hugging Face Transformers that scales the logit for an
+    "end-of-thinking" token based on a `thinking_effort` parameter—until that token is
+    actually generated for each sequence, at which point it stops scaling for that sequence.
+
+    Args:
+        end_thinking_token_id (int):
+            The special token ID representing the end-of-thinking marker (e.g. </think>).
+        thinking_effort (float, sequence, torch.Tensor or dict, optional):
+            Controls how heavily to scale the end_thinking_token_id. Interpreted via:
+                scale = scale_factor ** (1.0 - thinking_effort)
+            - If thinking_effort=0, scale=scale_factor^1 => strongly boosts the end token 
+              (reducing thinking).
+            - If thinking_effort=1, scale=scale_factor^0 => no scaling on the end token
+              (normal chance, i.e. more thinking).
+            - If thinking_effort>1, scale<1 => end token is suppressed (extensive thinking).
+            A sequence/1-D tensor gives one effort per batch row, and a dict {row_index: effort}
+            sets the effort of selected rows (the others use 1.0). Default is 1.0.
+        scale_factor (float, sequence, torch.Tensor or dict, optional):
+            The base used in the exponent that determines how strongly to scale the end token.
+            Accepts the same per-row forms as `thinking_effort` (missing rows use 2).
+            Default is 2.
+
+    Behavior:
+        - For each sequence in a batch, if the end_thinking_token_id has already appeared
+          in previous steps of generation, no further scaling is applied for that sequence.
+        - Otherwise, the logit for the end_thinking_token_id is multiplied by `scale`.
+        - The position of each sequence's end token is remembered, so a sequence that is cut
+          back before it (rejected candidates in assisted/speculative generation) is scaled again.
+
+
+    Explanation:
+        - The code runs at each generation step. For each sequence (row) in the batch:
+            1. If that sequence has already generated `end_thinking_token_id`, do nothing.
+            2. Otherwise, scale that token's logit by `scale = scale_factor ** (1.0 - thinking_effort)`.
+        - This makes the end token more or less likely to appear, depending on `thinking_effort`.
+    """
+
+    def __init__(self, end_thinking_token_id, thinking_effort=1.0, scale_factor=2):
+        super().__init__()
+        self.end_thinking_token_id = end_thinking_token_id
+        self.thinking_effort = thinking_effort
+        self.scale_factor = scale_factor
+        # Track which sequences (by index) have already produced the end_thinking_token_id,
+        # and where
+        self.finished_sequences = set()
+        self.end_positions = {}
+        # Per-row scales, computed once per (batch_size, device, dtype)
+        self._scales = None
+        self._scales_key = None
+
+    def get_scales(self, batch_size, device=None, dtype=torch.float32):
+        """
+        Returns the scale applied to each row's end_thinking_token_id logit.
+
+        When both `thinking_effort` and `scale_factor` are scalars this is a plain Python
+        float shared by all rows. Otherwise it is a tensor of shape (batch_size,), computed
+        once and cached, so applying it costs a single vectorized multiply per step.
+        """
+        if _is_scalar(self.thinking_effort) and _is_scalar(self.scale_factor):
+            return float(self.scale_factor) ** (1.0 - float(self.thinking_effort))
+
+        key = (batch_size, device, dtype)
+        if self._scales_key != key:
+            efforts = _per_row_values(self.thinking_effort, batch_size, 1.0, "thinking_effort")
+            factors = _per_row_values(self.scale_factor, batch_size, 2.0, "scale_factor")
+            scales = [factor ** (1.0 - effort) for effort, factor in zip(efforts, factors)]
+            self._scales = torch.tensor(scales, device=device, dtype=dtype)
+            self._scales_key = key
+        return self._scales
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        """
+        Invoked at each generation step by the Transformers library.
+
+        Args:
+            input_ids (torch.LongTensor):
+                The tokens generated so far, shape (batch_size, seq_length).
+            scores (torch.FloatTensor):
+                The current logits for the next token, shape (batch_size, vocab_size).
+
+        Returns:
+            torch.FloatTensor:
+                The modified logits (same shape) with the end_thinking_token_id scaled
+                for sequences that have not yet generated it.
+        """
+        batch_size = input_ids.size(0)
+        # Compute the scale factor(s) from the current thinking_effort
+        scale = self.get_scales(batch_size, scores.device, scores.dtype)
+        per_row = isinstance(scale, torch.Tensor)
+
+        # For each sequence in the batch, check if we've generated the end token before
+        for i in range(batch_size):
+            if i in self.finished_sequences:
+                position = self.end_positions[i]
+                if position < input_ids.size(1) and input_ids[i, position] == self.end_thinking_token_id:
+                    # Do not scale if we've already seen the end_thinking_token for this sequence
+                    continue
+                # The sequence was cut back before its end token
+                self.finished_sequences.discard(i)
+
+            # Check if this sequence contains the end_thinking_token_id already
+            matches = (input_ids[i] == self.end_thinking_token_id).nonzero()
+            if len(matches):
+                # Mark that we've generated the end token for this sequence
+                self.finished_sequences.add(i)
+                self.end_positions[i] = int(matches[0, 0])
+                # Don't scale the logit anymore
+                continue
+
+            # If we haven't encountered it yet, scale the logit for the end_thinking_token
+            scores[i, self.end_thinking_token_id] *= scale[i] if per_row else scale
+
+        return scores
+
+
+def _top_k_values(scores, k, block_size=64):
+    """
+    Returns the `k` largest values of each row of `scores` (unordered), shape (batch_size, k).
+
+    Two-stage selection, exact and several times faster than `torch.topk` over a large vocabulary
+    on CPU: the maximum of every block of `block_size` columns is taken with one vectorized
+    reduction, and `torch.topk` then only runs over the blocks holding the k largest maxima (plus
+    the columns past the last full block). Those blocks contain k values at least as large as the
+    k-th largest block maximum, so every top-k value lies in them.
+    """
+    batch_size, vocab_size = scores.shape
+    num_blocks = vocab_size // block_size
+    if num_blocks <= k:
+        return scores.topk(k, dim=-1, sorted=False).values
+    blocks = scores[:, : num_blocks * block_size].view(batch_size, num_blocks, block_size)
+    top_blocks = blocks.amax(dim=-1).topk(k, dim=-1, sorted=False).indices
+    candidates = blocks.gather(1, top_blocks[:, :, None].expand(batch_size, k, block_size)).flatten(1)
+    if num_blocks * block_size < vocab_size:
+        candidates = torch.cat([candidates, scores[:, num_blocks * block_size :]], dim=-1)
+    return candidates.topk(k, dim=-1, sorted=False).values
+
+
+class ScaleComponent:
+    """
+    Base class of the optional per-row features of `IncrementalThinkingEffortProcessor` that
+    follow the generation and adjust the end-of-thinking scale.
+
+    For each call, the processor calls `start` on a new prompt, `advance` for the newest token
+    when it extends the previous call, `observe` once per position with its logits, and then
+    `modulate` to adjust the scale. The per-row state is kept in tensors that are replaced, never
+    modified in place, so `snapshot` can return references for the processor's rollbacks.
+
+    Attributes:
+        name (str): The component's key in the processor's `state_dict`.
+    """
+
+    name = None
+
+    def reset(self):
+        """Forgets the per-row state."""
+        raise NotImplementedError(f"{self.__class__} must implement reset()")
+
+    def start(self, input_ids: torch.LongTensor):
+        """Initializes the per-row state from the prompt."""
+        raise NotImplementedError(f"{self.__class__} must implement start()")
+
+    def advance(self, input_ids: torch.LongTensor, finished: torch.BoolTensor):
+        """Consumes the newest token of each row (`finished` already includes it)."""
+
+    def observe(self, scores: torch.FloatTensor, finished: torch.BoolTensor):
+        """Consumes the logits of the current position."""
+
+    def modulate(self, scale, factors, thinking_tokens):
+        """
+        Returns `scale` (a float or a per-row tensor) adjusted for each row; `factors` are the
+        per-row scale factors and `thinking_tokens` the per-row thinking-token counts.
+        """
+        return scale
+
+    def snapshot(self):
+        """Returns the per-row state, for `restore`."""
+        raise NotImplementedError(f"{self.__class__} must implement snapshot()")
+
+    def restore(self, snapshot):
+        """Restores a state returned by `snapshot`."""
+        raise NotImplementedError(f"{self.__class__} must implement restore()")
+
+    def state_dict(self):
+        """Returns the per-row state as JSON-serializable lists (copies it to the host)."""
+        raise NotImplementedError(f"{self.__class__} must implement state_dict()")
+
+    def load_state_dict(self, state, batch_size, device=None):
+        """Restores a state returned by `state_dict`."""
+        raise NotImplementedError(f"{self.__class__} must implement load_state_dict()")
+
+
+class RepetitionTracker(ScaleComponent):
+    """
+    Per-row repetition-loop detection for `IncrementalThinkingEffortProcessor`: the batched,
+    device-resident counterpart of `thinking_effort.core.RepetitionDetector`, with the same
+    n-gram hash, window and score.
+
+    Each row keeps the rolling hash of its last `ngram_size` tokens (updated in O(1) per token),
+    a ring buffer with the hashes of the last `window` n-grams and one with their repeated
+    flags. A new n-gram is flagged as repeated when its hash is in the ring, found with one
+    comparison over the window for the whole batch, and the score is the running sum of the
+    flags divided by the window. The memory is two int64 per window position and row: 4 KiB per
+    row at the default window of 256. While a row's score is at least `threshold`, its
+    end-of-thinking scale is multiplied by `boost`.
+
+    Args:
+        ngram_size (int, optional): Length of the hashed n-grams (default=8).
+        window (int, optional): Number of recent tokens the score is computed over (default=256).
+        threshold (float, optional): Score from which a row counts as looping (default=0.5).
+        boost (float, optional): Extra multiplier on the scale of looping rows (default=4.0).
+    """
+
+    name = "repetition"
+    _STATE_KEYS = ("hash", "hashes", "flags", "repeated", "loop_steps", "looping", "step")
+
+    def __init__(self, ngram_size=8, window=256, threshold=0.5, boost=4.0):
+        if ngram_size < 1 or window < 1:
+            raise ValueError("ngram_size and window must be positive")
+        self.ngram_size = ngram_size
+        self.window = window
+        self.threshold = threshold
+        self.boost = boost
+        self._outgoing_weight = pow(NGRAM_HASH_BASE, ngram_size - 1, NGRAM_HASH_MODULUS)
+        self.state = None
+
+    def reset(self):
+        self.state = None
+
+    def start(self, input_ids: torch.LongTensor):
+        # The prompt only seeds the rolling hash; unused ring slots hold -1, which no hash equals
+        batch_size, device = input_ids.size(0), input_ids.device
+        tail = input_ids[:, -self.ngram_size :]
+        powers = torch.tensor(
+            [pow(NGRAM_HASH_BASE, k, NGRAM_HASH_MODULUS) for k in range(tail.size(1) - 1, -1, -1)],
+            dtype=torch.long,
+            device=device,
+        )
+        self.state = {
+            "hash": ((tail * powers) % NGRAM_HASH_MODULUS).sum(dim=-1) % NGRAM_HASH_MODULUS,
+            "hashes": torch.full((batch_size, self.window), -1, dtype=torch.long, device=device),
+            "flags": torch.zeros((batch_size, self.window), dtype=torch.long, device=device),
+            "repeated": torch.zeros(batch_size, dtype=torch.long, device=device),
+            "loop_steps": torch.zeros(batch_size, dtype=torch.long, device=device),
+            "looping": torch.zeros(batch_size, dtype=torch.bool, device=device),
+            "step": torch.zeros((), dtype=torch.long, device=device),
+        }
+
+    def advance(self, input_ids: torch.LongTensor, finished: torch.BoolTensor):
+        # Roll the hash, look it up in the window's ring and replace the oldest slot
+        state = self.state
+        n = self.ngram_size
+        if input_ids.size(1) > n:
+            outgoing = input_ids[:, -n - 1]
+        else:
+            outgoing = torch.zeros_like(input_ids[:, -1])
+        rolled = (state["hash"] - outgoing * self._outgoing_weight) % NGRAM_HASH_MODULUS
+        new_hash = (rolled * NGRAM_HASH_BASE + input_ids[:, -1]) % NGRAM_HASH_MODULUS
+
+        repeated = (state["hashes"] == new_hash[:, None]).any(dim=-1).long()
+        slot = (state["step"] % self.window).expand(new_hash.size(0), 1)
+        # The flag leaving the window is the one of the slot being replaced
+        count = state["repeated"] + repeated - state["flags"].gather(1, slot)[:, 0]
+        looping = ~finished & (count >= self.threshold * self.window)
+        self.state = {
+            "hash": new_hash,
+            "hashes": state["hashes"].scatter(1, slot, new_hash[:, None]),
+            "flags": state["flags"].scatter(1, slot, repeated[:, None]),
+            "repeated": count,
+            "loop_steps": state["loop_steps"] + looping.long(),
+            "looping": looping,
+            "step": state["step"] + 1,
+        }
+
+    def modulate(self, scale, factors, thinking_tokens):
+        # Rows stuck in a repetition loop get an extra push towards the end marker
+        return scale * torch.where(self.state["looping"], self.boost, 1.0).to(factors.dtype)
+
+    def stats(self):
+        """
+        Returns the statistics of each row (repetition_score, looping and loop_steps, as in
+        `RepetitionDetector.stats`), or an empty list before the first call. Copies them to the host.
+        """
+        if self.state is None:
+            return []
+        scores = (self.state["repeated"].double() / self.window).tolist()
+        loop_steps = self.state["loop_steps"].tolist()
+        return [
+            {"repetition_score": score, "looping": score >= self.threshold, "loop_steps": steps}
+            for score, steps in zip(scores, loop_steps)
+        ]
+
+    def snapshot(self):
+        return self.state
+
+    def restore(self, snapshot):
+        self.state = snapshot
+
+    def state_dict(self):
+        state = {key: value.tolist() for key, value in self.state.items() if key != "step"}
+        state["step"] = int(self.state["step"])
+        return state
+
+    def load_state_dict(self, state, batch_size, device=None):
+        self.state = {
+            key: torch.tensor(state[key], dtype=torch.bool if key == "looping" else torch.long, device=device)
+            for key in self._STATE_KEYS
+        }
+
+
+class AdaptiveConfidence(ScaleComponent):
+    """
+    Entropy-adaptive effort for `IncrementalThinkingEffortProcessor`: each row's confidence is
+    one minus the normalized entropy of the softmax over its `top_k` largest logits (an exact
+    two-stage block-max selection, no full-vocabulary softmax or sort), smoothed with an
+    exponential moving average, and the end-of-thinking scale of the row is multiplied by
+    `scale_factor ** (strength * (confidence - pivot))`. Confident rows wrap up sooner,
+    uncertain rows keep thinking.
+
+    Args:
+        top_k (int): How many top logits the entropy is computed over (at least 2, e.g. 20).
+        smoothing (float, optional): Decay of the moving average, in [0, 1) (default=0.95). The
+            average is bias-corrected, so the first steps are not pulled towards zero.
+        strength (float, optional): Effort shift per unit of smoothed confidence (default=1.0).
+        pivot (float, optional): The confidence at which the effort is left unchanged (default=0.5).
+    """
+
+    name = "confidence"
+
+    def __init__(self, top_k, smoothing=0.95, strength=1.0, pivot=0.5):
+        if top_k < 2:
+            raise ValueError("adaptive_top_k must be at least 2")
+        if not 0.0 <= smoothing < 1.0:
+            raise ValueError("adaptive_smoothing must be in [0, 1)")
+        self.top_k = top_k
+        self.smoothing = smoothing
+        self.strength = strength
+        self.pivot = pivot
+        # Per-row moving average of the confidence (not bias-corrected)
+        self.average = None
+
+    def reset(self):
+        self.average = None
+
+    def start(self, input_ids: torch.LongTensor):
+        self.average = torch.zeros(input_ids.size(0), dtype=torch.float32, device=input_ids.device)
+
+    def observe(self, scores: torch.FloatTensor, finished: torch.BoolTensor):
+        # Normalized entropy of the softmax over the top-k logits: a partial selection and a
+        # k-wide softmax per row instead of a softmax over the whole vocabulary
+        k = min(self.top_k, scores.size(-1))
+        probs = _top_k_values(scores, k).float().softmax(dim=-1)
+        confidence = 1.0 - torch.special.entr(probs).sum(dim=-1) / math.log(k)
+        decay = self.smoothing
+        self.average = torch.where(finished, self.average, decay * self.average + (1.0 - decay) * confidence)
+
+    def smoothed(self, thinking_tokens):
+        """
+        Returns the bias-corrected average of each row as a float32 tensor of shape
+        (batch_size,), or None before the first call.
+        """
+        if self.average is None:
+            return None
+        # Every call while a row is thinking fed the average once
+        updates = (thinking_tokens + 1).float()
+        return self.average / (1.0 - self.smoothing**updates)
+
+    def modulate(self, scale, factors, thinking_tokens):
+        # Confident rows get a lower effort, uncertain ones a higher effort
+        shift = self.strength * (self.smoothed(thinking_tokens) - self.pivot)
+        return scale * factors ** shift.to(factors.dtype)
+
+    def snapshot(self):
+        return self.average
+
+    def restore(self, snapshot):
+        self.average = snapshot
+
+    def state_dict(self):
+        return self.average.tolist()
+
+    def load_state_dict(self, state, batch_size, device=None):
+        self.average = torch.tensor(state, dtype=torch.float32, device=device)
+
+
+class IncrementalThinkingEffortProcessor(ThinkingEffortProcessor):
+    """
+    A batched, sync-free variant of `ThinkingEffortProcessor`.
+
+    Instead of rescanning every row of `input_ids` on every step, this processor keeps a
+    device-resident boolean "finished" mask of shape (batch_size,). The mask is built once
+    from the prompt on the first call and afterwards only the newest token of each row is
+    inspected. The scaling is applied to the whole batch with a single masked tensor op, so
+    there is no Python loop over rows and no device-to-host synchronization per step, which
+    also keeps `__call__` free of graph breaks under `torch.compile`.
+
+    Args:
+        end_thinking_token_id (int or None):
+            The special token ID representing the end-of-thinking marker (e.g. </think>).
+            May be None when `end_markers` is given.
+        thinking_effort (float, sequence, torch.Tensor or dict, optional):
+            Same meaning as in `ThinkingEffortProcessor`. Default is 1.0.
+        scale_factor (float, sequence, torch.Tensor or dict, optional):
+            Same meaning as in `ThinkingEffortProcessor`. Default is 2.
+        max_thinking_tokens (int, sequence or dict, optional):
+            Hard cap on the number of thinking tokens per sequence. Once a sequence has produced
+            this many tokens without emitting the end token, every other token is masked out so
+            the end token is forced. None (default) means no cap.
+        schedule (str or callable, optional):
+            How the effort moves towards `final_thinking_effort` as the budget is consumed:
+            "constant" (default, no change), "linear", "quadratic", "cubic", "sqrt", or a callable
+            mapping the progress tensor (thinking tokens / max_thinking_tokens, in [0, 1]) to [0, 1].
+            A non-constant schedule requires `max_thinking_tokens`.
+        final_thinking_effort (float, sequence or dict, optional):
+            The effort reached when the budget is exhausted. Default is 0.0, i.e. the end token
+            gets the full `scale_factor` boost; use negative values for an even stronger push.
+        end_markers (iterable, optional):
+            Several and/or multi-token end markers, each a sequence of token IDs (see
+            `thinking_effort.core.EndMarkerMatcher`). Replaces `end_thinking_token_id`. Each row
+            carries an automaton state that is advanced by the newest token only, and the scale
+            (or, over budget, the forcing) is applied to the next token of whichever marker is
+            partially matched; in the initial state that is the first token of every marker.
+        metrics (thinking_effort.core.ThinkingMetrics, optional):
+            Opt-in telemetry. The processor registers itself under `metrics_name` and reports,
+            per sequence, the thinking-token count, the step at which the end marker was emitted
+            and the cumulative processor wall time (host time; with CUDA this is launch time,
+            as the processor never synchronizes). Timing adds a graph break under `torch.compile`,
+            so compile `process` instead of the processor when metrics are on.
+        metrics_name (str, optional):
+            The name used for this processor in the metrics records.
+        repetition_ngram_size (int, optional):
+            Enables repetition-loop detection with n-grams of this length, see `RepetitionTracker`
+            (available as the `repetition` attribute). None (default) disables it.
+        repetition_window (int, optional):
+            Number of recent tokens the repetition score is computed over (default=256).
+        repetition_threshold (float, optional):
+            Fraction of repeated n-grams in the window from which a row counts as looping
+            (default=0.5).
+        repetition_boost (float, optional):
+            Extra multiplier on the end-of-thinking scale while a row is looping (default=4.0).
+        token_weights (dict, optional):
+            Extra tokens steered by the same effort, as {token_id: weight}. While a row is
+            thinking, the logit of each token is multiplied by `scale ** weight`, where `scale`
+            is the row's current end-of-thinking scale: positive weights favor the token as the
+            effort drops (e.g. wrap-up tokens), negative weights suppress it (e.g. "Wait", "Hmm").
+            The map is compiled once into index and weight tensors and applied to the whole batch
+            with one index_select and one index_copy per step. End marker tokens cannot be listed.
+        max_rollback (int, optional):
+            How many past positions the state can be rolled back to (default=64), for assisted
+            and speculative generation (`assistant_model=...`, `prompt_lookup_num_tokens=...`).
+            There, the processor is called for several candidate positions in a row (and by the
+            draft model), then the sequence is cut back to the accepted length. The processor keeps
+            a snapshot of its state after each position, keyed by sequence length; snapshots only
+            hold references to the per-row tensors, which are never modified in place. A call
+            that does not extend the previous one by exactly one token restores the snapshot of
+            the position before its newest token and advances from there, so every candidate
+            position is biased from the state of its own prefix. Without a usable snapshot the
+            whole input is rescanned as a new prompt. Set to 0 to disable; rollback tracking is
+            also skipped while tracing with `torch.compile`.
+        adaptive_top_k (int, optional):
+            Enables the entropy-adaptive mode with this many top logits (e.g. 20), see
+            `AdaptiveConfidence` (available as the `adaptive` attribute): the end-of-thinking
+            scale of a row is multiplied by
+            `scale_factor ** (adaptive_strength * (confidence - adaptive_pivot))`, where the
+            confidence is the smoothed normalized entropy of its top logits. None (default)
+            disables it.
+        adaptive_smoothing (float, optional):
+            Decay of the confidence moving average, in [0, 1) (default=0.95).
+        adaptive_strength (float, optional):
+            Effort shift per unit of smoothed confidence (default=1.0).
+        adaptive_pivot (float, optional):
+            The confidence at which the effort is left unchanged (default=0.5).
+
+    Both `thinking_effort` and `scale_factor` (as well as the budget arguments) accept the per-row
+    forms described in `ThinkingEffortProcessor`, so one batch can mix low, normal and
+    extended-thinking rows.
+
+    Behavior:
+        - Without a budget, the produced logits are identical to those of `ThinkingEffortProcessor`.
+        - `thinking_tokens` holds the per-sequence count of tokens generated before the end token
+          (the end token included). It is updated from the newest token only.
+        - In the adaptive mode, `smoothed_confidence()` returns the per-row confidence that
+          currently modulates the scale.
+        - `state_dict()` / `load_state_dict()` export and import the per-row state, so a
+          preempted generation resumes without rescanning its tokens.
+        - The state is tied to one `generate` call. Call `reset()` before reusing the same
+          instance for a new batch (a change of batch size also resets it automatically).
+    """
+
+    def __init__(
+        self,
+        end_thinking_token_id,
+        thinking_effort=1.0,
+        scale_factor=2,
+        max_thinking_tokens=None,
+        schedule="constant",
+        final_thinking_effort=0.0,
+        end_markers=None,
+        metrics=None,
+        metrics_name=None,
+        repetition_ngram_size=None,
+        repetition_window=256,
+        repetition_threshold=0.5,
+        repetition_boost=4.0,
+        token_weights=None,
+        max_rollback=64,
+        adaptive_top_k=None,
+        adaptive_smoothing=0.95,
+        adaptive_strength=1.0,
+        adaptive_pivot=0.5,
+    ):
+        super().__init__(end_thinking_token_id, thinking_effort=thinking_effort, scale_factor=scale_factor)
+        if end_markers is None:
+            if end_thinking_token_id is None:
+                raise ValueError("Either end_thinking_token_id or end_markers is required")
+            end_markers = [[end_thinking_token_id]]
+        self.matcher = EndMarkerMatcher(end_markers)
+        # A single single-token marker keeps the cheaper equality-based path
+        self.end_thinking_token_id = self.matcher.single_token
+        if schedule not in (None, "constant") and max_thinking_tokens is None:
+            raise ValueError("A non-constant effort schedule requires max_thinking_tokens")
+        self.max_thinking_tokens = max_thinking_tokens
+        self.schedule = schedule
+        self.schedule_fn = get_effort_schedule(schedule)
+        self.final_thinking_effort = final_thinking_effort
+        # Tensors of shape (batch_size,), lazily created on the device of the inputs
+        self.finished = None
+        self.thinking_tokens = None
+        self.marker_states = None
+        # Automaton tables as tensors, keyed by device
+        self._marker_tables = {}
+        # Per-row argument tensors, keyed by (name, batch_size, device, dtype)
+        self._row_tensors = {}
+        self.processor_seconds = 0.0
+        self.repetition = None
+        if repetition_ngram_size is not None:
+            self.repetition = RepetitionTracker(
+                repetition_ngram_size, repetition_window, repetition_threshold, repetition_boost
+            )
+        self.adaptive = None
+        if adaptive_top_k is not None:
+            self.adaptive = AdaptiveConfidence(adaptive_top_k, adaptive_smoothing, adaptive_strength, adaptive_pivot)
+        # Applied in this order by `process`
+        self.components = [component for component in (self.adaptive, self.repetition) if component is not None]
+        if token_weights and set(token_weights) & set(self.matcher.alphabet):
+            raise ValueError("token_weights cannot include end marker tokens, they are driven by the effort directly")
+        self.token_weights = dict(token_weights) if token_weights else None
+        # (token IDs, weights) as tensors, keyed by (device, dtype)
+        self._weight_tensors = {}
+        self.max_rollback = max_rollback
+        # State after each recent position, keyed by sequence length (see `_rollback`)
+        self._snapshots = {}
+        self._prompt_length = None
+        self._length = None
+        self.metrics = metrics
+        if metrics is not None:
+            self.metrics_name = metrics.register(self, metrics_name)
+
+    @classmethod
+    def from_target_tokens(cls, end_thinking_token_id, target_thinking_tokens, curve, scale_factor=2, **kwargs):
+        """
+        Creates a processor from a target number of thinking tokens instead of an effort.
+
+        Args:
+            end_thinking_token_id (int or None): As in the constructor.
+            target_thinking_tokens (int, sequence or dict): The expected thinking length, either
+                shared by the batch or per row (same forms as `thinking_effort`).
+            curve (thinking_effort.calibration.EffortCurve): The model's calibration curve.
+            scale_factor (float, optional): The scale factor to solve the effort for (default=2).
+            **kwargs: Other constructor arguments.
+        """
+        if isinstance(target_thinking_tokens, Mapping):
+            thinking_effort = {
+                row: curve.effort_for_tokens(target, scale_factor) for row, target in target_thinking_tokens.items()
+            }
+        elif _is_scalar(target_thinking_tokens):
+            thinking_effort = curve.effort_for_tokens(float(target_thinking_tokens), scale_factor)
+        else:
+            thinking_effort = [curve.effort_for_tokens(float(target), scale_factor) for target in target_thinking_tokens]
+        return cls(end_thinking_token_id, thinking_effort=thinking_effort, scale_factor=scale_factor, **kwargs)
+
+    def reset(self):
+        """
+        Forget all per-sequence state so the instance can be reused for a new generation.
+        """
+        self.finished = None
+        self.thinking_tokens = None
+        self.marker_states = None
+        for component in self.components:
+            component.reset()
+        self._snapshots = {}
+        self._prompt_length = None
+        self._length = None
+        self.finished_sequences = set()
+        self.end_positions = {}
+        self.processor_seconds = 0.0
+
+    def metrics_records(self):
+        """
+        Returns one telemetry record per row of the current batch (see `ThinkingMetrics`).
+        This copies the per-row state to the host, so call it outside the generation loop.
+        """
+        if self.finished is None:
+            return []
+        batch_size = self.finished.size(0)
+        efforts = _per_row_values(self.thinking_effort, batch_size, 1.0, "thinking_effort")
+        factors = _per_row_values(self.scale_factor, batch_size, 2.0, "scale_factor")
+        repetition = self.repetition_stats()
+        confidence = self.smoothed_confidence()
+        if confidence is not None:
+            confidence = confidence.tolist()
+        records = []
+        for row, (tokens, finished) in enumerate(zip(self.thinking_tokens.tolist(), self.finished.tolist())):
+            record = {
+                "sequence": str(row),
+                "thinking_effort": efforts[row],
+                "scale_factor": factors[row],
+                "thinking_tokens": tokens,
+                "finished": finished,
+                "end_step": end_step_from_counts(tokens, finished),
+                "processor_seconds": self.processor_seconds,
+            }
+            if repetition:
+                record["repetition_score"] = repetition[row]["repetition_score"]
+                record["loop_steps"] = repetition[row]["loop_steps"]
+            if confidence is not None:
+                record["confidence"] = confidence[row]
+            records.append(record)
+        return records
+
+    def smoothed_confidence(self):
+        """
+        Returns the bias-corrected moving average of each row's confidence as a float32 tensor
+        of shape (batch_size,), or None outside the adaptive mode (or before the first call).
+        """
+        if self.adaptive is None:
+            return None
+        return self.adaptive.smoothed(self.thinking_tokens)
+
+    def repetition_stats(self):
+        """
+        Returns the repetition detector statistics of each row (repetition_score, looping and
+        loop_steps, as in `RepetitionDetector.stats`), or an empty list when the detector is
+        disabled. Copies the state to the host.
+        """
+        if self.repetition is None:
+            return []
+        return self.repetition.stats()
+
+    def state_dict(self):
+        """
+        Returns the per-row generation state as a compact, JSON-serializable dict of Python
+        lists: phase (finished), thinking-token count (which is what the budget and schedule
+        are measured against), marker automaton states and the state of the components (the
+        adaptive confidence and the repetition detector's window). Store it next to the KV cache
+        of a preempted request.
+
+        The settings (efforts, scale factors, budget, schedule, ...) are not included: resume by
+        constructing a processor with the same arguments and calling `load_state_dict`. Copies
+        the state to the host, so call it outside the generation loop.
+        """
+        if self.finished is None:
+            return {"version": STATE_DICT_VERSION, "length": None, "finished": None}
+        state = {
+            "version": STATE_DICT_VERSION,
+            "length": self._length,
+            "finished": self.finished.tolist(),
+            "thinking_tokens": self.thinking_tokens.tolist(),
+            "marker_states": None if self.marker_states is None else self.marker_states.tolist(),
+            "confidence": None,
+            "repetition": None,
+        }
+        for component in self.components:
+            state[component.name] = component.state_dict()
+        return state
+
+    def load_state_dict(self, state, device=None):
+        """
+        Restores a state returned by `state_dict`, in O(batch_size) with no rescan of the
+        sequence: the next call continues exactly as the exporting processor would have, so the
+        biasing is bit-identical. That call should pass the sequence extended by the token
+        sampled after the export (or the same sequence again, which is recognized when the
+        exporting processor tracked rollbacks).
+
+        Args:
+            state (dict): The record.
+            device (torch.device or str, optional): Where to create the state tensors (default: CPU).
+        """
+        _check_state_dict_version(state)
+        self.reset()
+        if state["finished"] is None:
+            return
+        self.finished = torch.tensor(state["finished"], dtype=torch.bool, device=device)
+        self.thinking_tokens = torch.tensor(state["thinking_tokens"], dtype=torch.long, device=device)
+        if state["marker_states"] is not None:
+            self.marker_states = torch.tensor(state["marker_states"], dtype=torch.long, device=device)
+        for component in self.components:
+            if state[component.name] is not None:
+                component.load_state_dict(state[component.name], self.finished.size(0), device)
+        self._length = state["length"]
+        if self._length is not None and self.max_rollback > 0:
+            # A restored "prompt": a call at this same length restores instead of advancing
+            self._prompt_length = self._length
+            self._save_snapshot(self._length)
+
+    def _row_tensor(self, name, default, batch_size, device, dtype):
+        # Expands a (possibly per-row) constructor argument into a cached tensor
+        key = (name, batch_size, device, dtype)
+        if key not in self._row_tensors:
+            values = _per_row_values(getattr(self, name), batch_size, default, name)
+            self._row_tensors[key] = torch.tensor(values, device=device, dtype=dtype)
+        return self._row_tensors[key]
+
+    def _get_marker_tables(self, device):
+        if device not in self._marker_tables:
+            alphabet, table, accepting, next_tokens, has_next = self.matcher.dense_tables()
+            self._marker_tables[device] = (
+                torch.tensor(alphabet, dtype=torch.long, device=device),
+                torch.tensor(table, dtype=torch.long, device=device),
+                torch.tensor(accepting, dtype=torch.bool, device=device),
+                torch.tensor(next_tokens, dtype=torch.long, device=device),
+                torch.tensor(has_next, dtype=torch.bool, device=device),
+            )
+        return self._marker_tables[device]
+
+    def _save_snapshot(self, length):
+        self._length = length
+        components = [component.snapshot() for component in self.components]
+        self._snapshots[length] = (self.finished, self.thinking_tokens, self.marker_states, components)
+        self._snapshots.pop(length - self.max_rollback - 1, None)
+
+    def _restore_snapshot(self, length):
+        self.finished, self.thinking_tokens, self.marker_states, components = self._snapshots[length]
+        for component, snapshot in zip(self.components, components):
+            component.restore(snapshot)
+
+    def _rollback(self, input_ids: torch.LongTensor):
+        """
+        Prepares the state for a call that does not extend the previous one by one token.
+
+        Returns True when the caller should still consume the newest token (the state of the
+        previous position was restored), False when the state is already complete (the input
+        is the prompt itself, or it was rescanned from scratch).
+        """
+        length = input_ids.size(1)
+        if length == self._prompt_length and length in self._snapshots:
+            self._restore_snapshot(length)
+            return False
+        # Generation only ever cuts a sequence back and appends to it, so the tokens the
+        # previous position's snapshot consumed are still the same
+        if length - 1 in self._snapshots:
+            self._restore_snapshot(length - 1)
+            return True
+        # Too far back (or a different sequence): treat the input as a new prompt
+        self._start(input_ids)
+        return False
+
+    def _start(self, input_ids: torch.LongTensor):
+        self._init_state(input_ids)
+        for component in self.components:
+            component.start(input_ids)
+        self._snapshots = {}
+        self._prompt_length = input_ids.size(1)
+
+    def _get_weight_tensors(self, device, dtype):
+        key = (device, dtype)
+        if key not in self._weight_tensors:
+            self._weight_tensors[key] = (
+                torch.tensor(list(self.token_weights), dtype=torch.long, device=device),
+                torch.tensor(list(self.token_weights.values()), dtype=dtype, device=device),
+            )
+        return self._weight_tensors[key]
+
+    def _apply_token_weights(self, scores, scale):
+        # scale ** weight for every weighted token of every thinking row, in one pass
+        token_ids, weights = self._get_weight_tensors(scores.device, scores.dtype)
+        if isinstance(scale, torch.Tensor):
+            scale = scale[:, None]
+        factors = torch.where(self.finished[:, None], 1.0, torch.pow(scale, weights))
+        scores.index_copy_(1, token_ids, scores.index_select(1, token_ids) * factors)
+
+    def _init_state(self, input_ids: torch.LongTensor):
+        # The prompt may already contain the end token (e.g. a pre-filled thinking block),
+        # so the full sequence is scanned exactly once.
+        device = input_ids.device
+        self.thinking_tokens = torch.zeros(input_ids.size(0), dtype=torch.long, device=device)
+        if self.end_thinking_token_id is not None:
+            # Single vectorized op
+            self.finished = (input_ids == self.end_thinking_token_id).any(dim=-1)
+            return
+        # Multi-token markers: look for complete markers with sliding windows, ...
+        seq_length = input_ids.size(1)
+        self.finished = torch.zeros(input_ids.size(0), dtype=torch.bool, device=device)
+        for marker in self.matcher.markers:
+            if len(marker) <= seq_length:
+                windows = input_ids.unfold(1, len(marker), 1)
+                marker = torch.tensor(marker, dtype=input_ids.dtype, device=device)
+                self.finished = self.finished | (windows == marker).all(dim=-1).any(dim=-1)
+        # ... then recover each row's automaton state. A partial match is never longer than the
+        # longest marker, so feeding only that many trailing tokens gives the exact state.
+        self.marker_states = torch.zeros(input_ids.size(0), dtype=torch.long, device=device)
+        for position in range(max(seq_length - self.matcher.max_length, 0), seq_length):
+            self._advance_markers(input_ids[:, position])
+
+    def _advance_markers(self, new_tokens: torch.LongTensor):
+        # One automaton step per row: map each token to its alphabet column (0 = not in any
+        # marker), then look up the transition table.
+        alphabet, table, accepting, _, _ = self._get_marker_tables(new_tokens.device)
+        matches = new_tokens[:, None] == alphabet[None, :]
+        columns = (matches.long() * torch.arange(1, alphabet.size(0) + 1, device=new_tokens.device)).sum(dim=-1)
+        self.marker_states = table[self.marker_states, columns]
+        self.finished = self.finished | accepting[self.marker_states]
+
+    def peek_finished(self, input_ids: torch.LongTensor) -> torch.BoolTensor:
+        """
+        Returns which rows have left the thinking phase once the newest token of `input_ids`
+        is taken into account, without updating the processor state. Meant for stopping
+        criteria, which see each new token before the processor does.
+        """
+        if self.finished is None or self.finished.size(0) != input_ids.size(0):
+            probe = type(self).__new__(type(self))
+            probe.__dict__.update(self.__dict__)
+            probe._init_state(input_ids)
+            return probe.finished
+        if self.end_thinking_token_id is not None:
+            return self.finished | (input_ids[:, -1] == self.end_thinking_token_id)
+        alphabet, table, accepting, _, _ = self._get_marker_tables(input_ids.device)
+        new_tokens = input_ids[:, -1]
+        matches = new_tokens[:, None] == alphabet[None, :]
+        columns = (matches.long() * torch.arange(1, alphabet.size(0) + 1, device=input_ids.device)).sum(dim=-1)
+        return self.finished | accepting[table[self.marker_states, columns]]
+
+    def _scheduled_scales(self, batch_size, device, dtype):
+        # Moves each row's effort along the schedule according to how much budget it used
+        budget = self._row_tensor("max_thinking_tokens", float("inf"), batch_size, device, dtype)
+        progress = (self.thinking_tokens.to(dtype) / budget).clamp(max=1.0)
+        efforts = self._row_tensor("thinking_effort", 1.0, batch_size, device, dtype)
+        final_efforts = self._row_tensor("final_thinking_effort", 0.0, batch_size, device, dtype)
+        factors = self._row_tensor("scale_factor", 2.0, batch_size, device, dtype)
+        return factors ** (1.0 - scheduled_effort(efforts, final_efforts, progress, self.schedule_fn))
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        """
+        Invoked at each generation step by the Transformers library.
+
+        Args:
+            input_ids (torch.LongTensor):
+                The tokens generated so far, shape (batch_size, seq_length).
+            scores (torch.FloatTensor):
+                The current logits for the next token, shape (batch_size, vocab_size).
+
+        Returns:
+            torch.FloatTensor:
+                The modified logits (same shape) with the end_thinking_token_id scaled
+                for sequences that have not yet generated it.
+        """
+        if self.metrics is None:
+            return self.process(input_ids, scores)
+
+        start = time.perf_counter()
+        scores = self.process(input_ids, scores)
+        elapsed = time.perf_counter() - start
+        self.processor_seconds += elapsed
+        self.metrics.record_step(self.metrics_name, elapsed)
+        return scores
+
+    def process(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        """
+        The uninstrumented body of `__call__` (same arguments and return value).
+        """
+        batch_size = input_ids.size(0)
+        track = self.max_rollback > 0 and not torch.compiler.is_compiling()
+        if self.finished is None or self.finished.size(0) != batch_size:
+            self._start(input_ids)
+            advance = False
+        else:
+            # Anything but a one-token extension comes from assisted/speculative generation
+            advance = (
+                not track
+                or self._length is None  # Loaded from a state_dict without a known length
+                or input_ids.size(1) == self._length + 1
+                or self._rollback(input_ids)
+            )
+        if advance:
+            # The newest token was sampled while its row was still thinking
+            self.thinking_tokens = self.thinking_tokens + (~self.finished).long()
+            # Only the newest token can flip a sequence to finished
+            if self.end_thinking_token_id is not None:
+                self.finished = self.finished | (input_ids[:, -1] == self.end_thinking_token_id)
+            else:
+                self._advance_markers(input_ids[:, -1])
+            for component in self.components:
+                component.advance(input_ids, self.finished)
+        if advance or not self._snapshots:
+            # Once per position: a restored prompt snapshot already holds what it observed
+            for component in self.components:
+                component.observe(scores, self.finished)
+        if track:
+            self._save_snapshot(input_ids.size(1))
+
+        if self.schedule in (None, "constant"):
+            scale = self.get_scales(batch_size, scores.device, scores.dtype)
+        else:
+            scale = self._scheduled_scales(batch_size, scores.device, scores.dtype)
+        if self.components:
+            factors = self._row_tensor("scale_factor", 2.0, batch_size, scores.device, scores.dtype)
+            for component in self.components:
+                scale = component.modulate(scale, factors, self.thinking_tokens)
+        if self.token_weights is not None:
+            self._apply_token_weights(scores, scale)
+
+        if self.end_thinking_token_id is None:
+            return self._apply_to_markers(scores, scale, batch_size)
+
+        # One masked op for the whole batch: rows that are still thinking get scaled
+        end_logits = scores[:, self.end_thinking_token_id]
+        end_logits = torch.where(self.finished, end_logits, end_logits * scale)
+
+        if self.max_thinking_tokens is not None:
+            # Rows that exhausted their budget can only emit the end token
+            budget = self._row_tensor("max_thinking_tokens", float("inf"), batch_size, scores.device, scores.dtype)
+            forced = ~self.finished & (self.thinking_tokens >= budget)
+            scores.masked_fill_(forced[:, None], float("-inf"))
+            end_logits = torch.where(forced, torch.zeros_like(end_logits), end_logits)
+
+        scores[:, self.end_thinking_token_id] = end_logits
+        return scores
+
+    def _apply_to_markers(self, scores, scale, batch_size):
+        # Scales (or forces) the next expected token of each row's partially matched marker
+        # with one gather and one scatter for the whole batch.
+        _, _, _, next_tokens, has_next = self._get_marker_tables(scores.device)
+        columns = next_tokens[self.marker_states]
+        active = (~self.finished & has_next[self.marker_states])[:, None]
+        if isinstance(scale, torch.Tensor):
+            scale = scale[:, None]
+
+        logits = scores.gather(1, columns)
+        logits = torch.where(active, logits * scale, logits)
+
+        if self.max_thinking_tokens is not None:
+            budget = self._row_tensor("max_thinking_tokens", float("inf"), batch_size, scores.device, scores.dtype)
+            forced = ~self.finished & (self.thinking_tokens >= budget)
+            scores.masked_fill_(forced[:, None], float("-inf"))
+            logits = torch.where(forced[:, None] & active, torch.zeros_like(logits), logits)
+
+        # Padding columns repeat the first next token with the same value, so duplicate
+        # indices in the scatter always write identical values.
+        scores.scatter_(1, columns, logits)
+        return scores
+
+
+class ControllerLogitsProcessor(LogitsProcessor):
+    """
+    Adapts a request-keyed `thinking_effort.core.ThinkingEffortController` to the Transformers
+    logits-processor interface, for engines whose batch rows change between steps.
+
+    The engine tells the processor which request each row holds with `set_request_ids` before
+    a step; rows may be reordered, added or evicted freely since all state lives in the
+    controller. Requests the controller does not know yet are added with its defaults, using
+    the row's tokens as the prompt. Each call reads the newest token of every row with a single
+    device-to-host copy and applies the per-request biases with one gather and one index_put.
+
+    Args:
+        controller (thinking_effort.core.ThinkingEffortController): The shared state.
+        request_ids (list, optional): The request ID of each row; None marks an unused row.
+
+    Behavior:
+        - The processor must be called exactly once per generated token of every request it
+          serves, as in `generate` (see `ThinkingEffortController.observe`).
+    """
+
+    def __init__(self, controller, request_ids=None):
+        self.controller = controller
+        self.request_ids = list(request_ids or [])
+
+    def set_request_ids(self, request_ids):
+        self.request_ids = list(request_ids)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if len(self.request_ids) != input_ids.size(0):
+            raise ValueError(f"Got {input_ids.size(0)} rows but {len(self.request_ids)} request IDs")
+        newest_tokens = input_ids[:, -1].tolist()
+
+        rows, columns, multipliers, forced_entries, forced_rows = [], [], [], [], []
+        for row, request_id in enumerate(self.request_ids):
+            if request_id is None:
+                continue
+            if request_id not in self.controller:
+                self.controller.add(request_id, input_ids[row].tolist())
+            self.controller.observe(request_id, newest_tokens[row])
+            action = self.controller.bias(request_id)
+            if action is None:
+                continue
+            token_ids, multiplier, forced = action
+            rows.extend([row] * len(token_ids))
+            columns.extend(token_ids)
+            multipliers.extend([multiplier] * len(token_ids))
+            forced_entries.extend([forced] * len(token_ids))
+            if forced:
+                forced_rows.append(row)
+        if not rows:
+            return scores
+
+        rows = torch.tensor(rows, device=scores.device)
+        columns = torch.tensor(columns, device=scores.device)
+        values = scores[rows, columns] * torch.tensor(multipliers, device=scores.device, dtype=scores.dtype)
+        # Rows over budget: 0 for the marker tokens, -inf everywhere else
+        values = torch.where(torch.tensor(forced_entries, device=scores.device), 0.0, values)
+        if forced_rows:
+            scores[torch.tensor(forced_rows, device=scores.device)] = float("-inf")
+        scores[rows, columns] = values
+        return scores
+
+
+def build_tiny_random_model(vocab_size=256, seed=0, **config_overrides):
+    """
+    Returns a tiny randomly initialized Llama-style causal LM.
+
+    Nothing is downloaded, which makes it handy for exercising the processors, benchmarks and
+    tools end to end on CPU. The generated text is of course meaningless.
+
+    Args:
+        vocab_size (int, optional): Vocabulary size (default=256).
+        seed (int, optional): Seed for the random weights (default=0).
+        **config_overrides: Extra `LlamaConfig` arguments.
+    """
+    from transformers import LlamaConfig, LlamaForCausalLM
+
+    config = dict(
+        vocab_size=vocab_size,
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=4,
+        max_position_embeddings=4096,
+    )
+    config.update(config_overrides)
+    torch.manual_seed(seed)
+    return LlamaForCausalLM(LlamaConfig(**config)).eval()
+
+
+class ByteTokenizer:
+    """
+    A minimal byte-level tokenizer to pair with `build_tiny_random_model`.
+
+    Token IDs 0-255 are raw UTF-8 bytes, followed by a few special tokens. It implements the
+    small subset of the Hugging Face tokenizer API used by the tools in this repository
+    (`encode`, `decode`, `convert_tokens_to_ids`, `apply_chat_template`), with a Qwen-style
+    chat template whose generation prompt ends with `<think>`.
+    """
+
+    special_tokens = ["<think>", "</think>", "<|im_start|>", "<|im_end|>", "<|endoftext|>"]
+
+    def __init__(self):
+        self.special_token_ids = {token: 256 + index for index, token in enumerate(self.special_tokens)}
+        self.id_to_special = {index: token for token, index in self.special_token_ids.items()}
+        self.eos_token_id = self.special_token_ids["<|im_end|>"]
+        self.pad_token_id = self.special_token_ids["<|endoftext|>"]
+        self.vocab_size = 256 + len(self.special_tokens)
+
+    def __len__(self):
+        return self.vocab_size
+
+    def convert_tokens_to_ids(self, token):
+        return self.special_token_ids[token]
+
+    def encode(self, text, add_special_tokens=False):
+        # Special tokens in the text are mapped to their IDs, everything else to bytes
+        ids = []
+        position = 0
+        while position < len(text):
+            for token, index in self.special_token_ids.items():
+                if text.startswith(token, position):
+                    ids.append(index)
+                    position += len(token)
+                    break
+            else:
+                ids.extend(text[position].encode("utf-8"))
+                position += 1
+        return ids
+
+    def decode(self, ids, skip_special_tokens=False):
+        if isinstance(ids, torch.Tensor):
+            ids = ids.tolist()
+        text = ""
+        pending = bytearray()
+        for index in ids:
+            if index < 256:
+                pending.append(index)
+                continue
+            text += pending.decode("utf-8", errors="replace")
+            pending = bytearray()
+            if not skip_special_tokens and index in self.id_to_special:
+                text += self.id_to_special[index]
+        return text + pending.decode("utf-8", errors="replace")
+
+    def apply_chat_template(self, messages, add_generation_prompt=False, tokenize=True, return_tensors=None, **kwargs):
+        text = "".join(f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages)
+        if add_generation_prompt:
+            text += "<|im_start|>assistant\n<think>\n"
+        if not tokenize:
+            return text
+        ids = self.encode(text)
+        return torch.tensor([ids]) if return_tensors == "pt" else ids
+
+
+class ThinkingSplitStreamer(BaseStreamer):
+    """
+    A `generate` streamer that splits the output into "reasoning" and "content" text.
+
+    Works like `TextIteratorStreamer` (run `generate` in a thread and iterate over the
+    streamer), but yields (channel, text) pairs. The split happens on token IDs with the
+    processors' end-marker matcher (see `thinking_effort.core.ThinkingSplitter`), so it does not
+    depend on how </think> is rendered, and each channel is detokenized incrementally.
+    Batch size 1 only.
+
+    Args:
+        tokenizer: The tokenizer used to decode tokens.
+        end_thinking_token_id (int, optional): The end-of-thinking token ID.
+        end_markers (iterable, optional): Several and/or multi-token end markers instead.
+        skip_prompt (bool, optional): Skip the prompt tokens (default=True).
+        thinking (bool, optional): Whether generation starts in the thinking phase (default=True).
+        timeout (float, optional): Timeout for each item when iterating (default=None).
+        **decode_kwargs: Passed to `tokenizer.decode`.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        end_thinking_token_id=None,
+        end_markers=None,
+        skip_prompt=True,
+        thinking=True,
+        timeout=None,
+        **decode_kwargs,
+    ):
+        self.splitter = ThinkingSplitter(
+            lambda ids: tokenizer.decode(ids, **decode_kwargs), end_thinking_token_id, end_markers, thinking
+        )
+        self.skip_prompt = skip_prompt
+        self.next_tokens_are_prompt = True
+        self.timeout = timeout
+        self.queue = queue.Queue()
+        self.stop_signal = None
+
+    def put(self, value):
+        if value.dim() > 1 and value.size(0) > 1:
+            raise ValueError("ThinkingSplitStreamer only supports batch size 1")
+        if self.skip_prompt and self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            return
+        for token in value.reshape(-1).tolist():
+            for piece in self.splitter.feed(token):
+                self.queue.put(piece, timeout=self.timeout)
+
+    def end(self):
+        for piece in self.splitter.finish():
+            self.queue.put(piece, timeout=self.timeout)
+        self.next_tokens_are_prompt = True
+        self.queue.put(self.stop_signal, timeout=self.timeout)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        value = self.queue.get(timeout=self.timeout)
+        if value == self.stop_signal:
+            raise StopIteration()
+        return value
+
+
+class ThinkingEndStoppingCriteria(StoppingCriteria):
+    """
+    Stops each row of `generate` as soon as it leaves the thinking phase, as detected by an
+    `IncrementalThinkingEffortProcessor` (single or multi-token end markers alike).
+
+    Args:
+        processor (IncrementalThinkingEffortProcessor): The processor used for the same `generate` call.
+    """
+
+    def __init__(self, processor):
+        self.processor = processor
+
+    def __call__(self, input_ids: torch.LongTensor, scores, **kwargs) -> torch.BoolTensor:
+        return self.processor.peek_finished(input_ids)
+
+
+class PhasedGenerationOutput:
+    """
+    The result of `generate_with_answer_lookup`.
+
+    Attributes:
+        sequences (list of torch.LongTensor): One 1-D tensor per row (prompt, thinking and
+            answer), without padding.
+        thinking_lengths (list of int or None): Generated tokens up to and including the end
+            marker, or None for rows that never left the thinking phase.
+        answer_tokens (int): Tokens generated in the answer phase, over all rows.
+        answer_seconds (float): Wall time spent in the answer phase, over all rows.
+    """
+
+    def __init__(self, sequences, thinking_lengths, answer_tokens, answer_seconds):
+        self.sequences = sequences
+        self.thinking_lengths = thinking_lengths
+        self.answer_tokens = answer_tokens
+        self.answer_seconds = answer_seconds
+
+    @property
+    def answer_tokens_per_second(self):
+        return self.answer_tokens / self.answer_seconds if self.answer_seconds else 0.0
+
+
+def _row_cache(model, cache, row, start, length):
+    # Positions [start, length) of one row of a batched DynamicCache, as a new single-row cache
+    row_cache = DynamicCache(config=model.config)
+    for layer_index, layer in enumerate(cache.layers):
+        row_cache.update(
+            layer.keys[row : row + 1, :, start:length], layer.values[row : row + 1, :, start:length], layer_index
+        )
+    return row_cache
+
+
+_LOOKUP_ANSWER_KWARGS = {"do_sample", "temperature", "top_k", "top_p", "eos_token_id", "pad_token_id"}
+
+
+def _lookup_draft(tokens, num_tokens, max_ngram_size=2):
+    # Transformers' prompt-lookup drafting: the tokens following the earliest earlier occurrence
+    # of the sequence's last n-gram, trying the longest n-gram first
+    length = tokens.size(0)
+    for size in range(min(max_ngram_size, length - 1), 0, -1):
+        matches = (tokens.unfold(0, size, 1) == tokens[-size:]).all(dim=1).nonzero().flatten().tolist()
+        for start in matches:
+            if start + size < length:
+                return tokens[start + size : start + size + num_tokens]
+    return tokens[:0]
+
+
+def _prompt_lookup_decode(model, tokens, cache, max_new_tokens, num_tokens, generation_config):
+    # Prompt-lookup decoding of one sequence continuing from `cache`, which holds every token but
+    # the last: each step verifies the pending token plus a draft in one forward pass and keeps the
+    # draft tokens up to the first one the model would not have chosen
+    eos_token_ids = generation_config.eos_token_id
+    if eos_token_ids is None:
+        eos_token_ids = []
+    elif isinstance(eos_token_ids, int):
+        eos_token_ids = [eos_token_ids]
+    warpers = []
+    if generation_config.do_sample:
+        if generation_config.temperature is not None and generation_config.temperature != 1.0:
+            warpers.append(TemperatureLogitsWarper(generation_config.temperature))
+        if generation_config.top_k:
+            warpers.append(TopKLogitsWarper(generation_config.top_k))
+        if generation_config.top_p is not None and generation_config.top_p < 1.0:
+            warpers.append(TopPLogitsWarper(generation_config.top_p))
+
+    prompt_length = tokens.size(0)
+    while tokens.size(0) - prompt_length < max_new_tokens:
+        budget = max_new_tokens - (tokens.size(0) - prompt_length)
+        draft = _lookup_draft(tokens, num_tokens)[: budget - 1]
+        cached = cache.get_seq_length()
+        logits = model(torch.cat([tokens[-1:], draft])[None], past_key_values=cache, use_cache=True).logits[0]
+        if generation_config.do_sample:
+            for warper in warpers:
+                logits = warper(None, logits)
+            chosen = torch.multinomial(logits.float().softmax(dim=-1), 1).flatten()
+        else:
+            chosen = logits.argmax(dim=-1)
+        accepted = int((chosen[:-1] == draft).cumprod(dim=0).sum())
+        new_tokens = chosen[: accepted + 1]
+        for index, token in enumerate(new_tokens.tolist()):
+            if token in eos_token_ids:
+                new_tokens = new_tokens[: index + 1]
+                break
+        tokens = torch.cat([tokens, new_tokens])
+        if new_tokens[-1].item() in eos_token_ids:
+            break
+        # Keep the verified tokens; the newest one is fed with the next draft
+        excess = cache.get_seq_length() - (cached + new_tokens.size(0))
+        if excess > 0:
+            cache.crop(-excess)
+    return tokens
+
+
+def generate_with_answer_lookup(
+    model,
+    input_ids,
+    processor,
+    attention_mask=None,
+    max_new_tokens=1024,
+    prompt_lookup_num_tokens=10,
+    thinking_kwargs=None,
+    answer_kwargs=None,
+):
+    """
+    Generates in two phases, switching each sequence to prompt-lookup decoding once it leaves
+    the thinking phase.
+
+    1. Thinking: the whole batch runs `model.generate` with `processor`; each row stops as soon
+       as the processor sees its end marker (`ThinkingEndStoppingCriteria`).
+    2. Answer: each finished row continues from its own slice of the phase-1 KV cache with
+       `prompt_lookup_num_tokens`, i.e. n-gram speculative decoding whose drafts come from the
+       row's own prompt and thinking tokens, which the answer usually restates. The answer phase
+       uses its own sampling parameters and no effort processor.
+
+    The answer phase runs row by row. Each row gets a single-row copy of its part of the
+    phase-1 cache, without the row's left padding, so nothing is prefilled again. `generate`
+    cannot start prompt-lookup decoding from a filled cache, because its first verification
+    step re-encodes the whole input. The answer phase therefore runs its own prompt-lookup loop:
+    the same n-gram drafts as Transformers, accepted up to the first token the model would not
+    have chosen. That loop supports greedy decoding and sampling with `temperature`, `top_k` and
+    `top_p`. With any other `answer_kwargs`, `generate` is called with
+    `prompt_lookup_num_tokens`, and the row's prompt and thinking tokens are prefilled again.
+
+    Args:
+        model: A Hugging Face causal LM.
+        input_ids (torch.LongTensor): Prompts, shape (batch_size, seq_length), left-padded.
+        processor (IncrementalThinkingEffortProcessor): Controls the thinking phase.
+        attention_mask (torch.LongTensor, optional): Mask for padded prompts.
+        max_new_tokens (int, optional): Budget per row for thinking and answer together (default=1024).
+        prompt_lookup_num_tokens (int, optional): Draft length for prompt lookup (default=10).
+            None continues with plain decoding from the phase-1 cache.
+        thinking_kwargs (dict, optional): Extra `generate` arguments for the thinking phase.
+        answer_kwargs (dict, optional): Extra `generate` arguments (sampling parameters,
+            eos_token_id, ...) for the answer phase.
+
+    Returns:
+        PhasedGenerationOutput
+    """
+    thinking_kwargs = dict(thinking_kwargs or {})
+    answer_kwargs = dict(answer_kwargs or {})
+    if attention_mask is None:
+        attention_mask = torch.ones_like(input_ids)
+
+    processor.reset()
+    with torch.no_grad():
+        thinking = model.generate(
+            input_ids,
+            attention_mask=attention_mask,
+            max_new_tokens=max_new_tokens,
+            logits_processor=[processor],
+            stopping_criteria=[ThinkingEndStoppingCriteria(processor)],
+            return_dict_in_generate=True,
+            **thinking_kwargs,
+        )
+
+    config = copy.deepcopy(model.generation_config)
+    config.update(**answer_kwargs)
+    cached_lookup = set(answer_kwargs) <= _LOOKUP_ANSWER_KWARGS
+
+    prompt_length = input_ids.size(1)
+    cache = thinking.past_key_values
+    sequences, thinking_lengths = [], []
+    answer_tokens, answer_seconds = 0, 0.0
+    for row in range(input_ids.size(0)):
+        padding = int((attention_mask[row] == 0).sum())
+        generated = thinking.sequences[row, prompt_length:].tolist()
+        context = input_ids[row, max(0, prompt_length - processor.matcher.max_length) :].tolist()
+        thinking_length = processor.matcher.find_end(generated, context)
+        thinking_lengths.append(thinking_length)
+        if thinking_length is None or thinking_length >= max_new_tokens:
+            sequences.append(thinking.sequences[row, padding:])
+            continue
+
+        row_length = prompt_length + thinking_length
+        row_ids = thinking.sequences[row : row + 1, padding:row_length]
+        if prompt_lookup_num_tokens is None or cached_lookup:
+            # This row's slice of the shared cache, cut right before its last token
+            row_cache = _row_cache(model, cache, row, padding, row_length - 1)
+            phase_kwargs = {"past_key_values": row_cache}
+        else:
+            phase_kwargs = {"prompt_lookup_num_tokens": prompt_lookup_num_tokens}
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            if prompt_lookup_num_tokens is not None and cached_lookup:
+                answer = _prompt_lookup_decode(
+                    model, row_ids[0], row_cache, max_new_tokens - thinking_length, prompt_lookup_num_tokens, config
+                )
+            else:
+                answer = model.generate(
+                    row_ids,
+                    attention_mask=torch.ones_like(row_ids),
+                    max_new_tokens=max_new_tokens - thinking_length,
+                    **phase_kwargs,
+                    **answer_kwargs,
+                )[0]
+        answer_seconds += time.perf_counter() - start
+        answer_tokens += answer.size(0) - row_ids.size(1)
+        sequences.append(answer)
+
+    return PhasedGenerationOutput(sequences, thinking_lengths, answer_tokens, answer_seconds)
+
+
+class BranchStreamer(BaseStreamer):
+    """
+    A `generate` streamer that reports the tokens of each row separately, as
+    `callback(branch, token_id)`. Rows stop being reported after their EOS token, so padding
+    added once a row has finished is never streamed.
+
+    Args:
+        callback (callable): Called with the row index and the new token ID.
+        eos_token_id (int or list of int, optional): The EOS token(s) ending a row.
+    """
+
+    def __init__(self, callback, eos_token_id=None):
+        self.callback = callback
+        if eos_token_id is None:
+            eos_token_id = []
+        self.eos_token_ids = {eos_token_id} if isinstance(eos_token_id, int) else set(eos_token_id)
+        self.done = None
+        self.prompt_seen = False
+
+    def put(self, value):
+        # The first call carries the prompt
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        tokens = value.reshape(-1).tolist()
+        if self.done is None:
+            self.done = [False] * len(tokens)
+        for branch, token in enumerate(tokens):
+            if self.done[branch]:
+                continue
+            self.callback(branch, token)
+            self.done[branch] = token in self.eos_token_ids
+
+    def end(self):
+        pass
+
+
+def generate_effort_fanout(
+    model,
+    input_ids,
+    thinking_efforts,
+    end_thinking_token_id,
+    attention_mask=None,
+    scale_factor=2,
+    callback=None,
+    processor_kwargs=None,
+    **generate_kwargs,
+):
+    """
+    Runs one prompt at several thinking efforts, ingesting the prompt only once.
+
+    The prompt is prefilled into a KV cache for a single row, the cache is then forked into one
+    row per effort (`DynamicCache.batch_repeat_interleave`) and all branches are decoded by one
+    batched `generate` call. Each branch gets its own processor state (the per-row efforts of
+    `IncrementalThinkingEffortProcessor`), so branches stop thinking independently.
+
+    Args:
+        model: A Hugging Face causal LM.
+        input_ids (torch.LongTensor): The prompt, shape (1, seq_length).
+        thinking_efforts (list of float): One thinking effort per branch.
+        end_thinking_token_id (int): The token ID marking the end of thinking.
+        attention_mask (torch.LongTensor, optional): Mask of the prompt.
+        scale_factor (float or list, optional): Shared or per-branch scale factor (default=2).
+        callback (callable, optional): Streams results as `callback(branch, token_id)` while
+            generating (see `BranchStreamer`).
+        processor_kwargs (dict, optional): Extra `IncrementalThinkingEffortProcessor` arguments,
+            e.g. `max_thinking_tokens` or `end_markers`.
+        **generate_kwargs: Passed to `model.generate` (max_new_tokens, sampling parameters, ...).
+
+    Returns:
+        list of torch.LongTensor: The generated tokens of each branch, in the order of
+        `thinking_efforts`, cut after the first EOS token.
+    """
+    if input_ids.size(0) != 1:
+        raise ValueError("generate_effort_fanout expects a single prompt (batch size 1)")
+    branches = len(thinking_efforts)
+    if attention_mask is None:
+        attention_mask = torch.ones_like(input_ids)
+
+    # Prefill everything but the last prompt token, which `generate` feeds itself
+    cache = DynamicCache(config=model.config)
+    if input_ids.size(1) > 1:
+        with torch.no_grad():
+            model(input_ids[:, :-1], attention_mask=attention_mask[:, :-1], past_key_values=cache, use_cache=True)
+        cache.batch_repeat_interleave(branches)
+
+    processor = IncrementalThinkingEffortProcessor(
+        end_thinking_token_id,
+        thinking_effort=list(thinking_efforts),
+        scale_factor=scale_factor,
+        **(processor_kwargs or {}),
+    )
+    eos_token_id = generate_kwargs.get("eos_token_id", model.generation_config.eos_token_id)
+    if callback is not None:
+        generate_kwargs["streamer"] = BranchStreamer(callback, eos_token_id)
+
+    with torch.no_grad():
+        sequences = model.generate(
+            input_ids.expand(branches, -1),
+            attention_mask=attention_mask.expand(branches, -1),
+            past_key_values=cache,
+            logits_processor=[processor],
+            **generate_kwargs,
+        )
+
+    eos_token_ids = [] if eos_token_id is None else [eos_token_id] if isinstance(eos_token_id, int) else eos_token_id
+    results = []
+    for generated in sequences[:, input_ids.size(1) :]:
+        is_eos = torch.isin(generated, torch.tensor(eos_token_ids, device=generated.device, dtype=generated.dtype))
+        if is_eos.any():
+            generated = generated[: int(is_eos.int().argmax()) + 1]
+        results.append(generated)
+    return results
+
+
+class _FirstTokenTimer(BaseStreamer):
+    # Records when `generate` emits its first new token (the first `put` is the prompt), and
+    # forwards everything to an optional user streamer
+    def __init__(self, streamer=None):
+        self.streamer = streamer
+        self.first_token_time = None
+        self._prompt_seen = False
+
+    def put(self, value):
+        if self._prompt_seen and self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self._prompt_seen = True
+        if self.streamer is not None:
+            self.streamer.put(value)
+
+    def end(self):
+        if self.streamer is not None:
+            self.streamer.end()
+
+
+class ThinkingChatSession:
+    """
+    A multi-turn chat with thinking-effort control that keeps only the answers of earlier turns
+    in the history, while keeping the KV cache warm.
+
+    Chat templates of thinking models drop the thinking of earlier assistant turns, so the
+    rendered conversation is not a continuation of the previous turn's tokens and a plain
+    `generate` call re-ingests the whole history every turn. The session keeps the KV cache of
+    the previous turn, crops it to the longest prefix it shares with the new prompt (everything
+    up to the previous assistant turn's opening, i.e. right before its thinking) and only
+    prefills the rest: the previous answer and the new message. Each turn records where its
+    </think> boundary was (see `thinking_effort.core.ChatTurn`).
+
+    Args:
+        model: A Hugging Face causal LM.
+        tokenizer: Its tokenizer; the prompt is rendered with `apply_chat_template`.
+        end_thinking_token_id (int, optional): The end-of-thinking token ID. May be None when
+            `processor_kwargs` has `end_markers`.
+        thinking_effort (float, optional): Default effort of the turns (default=1.0).
+        scale_factor (float, optional): Default scale factor of the turns (default=2).
+        messages (list of dict, optional): Initial history, e.g. a system message.
+        reuse_cache (bool, optional): Keep the KV cache across turns (default=True). False
+            re-ingests the whole conversation every turn, as a baseline.
+        processor_kwargs (dict, optional): Default `IncrementalThinkingEffortProcessor` arguments
+            (max_thinking_tokens, end_markers, ...).
+        **generate_kwargs: Default `model.generate` arguments (max_new_tokens, sampling
+            parameters, ...).
+
+    Attributes:
+        messages (list of dict): The answer-only history.
+        turns (list of ChatTurn): One record per completed turn.
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        end_thinking_token_id=None,
+        thinking_effort=1.0,
+        scale_factor=2,
+        messages=None,
+        reuse_cache=True,
+        processor_kwargs=None,
+        **generate_kwargs,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.end_thinking_token_id = end_thinking_token_id
+        self.thinking_effort = thinking_effort
+        self.scale_factor = scale_factor
+        self.reuse_cache = reuse_cache
+        self.processor_kwargs = dict(processor_kwargs or {})
+        self.generate_kwargs = generate_kwargs
+        self.reset(messages)
+
+    def reset(self, messages=None):
+        """Starts a new conversation, dropping the history and the KV cache."""
+        self.messages = list(messages or [])
+        self.turns = []
+        self._cache = None
+        self._cached_ids = []
+
+    def _decode(self, ids):
+        return self.tokenizer.decode(ids, skip_special_tokens=True)
+
+    def send(self, content, thinking_effort=None, processor_kwargs=None, **generate_kwargs):
+        """
+        Adds a user message, generates the assistant turn and appends its answer to the history.
+
+        Args:
+            content (str): The user message.
+            thinking_effort (float, optional): Effort of this turn (default: the session's).
+            processor_kwargs (dict, optional): Processor arguments overriding the session's.
+            **generate_kwargs: `model.generate` arguments overriding the session's.
+
+        Returns:
+            ChatTurn
+        """
+        start = time.perf_counter()
+        messages = self.messages + [{"role": "user", "content": content}]
+        text = self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+        prompt_ids = self.tokenizer.encode(text, add_special_tokens=False)
+
+        # At least the last prompt token is fed again, for fresh logits
+        reused = 0
+        cache = None
+        if self.reuse_cache and self._cache is not None:
+            reused = min(longest_common_prefix(self._cached_ids, prompt_ids), len(prompt_ids) - 1)
+            if reused:
+                cache = self._cache
+                excess = cache.get_seq_length() - reused
+                if excess > 0:
+                    cache.crop(-excess)
+        if cache is None:
+            cache = DynamicCache(config=self.model.config)
+
+        processor = IncrementalThinkingEffortProcessor(
+            self.end_thinking_token_id,
+            thinking_effort=self.thinking_effort if thinking_effort is None else thinking_effort,
+            scale_factor=self.scale_factor,
+            **{**self.processor_kwargs, **(processor_kwargs or {})},
+        )
+        generate_kwargs = {**self.generate_kwargs, **generate_kwargs}
+        eos_token_id = generate_kwargs.get("eos_token_id", self.model.generation_config.eos_token_id)
+        if eos_token_id is None:
+            eos_token_id = generate_kwargs["eos_token_id"] = getattr(self.tokenizer, "eos_token_id", None)
+        timer = _FirstTokenTimer(generate_kwargs.pop("streamer", None))
+
+        input_ids = torch.tensor([prompt_ids], device=self.model.device)
+        with torch.no_grad():
+            output = self.model.generate(
+                input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=cache,
+                logits_processor=[processor],
+                streamer=timer,
+                return_dict_in_generate=True,
+                **generate_kwargs,
+            )
+        seconds = time.perf_counter() - start
+
+        generated = output.sequences[0, len(prompt_ids) :].tolist()
+        eos_token_ids = [] if eos_token_id is None else [eos_token_id] if isinstance(eos_token_id, int) else eos_token_id
+        for index, token in enumerate(generated):
+            if token in eos_token_ids:
+                generated = generated[: index + 1]
+                break
+        if self.reuse_cache:
+            self._cache = output.past_key_values
+            self._cached_ids = output.sequences[0, : self._cache.get_seq_length()].tolist()
+
+        first_token_time = timer.first_token_time or time.perf_counter()
+        turn = ChatTurn.from_generation(
+            processor.matcher, prompt_ids, reused, generated, self._decode, first_token_time - start, seconds
+        )
+        self.messages = messages + [{"role": "assistant", "content": turn.answer}]
+        self.turns.append(turn)
+        return turn